@@ -37,24 +37,112 @@
 #
 # Copyright (c) 2025 Rafael Sanchez.  All rights reserved.
 
+import click
 from flask import Flask
 from chatgpt_api.api.conversacion import conversacion_bp
 from chatgpt_api.api.mensaje import mensaje_bp
 from chatgpt_api.api.modelo import modelo_bp
 from chatgpt_api.api.contexto import contexto_bp
-from chatgpt_api.db import init_app
+from chatgpt_api.api.cache import cache_bp
+from chatgpt_api.api.trabajo import trabajo_bp
+from chatgpt_api.api.busqueda import busqueda_bp
+from chatgpt_api.api.exportacion import exportacion_bp
+from chatgpt_api.api.metricas import metricas_bp, instrumentar_app
+from chatgpt_api.api.perfilado import activar_perfilado
+from chatgpt_api.db import init_app, db_session
+from chatgpt_api.migraciones import aplicar_migraciones, rellenar_pendientes, version_actual
+from chatgpt_api.services.modelos_service import registro_modelos
+from chatgpt_api.services.trabajos_service import pool_trabajos
+from chatgpt_api.services import archivo_service
 import logging
-logging.basicConfig(level=logging.DEBUG)
+import os
+import threading
+
+'''! @brief Nivel de los logs (DEBUG, INFO, WARNING...); con DEBUG se registran también los detalles de cada petición'''
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+logging.basicConfig(level=LOG_LEVEL)
+
+'''! @brief Si es distinto de "0", las migraciones pendientes se aplican al crear la aplicación'''
+MIGRAR_AL_ARRANCAR = os.getenv('MIGRAR_AL_ARRANCAR', '1') != '0'
+
+def _imprimir_informe():
+    """! @brief Muestra el informe de `archivo_service.informe` (comandos `archivar` y `archivo`)."""
+    informe = archivo_service.informe(db_session)
+    ratio = informe.bytes_originales / informe.bytes_comprimidos if informe.bytes_comprimidos else 0
+    print(f"Conversaciones archivadas: {informe.conversaciones}")
+    print(f"Mensajes archivados:       {informe.mensajes}")
+    print(f"Tamaño archivado:          {informe.bytes_originales / 1e6:.1f} MB -> "
+          f"{informe.bytes_comprimidos / 1e6:.1f} MB (x{ratio:.1f})")
+    print(f"Mensajes activos:          {informe.mensajes_activos}")
+    if informe.bytes_fichero is not None:
+        print(f"Fichero de la base de datos: {informe.bytes_fichero / 1e6:.1f} MB "
+              f"({informe.bytes_libres / 1e6:.1f} MB libres, recuperables con --vacuum)")
+
+_servicios_lock = threading.Lock()
+_servicios_iniciados = False
+
+def iniciar_servicios():
+    """
+    @brief Arranca los hilos de fondo del proceso: el pool de trabajos y el refresco de modelos.
+
+    @details
+    Sólo deben arrancarse en los procesos que atienden peticiones: un comando de la CLI
+    (`flask migrar`, `flask archivar`...) podría tomar un trabajo pendiente y terminar a
+    mitad de la generación. `create_app` los arranca con la primera petición, y `asgi.py`
+    al recibir `lifespan.startup`. Sólo tiene efecto la primera llamada.
+    """
+    global _servicios_iniciados
+    if _servicios_iniciados:
+        return
+    with _servicios_lock:
+        if not _servicios_iniciados:
+            registro_modelos.iniciar_refresco_periodico()
+            pool_trabajos.iniciar()
+            _servicios_iniciados = True
 
 def create_app():
     """! Inicializar el programa """
     app = Flask(__name__)
     init_app(app)
+    if MIGRAR_AL_ARRANCAR:
+        aplicar_migraciones()
+    app.before_request(iniciar_servicios)
+
+    @app.cli.command('migrar')
+    def migrar():
+        """Aplica las migraciones pendientes del esquema de la base de datos."""
+        versiones = aplicar_migraciones()
+        print(f"Migraciones aplicadas: {versiones or 'ninguna'}. Versión del esquema: {version_actual()}")
+        print(f"Tokens calculados de {rellenar_pendientes()} mensajes existentes.")
+
+    @app.cli.command('archivar')
+    @click.option('--dias', default=archivo_service.ARCHIVO_DIAS, show_default=True, help='Días sin mensajes.')
+    @click.option('--vacuum', is_flag=True, help='Ejecutar VACUUM después (SQLite; bloquea las escrituras).')
+    def archivar(dias, vacuum):
+        """Archiva comprimidos los mensajes de las conversaciones inactivas."""
+        resultado = archivo_service.archivar(db_session, dias)
+        print(f"Archivadas {resultado.conversaciones} conversaciones ({resultado.mensajes} mensajes): "
+              f"{resultado.bytes_originales / 1e6:.1f} MB -> {resultado.bytes_comprimidos / 1e6:.1f} MB")
+        if vacuum and archivo_service.compactar():
+            print("VACUUM completado")
+        _imprimir_informe()
+
+    @app.cli.command('archivo')
+    def archivo():
+        """Muestra el estado del archivo de mensajes."""
+        _imprimir_informe()
 
     app.register_blueprint(conversacion_bp)
     app.register_blueprint(mensaje_bp)
     app.register_blueprint(modelo_bp)
     app.register_blueprint(contexto_bp)
+    app.register_blueprint(cache_bp)
+    app.register_blueprint(trabajo_bp)
+    app.register_blueprint(busqueda_bp)
+    app.register_blueprint(exportacion_bp)
+    app.register_blueprint(metricas_bp)
+    instrumentar_app(app)
+    activar_perfilado(app)
 
     return app
 
@@ -0,0 +1,231 @@
+"""! @brief Punto de entrada ASGI de la aplicación FlaskChat"""
+##
+# @file asgi.py
+#
+# @brief Aplicación ASGI que atiende los endpoints de chat de forma asíncrona.
+#
+# @section description_asgi Descripción
+# `POST /api/chat/<id>` y `POST /api/chat/<id>/stream` se sirven con los manejadores
+# asíncronos de `chatgpt_api.api.mensaje_async`, de forma que las peticiones en curso
+# a OpenAI no ocupan un hilo cada una. El resto de rutas se delegan en la aplicación
+# Flask de `create_app()` con `AdaptadorWSGI`, que las ejecuta en un pool de
+# `ASGI_HILOS` hilos: una exportación o una búsqueda lenta no bloquea a las demás.
+#
+# Las rutas asíncronas no pasan por los hooks de Flask, así que sus peticiones se
+# registran aquí en las métricas de `/metrics` (con la misma etiqueta `ruta`).
+#
+# La aplicación no tiene websockets: las conexiones websocket se rechazan en el
+# handshake (el servidor responde 403) y cualquier otro tipo de `scope` es un error.
+#
+# @section usage_asgi Uso
+# @code
+# uvicorn asgi:app --host 0.0.0.0 --port 5000
+# @endcode
+import asyncio
+import contextvars
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from app import create_app, iniciar_servicios
+from chatgpt_api.api import mensaje_async
+from chatgpt_api.services.metricas_service import registrar_peticion
+
+'''! @brief Rutas de chat atendidas de forma asíncrona'''
+RUTA_CHAT = re.compile(r'^/api/chat/(\d+)(/stream)?/?$')
+
+'''! @brief Hilos que atienden a la vez las peticiones delegadas en la aplicación Flask'''
+ASGI_HILOS = int(os.getenv('ASGI_HILOS', '20'))
+
+'''! @brief Bytes del cuerpo de la petición que se guardan en memoria antes de pasar a un fichero temporal'''
+CUERPO_EN_MEMORIA = 64 * 1024
+
+
+def _acepta_sse(scope):
+    """! @brief Indica si la petición pide la respuesta como `text/event-stream`."""
+    for nombre, valor in scope.get('headers', []):
+        if nombre == b'accept' and b'text/event-stream' in valor:
+            return True
+    return False
+
+
+def _prefiere_asincrono(scope):
+    """! @brief Indica si la petición pide un trabajo en segundo plano (`Prefer: respond-async`)."""
+    for nombre, valor in scope.get('headers', []):
+        if nombre == b'prefer' and b'respond-async' in valor:
+            return True
+    return False
+
+
+async def _medir(manejador, ruta, id, receive, send):
+    """! @brief Ejecuta un manejador asíncrono y registra la petición en las métricas."""
+    inicio = time.perf_counter()
+    estado = 500
+
+    async def enviar(mensaje):
+        nonlocal estado
+        if mensaje['type'] == 'http.response.start':
+            estado = mensaje['status']
+        await send(mensaje)
+
+    try:
+        return await manejador(id, receive, enviar)
+    finally:
+        registrar_peticion('POST', ruta, estado, time.perf_counter() - inicio)
+
+
+def _environ(scope, cuerpo):
+    """! @brief Construye el `environ` WSGI de una petición HTTP de ASGI."""
+    raiz = scope.get('root_path', '')
+    ruta = scope['path']
+    if raiz and ruta.startswith(raiz):
+        ruta = ruta[len(raiz):]
+    servidor = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': raiz.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': ruta.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': servidor[0],
+        'SERVER_PORT': str(servidor[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': cuerpo,
+        'wsgi.input_terminated': True,  # El cuerpo está completo: se puede leer sin Content-Length
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for nombre, valor in scope.get('headers', []):
+        nombre = nombre.decode('latin-1').upper().replace('-', '_')
+        if nombre not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            nombre = f"HTTP_{nombre}"
+        valor = valor.decode('latin-1')
+        environ[nombre] = f"{environ[nombre]},{valor}" if nombre in environ else valor
+    return environ
+
+
+async def _rechazar_websocket(receive, send):
+    """! @brief Rechaza una conexión websocket durante el handshake."""
+    evento = await receive()
+    if evento['type'] == 'websocket.connect':
+        await send({'type': 'websocket.close', 'code': 1008})
+
+
+class AdaptadorWSGI:
+    """
+    @brief Sirve una aplicación WSGI como ASGI, ejecutando cada petición en un pool de hilos.
+
+    @details
+    El cuerpo de la petición se lee en el bucle de eventos y la aplicación se ejecuta en
+    uno de los `hilos` del pool, con una copia del contexto de la petición (como
+    `asyncio.to_thread`), de modo que las variables de contexto de una petición no pasan
+    a la siguiente que use el mismo hilo. Cada fragmento de la respuesta se envía al
+    cliente desde el hilo a través del bucle. Al terminar (o si el cliente se desconecta)
+    se llama a `close()` de la respuesta, como exige WSGI.
+
+    @param aplicacion Aplicación WSGI.
+    @param hilos Número máximo de peticiones atendidas a la vez.
+    """
+
+    def __init__(self, aplicacion, hilos=ASGI_HILOS):
+        self.aplicacion = aplicacion
+        self.ejecutor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='flask')
+
+    async def __call__(self, scope, receive, send):
+        with SpooledTemporaryFile(max_size=CUERPO_EN_MEMORIA) as cuerpo:
+            while True:
+                mensaje = await receive()
+                if mensaje['type'] == 'http.disconnect':
+                    return
+                cuerpo.write(mensaje.get('body', b''))
+                if not mensaje.get('more_body'):
+                    break
+            cuerpo.seek(0)
+            bucle = asyncio.get_running_loop()
+            contexto = contextvars.copy_context()
+            await bucle.run_in_executor(self.ejecutor, contexto.run, self._atender, scope, cuerpo, send, bucle)
+
+    def _atender(self, scope, cuerpo, send, bucle):
+        """! @brief Ejecuta la aplicación WSGI (en un hilo del pool) y envía la respuesta."""
+        def enviar(mensaje):
+            asyncio.run_coroutine_threadsafe(send(mensaje), bucle).result()
+
+        inicio = {}
+
+        def start_response(estado, cabeceras, exc_info=None):
+            if exc_info and inicio.get('enviado'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            inicio['mensaje'] = {
+                'type': 'http.response.start',
+                'status': int(estado.split(' ', 1)[0]),
+                'headers': [(nombre.lower().encode('latin-1'), valor.encode('latin-1')) for nombre, valor in cabeceras],
+            }
+
+        respuesta = self.aplicacion(_environ(scope, cuerpo), start_response)
+        try:
+            for fragmento in respuesta:
+                if not inicio.get('enviado'):
+                    enviar(inicio['mensaje'])
+                    inicio['enviado'] = True
+                if fragmento:
+                    enviar({'type': 'http.response.body', 'body': fragmento, 'more_body': True})
+            if not inicio.get('enviado'):
+                enviar(inicio['mensaje'])
+            enviar({'type': 'http.response.body'})
+        finally:
+            if hasattr(respuesta, 'close'):
+                respuesta.close()
+
+
+def create_asgi_app(flask_app=None):
+    """
+    @brief Crea la aplicación ASGI.
+
+    @param flask_app Aplicación Flask a la que se delegan las rutas síncronas.
+    Si no se indica, se crea con `create_app()`.
+
+    @return
+    - Callable ASGI.
+    """
+    flask_app = flask_app or create_app()
+    wsgi = AdaptadorWSGI(flask_app)
+
+    async def aplicacion(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                evento = await receive()
+                if evento['type'] == 'lifespan.startup':
+                    iniciar_servicios()
+                    await send({'type': 'lifespan.startup.complete'})
+                elif evento['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+
+        if scope['type'] == 'websocket':
+            return await _rechazar_websocket(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError(f"Tipo de conexión ASGI no soportado: {scope['type']}")
+
+        if scope['method'] == 'POST':
+            ruta = RUTA_CHAT.match(scope['path'])
+            # Encolar un trabajo es inmediato: lo atiende la aplicación Flask
+            if ruta and not _prefiere_asincrono(scope):
+                id = int(ruta.group(1))
+                plantilla = '/api/chat/<int:id>/stream' if ruta.group(2) else '/api/chat/<int:id>'
+                if ruta.group(2) or _acepta_sse(scope):
+                    return await _medir(mensaje_async.enviar_mensaje_stream, plantilla, id, receive, send)
+                return await _medir(mensaje_async.enviar_mensaje, plantilla, id, receive, send)
+
+        await wsgi(scope, receive, send)
+
+    return aplicacion
+
+
+app = create_asgi_app()
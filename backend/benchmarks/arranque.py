@@ -0,0 +1,112 @@
+"""! @brief Medición del tiempo de arranque en frío de la aplicación"""
+##
+# @file arranque.py
+#
+# @brief Lanza varios procesos nuevos que importan `app` y llaman a `create_app()`,
+# y muestra la mediana, el mínimo y el máximo del tiempo de arranque.
+#
+# @section description_arranque Descripción
+# Cada repetición es un intérprete nuevo, de modo que se mide el arranque real
+# (importaciones incluidas) y no el de un proceso con los módulos ya cargados.
+# En el proceso hijo se sustituye `socket.connect` para contar las conexiones de red
+# abiertas durante el arranque desde el hilo principal (deberían ser cero: la lista de
+# modelos se lee del disco y se refresca en segundo plano).
+#
+# Con `--importaciones N` se muestran además los N módulos que más tardan en importarse
+# (según `python -X importtime`).
+#
+# @code
+# Uso (desde backend/):
+# python benchmarks/arranque.py
+# python benchmarks/arranque.py --repeticiones 20 --importaciones 15
+# @endcode
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+'''! @brief Directorio `backend/`, desde el que se importa la aplicación'''
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+'''! @brief Código que ejecuta cada proceso hijo; imprime una línea JSON con los resultados'''
+CODIGO_HIJO = r'''
+import json, socket, threading, time
+conexiones = []
+_connect = socket.socket.connect
+def connect(self, direccion):
+    if threading.current_thread() is threading.main_thread() and self.family != socket.AF_UNIX:
+        conexiones.append(repr(direccion))
+    return _connect(self, direccion)
+socket.socket.connect = connect
+inicio = time.perf_counter()
+from app import create_app
+importado = time.perf_counter()
+create_app()
+fin = time.perf_counter()
+print(json.dumps({"importar": importado - inicio, "create_app": fin - importado, "total": fin - inicio, "conexiones": conexiones}))
+'''
+
+
+def medir(repeticiones):
+    """
+    @brief Ejecuta `repeticiones` arranques en procesos nuevos.
+    @param repeticiones Número de procesos a lanzar.
+    @return Lista de diccionarios con `importar`, `create_app`, `total` (segundos) y `conexiones`.
+    """
+    resultados = []
+    for _ in range(repeticiones):
+        salida = subprocess.run(
+            [sys.executable, '-c', CODIGO_HIJO], cwd=BACKEND,
+            capture_output=True, text=True, check=True,
+        ).stdout
+        resultados.append(json.loads(salida.strip().splitlines()[-1]))
+    return resultados
+
+
+def importaciones_lentas(cantidad):
+    """
+    @brief Devuelve los módulos que más tardan en importarse al cargar `app`.
+    @param cantidad Número de módulos a devolver.
+    @return Lista de tuplas `(microsegundos acumulados, módulo)`, de mayor a menor.
+    """
+    salida = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'from app import create_app'],
+        cwd=BACKEND, capture_output=True, text=True, check=True,
+    ).stderr
+    modulos = []
+    for linea in salida.splitlines():
+        if not linea.startswith('import time:') or 'cumulative' in linea:
+            continue
+        _, acumulado, modulo = linea.split('|')
+        modulos.append((int(acumulado), modulo.strip()))
+    return sorted(modulos, reverse=True)[:cantidad]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tiempo de arranque en frío de create_app()')
+    parser.add_argument('--repeticiones', type=int, default=10)
+    parser.add_argument('--importaciones', type=int, default=0, help='Mostrar los N módulos más lentos de importar')
+    args = parser.parse_args()
+
+    resultados = medir(args.repeticiones)
+    for campo in ('importar', 'create_app', 'total'):
+        tiempos = [r[campo] * 1000 for r in resultados]
+        print(f"{campo:<11} mediana {statistics.median(tiempos):8.1f} ms   "
+              f"mín {min(tiempos):8.1f} ms   máx {max(tiempos):8.1f} ms")
+
+    conexiones = sorted({c for r in resultados for c in r['conexiones']})
+    print(f"Conexiones de red durante el arranque: {len(conexiones)}")
+    for conexion in conexiones:
+        print(f"  {conexion}")
+
+    if args.importaciones:
+        print("\nMódulos más lentos de importar (acumulado):")
+        for acumulado, modulo in importaciones_lentas(args.importaciones):
+            print(f"  {acumulado / 1000:8.1f} ms  {modulo}")
+    return 1 if conexiones else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""! @brief Prueba de carga de extremo a extremo de la API de chat"""
+##
+# @file carga.py
+#
+# @brief Lanza peticiones concurrentes contra los endpoints de la aplicación y muestra
+# latencias p50/p95/p99, rendimiento y tasa de errores por endpoint.
+#
+# @section description_carga Descripción
+# Con `--arrancar` (por defecto si no se indica `--url`) todo es local y sin coste:
+# - Se arranca en este proceso el servidor de `openai_falso.py`, con las opciones
+#   `--latencia`, `--tokens-por-segundo`, `--errores`...
+# - Se arranca la aplicación en un proceso hijo (servidor con hilos de Werkzeug o, con
+#   `--asgi`, `uvicorn asgi:app`) con `OPENAI_BASE_URL` apuntando al servidor falso y una
+#   base de datos y una caché nuevas en un directorio temporal.
+#
+# tiktoken descarga sus codificaciones la primera vez que se usan y las guarda en
+# `TIKTOKEN_CACHE_DIR` (o en el directorio temporal del sistema): para trabajar sin red hay
+# que haberlas descargado antes una vez. Se comprueba antes de arrancar.
+#
+# Después se crean `--conversaciones` conversaciones y `--concurrencia` clientes envían
+# peticiones sin pausa durante `--duracion` segundos, eligiendo el endpoint al azar según
+# `--mezcla`:
+# - `chat`: `POST /api/chat/<id>`
+# - `stream`: `POST /api/chat/<id>/stream` (se mide también el primer fragmento)
+# - `leer`: `GET /api/chat/<id>`
+# - `historial`: `GET /api/historial`
+# - `buscar`: `GET /api/search`
+#
+# Es un bucle cerrado: cada cliente espera su respuesta antes de enviar la siguiente,
+# así que el rendimiento medido es el máximo a esa concurrencia. Las peticiones con
+# código >= 400 o sin respuesta cuentan como errores.
+#
+# @section usage_carga Uso
+# @code
+# Uso (desde backend/):
+# python benchmarks/carga.py --concurrencia 20 --duracion 30
+# python benchmarks/carga.py --asgi --concurrencia 100 --mezcla chat=1,stream=1 --latencia 1
+# python benchmarks/carga.py --asgi --hilos 4 --concurrencia 50 --mezcla leer=3,buscar=1
+# python benchmarks/carga.py --url http://localhost:5000 --mezcla leer=3,historial=1
+# @endcode
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, namedtuple
+import requests
+import openai_falso
+
+'''! @brief Directorio `backend/`, desde el que se arranca la aplicación'''
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+'''! @brief Mezcla de endpoints por defecto (pesos relativos)'''
+MEZCLA_POR_DEFECTO = 'chat=5,stream=2,leer=2,historial=1'
+
+'''! @brief Segundos de espera máxima a que la aplicación acepte conexiones'''
+ESPERA_ARRANQUE = 60
+
+'''! @brief Segundos de espera máxima de cada petición'''
+TIMEOUT_PETICION = 120
+
+'''! @brief Codificaciones de tiktoken que necesita la aplicación (gpt-3.5/gpt-4 y gpt-4o)'''
+CODIFICACIONES = ('cl100k_base', 'o200k_base')
+
+'''! @brief Resultado de una petición: endpoint, segundos, código de estado (None si falló la conexión)'''
+Medida = namedtuple('Medida', ['endpoint', 'duracion', 'estado'])
+
+# Frases de los mensajes de usuario (también sirven de términos para `buscar`)
+_FRASES = ('hola, ¿qué tal?', 'resume el texto anterior', 'explica la latencia', 'dame un ejemplo de prueba')
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _esperar_puerto(puerto, proceso, limite=ESPERA_ARRANQUE):
+    fin = time.monotonic() + limite
+    while time.monotonic() < fin:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"La aplicación terminó al arrancar (código {proceso.returncode})")
+        try:
+            socket.create_connection(('127.0.0.1', puerto), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"La aplicación no acepta conexiones en el puerto {puerto}")
+
+
+def comprobar_codificaciones():
+    """
+    @brief Comprueba que las codificaciones de tiktoken están en la caché local.
+    @throws SystemExit Si alguna no se puede cargar (sin red y sin descargar antes).
+    """
+    import tiktoken
+    for nombre in CODIFICACIONES:
+        try:
+            tiktoken.get_encoding(nombre)
+        except Exception as e:
+            raise SystemExit(
+                f"No se puede cargar la codificación {nombre} de tiktoken ({type(e).__name__}). "
+                "Ejecute una vez con conexión: python -c \"import tiktoken; "
+                f"[tiktoken.get_encoding(c) for c in {CODIFICACIONES!r}]\""
+            )
+
+
+def arrancar_aplicacion(url_openai, directorio, asgi=False, hilos=None):
+    """
+    @brief Arranca la aplicación en un proceso hijo contra el servidor OpenAI falso.
+
+    @param url_openai URL base del servidor falso (`http://127.0.0.1:<puerto>/v1`).
+    @param directorio Directorio para la base de datos, la caché y el log de la aplicación.
+    @param asgi Si es True se usa `uvicorn asgi:app`; si no, el servidor con hilos de Werkzeug.
+    @param hilos Con `asgi`, hilos del pool que atiende las rutas de Flask (`ASGI_HILOS`); None para el valor por defecto.
+
+    @return
+    - Tupla `(proceso, url base de la aplicación)`.
+    """
+    puerto = _puerto_libre()
+    entorno = dict(
+        os.environ,
+        OPENAI_BASE_URL=url_openai,
+        OPENAI_API_KEY='falsa',
+        DATABASE_URI=f"sqlite:///{os.path.join(directorio, 'carga.db')}",
+        CACHE_DB=os.path.join(directorio, 'cache.db'),
+        PYTHONPATH=os.pathsep.join(filter(None, [BACKEND, os.environ.get('PYTHONPATH')])),
+    )
+    if hilos is not None:
+        entorno['ASGI_HILOS'] = str(hilos)
+    if asgi:
+        orden = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(puerto), '--log-level', 'warning']
+    else:
+        orden = [sys.executable, '-c',
+                 'from werkzeug.serving import run_simple; from app import create_app; '
+                 f'run_simple("127.0.0.1", {puerto}, create_app(), threaded=True)']
+    log = open(os.path.join(directorio, 'aplicacion.log'), 'w')
+    proceso = subprocess.Popen(orden, cwd=BACKEND, env=entorno, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        _esperar_puerto(puerto, proceso)
+    except RuntimeError:
+        proceso.terminate()
+        raise
+    return proceso, f"http://127.0.0.1:{puerto}"
+
+
+def _peticion(sesion, endpoint, url, conversaciones):
+    """! @brief Envía una petición del tipo `endpoint` y devuelve sus `Medida` (dos en `stream`)."""
+    id = random.choice(conversaciones)
+    frase = random.choice(_FRASES)
+    inicio = time.perf_counter()
+    try:
+        if endpoint == 'chat':
+            respuesta = sesion.post(f"{url}/api/chat/{id}", json={'mensaje': frase}, timeout=TIMEOUT_PETICION)
+        elif endpoint == 'stream':
+            with sesion.post(f"{url}/api/chat/{id}/stream", json={'mensaje': frase},
+                             stream=True, timeout=TIMEOUT_PETICION) as respuesta:
+                primero = None
+                for _ in respuesta.iter_content(chunk_size=None):
+                    if primero is None:
+                        primero = time.perf_counter() - inicio
+                fin = time.perf_counter() - inicio
+            medidas = [Medida('stream', fin, respuesta.status_code)]
+            if primero is not None:
+                medidas.append(Medida('stream (primer fragmento)', primero, respuesta.status_code))
+            return medidas
+        elif endpoint == 'leer':
+            respuesta = sesion.get(f"{url}/api/chat/{id}", timeout=TIMEOUT_PETICION)
+        elif endpoint == 'historial':
+            respuesta = sesion.get(f"{url}/api/historial", timeout=TIMEOUT_PETICION)
+        elif endpoint == 'buscar':
+            respuesta = sesion.get(f"{url}/api/search", params={'q': frase.split()[-1]}, timeout=TIMEOUT_PETICION)
+        else:
+            raise ValueError(f"Endpoint desconocido: {endpoint}")
+        respuesta.content
+        return [Medida(endpoint, time.perf_counter() - inicio, respuesta.status_code)]
+    except requests.RequestException:
+        return [Medida(endpoint, time.perf_counter() - inicio, None)]
+
+
+def ejecutar(url, mezcla, concurrencia, duracion, conversaciones):
+    """
+    @brief Ejecuta la prueba de carga.
+
+    @param url URL base de la aplicación.
+    @param mezcla Diccionario `endpoint -> peso`.
+    @param concurrencia Número de clientes simultáneos.
+    @param duracion Segundos de prueba.
+    @param conversaciones Lista de IDs de conversación entre los que se reparten las peticiones.
+
+    @return
+    - Tupla `(lista de Medida, segundos transcurridos)`.
+    """
+    endpoints, pesos = zip(*mezcla.items())
+    medidas = []
+    lock = threading.Lock()
+    fin = time.monotonic() + duracion
+
+    def cliente():
+        locales = []
+        with requests.Session() as sesion:
+            while time.monotonic() < fin:
+                locales.extend(_peticion(sesion, random.choices(endpoints, pesos)[0], url, conversaciones))
+        with lock:
+            medidas.extend(locales)
+
+    hilos = [threading.Thread(target=cliente) for _ in range(concurrencia)]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return medidas, time.perf_counter() - inicio
+
+
+def _percentil(ordenados, p):
+    """! @brief Percentil `p` (0-100) de una lista ordenada, por el método del rango más cercano."""
+    return ordenados[min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))]
+
+
+def informe(medidas, transcurrido):
+    """
+    @brief Resume las medidas por endpoint.
+    @param medidas Lista de `Medida`.
+    @param transcurrido Segundos que duró la prueba.
+    @return Lista de diccionarios con `endpoint`, `peticiones`, `errores`, `por_segundo` y `p50`, `p95`, `p99` y `max` (ms).
+    """
+    por_endpoint = defaultdict(list)
+    for medida in medidas:
+        por_endpoint[medida.endpoint].append(medida)
+    filas = []
+    for endpoint, lista in sorted(por_endpoint.items()):
+        tiempos = sorted(m.duracion * 1000 for m in lista)
+        errores = sum(1 for m in lista if m.estado is None or m.estado >= 400)
+        filas.append({
+            'endpoint': endpoint,
+            'peticiones': len(lista),
+            'errores': errores,
+            'por_segundo': len(lista) / transcurrido,
+            **{f"p{p}": _percentil(tiempos, p) for p in (50, 95, 99)},
+            'max': tiempos[-1],
+        })
+    return filas
+
+
+def _leer_mezcla(texto):
+    mezcla = {}
+    for parte in texto.split(','):
+        endpoint, _, peso = parte.partition('=')
+        mezcla[endpoint.strip()] = float(peso or 1)
+    return mezcla
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga de la API de chat')
+    parser.add_argument('--url', help='URL de una aplicación ya arrancada (si no, se arranca una local)')
+    parser.add_argument('--asgi', action='store_true', help='Arrancar la aplicación con uvicorn (asgi.py)')
+    parser.add_argument('--hilos', type=int, help='Con --asgi, hilos para las rutas de Flask (ASGI_HILOS)')
+    parser.add_argument('--concurrencia', type=int, default=10)
+    parser.add_argument('--duracion', type=float, default=20, help='Segundos de prueba')
+    parser.add_argument('--conversaciones', type=int, default=20)
+    parser.add_argument('--mezcla', default=MEZCLA_POR_DEFECTO, help='Pesos por endpoint, e.g. "chat=5,stream=2,leer=2"')
+    parser.add_argument('--json', action='store_true', help='Mostrar el resultado como JSON')
+    openai_falso.argumentos_configuracion(parser)
+    args = parser.parse_args()
+
+    servidor = proceso = None
+    directorio = tempfile.TemporaryDirectory(prefix='carga-')
+    try:
+        url = args.url
+        if not url:
+            comprobar_codificaciones()
+            configuracion = openai_falso.CONFIGURACION_POR_DEFECTO._replace(
+                latencia=args.latencia, variacion=args.variacion, tokens_por_segundo=args.tokens_por_segundo,
+                tokens_respuesta=args.tokens_respuesta, errores=args.errores, codigo_error=args.codigo_error,
+            )
+            servidor = openai_falso.crear_servidor(configuracion=configuracion)
+            threading.Thread(target=servidor.serve_forever, daemon=True).start()
+            proceso, url = arrancar_aplicacion(
+                f"http://127.0.0.1:{servidor.server_address[1]}/v1", directorio.name, args.asgi, args.hilos)
+
+        with requests.Session() as sesion:
+            conversaciones = [
+                sesion.post(f"{url}/api/chat", json={}, timeout=TIMEOUT_PETICION).json()['id']
+                for _ in range(args.conversaciones)
+            ]
+        medidas, transcurrido = ejecutar(url, _leer_mezcla(args.mezcla), args.concurrencia, args.duracion, conversaciones)
+        filas = informe(medidas, transcurrido)
+
+        if args.json:
+            print(json.dumps(filas, indent=2))
+        else:
+            print(f"{len(medidas)} medidas en {transcurrido:.1f} s con {args.concurrencia} clientes ({url})\n")
+            print(f"{'endpoint':<26}{'peticiones':>11}{'errores':>9}{'pet/s':>9}"
+                  f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'máx ms':>10}")
+            for f in filas:
+                errores = f"{100 * f['errores'] / f['peticiones']:.1f}%"
+                print(f"{f['endpoint']:<26}{f['peticiones']:>11}{errores:>9}{f['por_segundo']:>9.1f}"
+                      f"{f['p50']:>10.1f}{f['p95']:>10.1f}{f['p99']:>10.1f}{f['max']:>10.1f}")
+        if servidor is not None and not args.json:
+            print("\nPeticiones recibidas por el servidor OpenAI falso:")
+            for (ruta, estado), cantidad in sorted(servidor.peticiones.items()):
+                print(f"  {cantidad:7d}  {estado}  {ruta}")
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            proceso.wait()
+        if servidor is not None:
+            servidor.shutdown()
+            servidor.server_close()
+        directorio.cleanup()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,405 @@
+"""! @brief Medición de las consultas de la API sobre una base de datos sintética grande"""
+##
+# @file escala.py
+#
+# @brief Genera un conjunto de datos sintético con el esquema de `models.py` y mide el
+# camino de consulta y serialización de cada endpoint de lectura y escritura.
+#
+# @section description_escala Descripción
+# Generación (sólo si la base de datos no existe, o con `--regenerar`):
+# - `--conversaciones` conversaciones y `--mensajes` mensajes en total, repartidos con una
+#   distribución de Pareto (`--sesgo`): la mayoría de conversaciones son cortas y unas
+#   pocas acumulan decenas de miles de mensajes, como en el uso real.
+# - Los mensajes se insertan en orden cronológico global (los IDs de distintas
+#   conversaciones se intercalan), con textos de longitud variable (cortos del usuario,
+#   largos del asistente) y `tokens` ya calculado, como los guardaría la aplicación.
+# - El esquema se crea con las migraciones, así que incluye los índices y el índice de
+#   búsqueda de la versión actual.
+#
+# Medición: cada caso se ejecuta `--repeticiones` veces (tras una de calentamiento) con el
+# cliente de pruebas de Flask, de modo que incluye el enrutado, las consultas y la
+# serialización JSON, pero no la red. Los casos que dependen del tamaño se repiten para una
+# conversación mediana, una del percentil 99 y la mayor. Para cada caso se muestra la
+# latencia y el tiempo y número de sentencias SQL por petición (de las métricas de
+# `DURACION_DB`); la diferencia es enrutado y serialización.
+#
+# El resultado puede guardarse (`--salida`) y compararse con uno anterior (`--comparar`)
+# para valorar cambios de índices o regresiones con números.
+#
+# @section usage_escala Uso
+# @code
+# Uso (desde backend/):
+# python benchmarks/escala.py --db /tmp/escala.db --salida antes.json
+# python benchmarks/escala.py --db /tmp/escala.db --comparar antes.json
+# python benchmarks/escala.py --db /tmp/escala10m.db --conversaciones 10000 --mensajes 10000000
+# @endcode
+import argparse
+import heapq
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+'''! @brief Directorio `backend/`, desde el que se importa la aplicación'''
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+'''! @brief Mensajes que se insertan por transacción durante la generación'''
+LOTE_GENERACION = 20000
+
+'''! @brief Textos distintos que se generan y se reutilizan (generar cada mensaje es demasiado lento)'''
+TEXTOS_DISTINTOS = 20000
+
+'''! @brief Modelos que se asignan a las conversaciones (todos con la codificación `cl100k_base`)'''
+MODELOS = ('gpt-3.5-turbo', 'gpt-4', 'gpt-4-turbo')
+
+'''! @brief Codificación que se guarda en `Mensaje.codificacion` (la de `MODELOS`)'''
+CODIFICACION = 'cl100k_base'
+
+
+def _vocabulario(rng, cantidad=3000):
+    """! @brief Pseudo-palabras y pesos de Zipf con los que se componen los textos."""
+    silabas = ['ba', 'ce', 'di', 'fo', 'gu', 'la', 'me', 'ni', 'po', 'ra', 'se', 'ti', 'vo', 'za', 'cha', 'que', 'tra', 'pla']
+    palabras = sorted({''.join(rng.choices(silabas, k=rng.randint(1, 4))) for _ in range(cantidad * 2)})[:cantidad]
+    rng.shuffle(palabras)
+    return palabras, [1 / (rango + 1) for rango in range(len(palabras))]
+
+
+def _textos(rng):
+    """! @brief Textos de usuario (cortos) y del asistente (largos), con su número aproximado de tokens."""
+    palabras, pesos = _vocabulario(rng)
+    textos = {True: [], False: []}
+    for es_usuario, media in ((True, 20), (False, 150)):
+        for _ in range(TEXTOS_DISTINTOS // 2):
+            n = max(1, int(rng.expovariate(1 / media)))
+            texto = ' '.join(rng.choices(palabras, pesos, k=n))
+            textos[es_usuario].append((texto, n * 4 // 3 + 1))
+    return textos
+
+
+def _tamanos(rng, conversaciones, mensajes, sesgo):
+    """! @brief Reparte `mensajes` entre `conversaciones` según una distribución de Pareto."""
+    pesos = [rng.paretovariate(sesgo) for _ in range(conversaciones)]
+    total = sum(pesos)
+    tamanos = [int(mensajes * p / total) for p in pesos]
+    for i in rng.sample(range(conversaciones), mensajes - sum(tamanos)):
+        tamanos[i] += 1
+    return tamanos
+
+
+def _intervalo(semilla, conv_id, tamano, ahora):
+    """! @brief Fecha del primer mensaje de una conversación y separación entre mensajes (deterministas)."""
+    rng = random.Random(f"{semilla}-{conv_id}")
+    duracion = timedelta(seconds=rng.uniform(600, 60 * 86400))
+    inicio = ahora - timedelta(days=365) + (timedelta(days=365) - duracion) * rng.random()
+    return inicio, duracion / max(tamano, 1)
+
+
+def _cronologia(semilla, conv_id, tamano, ahora):
+    """! @brief Genera `(fecha, conversación, índice)` de los mensajes de una conversación, en orden."""
+    inicio, paso = _intervalo(semilla, conv_id, tamano, ahora)
+    for i in range(tamano):
+        yield inicio + paso * i, conv_id, i
+
+
+def generar(db_session, conversaciones, mensajes, sesgo, semilla):
+    """
+    @brief Llena una base de datos vacía con datos sintéticos.
+
+    @param db_session Sesión de SQLAlchemy de la base de datos (con el esquema ya creado).
+    @param conversaciones Número de conversaciones.
+    @param mensajes Número total de mensajes.
+    @param sesgo Parámetro de la distribución de Pareto (menor = más desigual).
+    @param semilla Semilla del generador aleatorio (mismos parámetros = mismos datos).
+    """
+    from sqlalchemy import insert
+    from chatgpt_api.models import Conversacion, Mensaje
+    from chatgpt_api.services.conversacion_service import recalcular_actividad
+
+    rng = random.Random(semilla)
+    ahora = datetime.utcnow()
+    textos = _textos(rng)
+    tamanos = _tamanos(rng, conversaciones, mensajes, sesgo)
+    filas = []
+    for id, tamano in enumerate(tamanos, start=1):
+        inicio, paso = _intervalo(semilla, id, tamano, ahora)
+        filas.append({
+            'id': id,
+            'nombre': f"Conversación sintética {id} ({tamano} mensajes)",
+            'contexto': True,
+            'modelo': rng.choice(MODELOS),
+            'fecha_creacion': inicio - timedelta(seconds=1),
+            'fecha_modificacion': inicio + paso * max(tamano - 1, 0),
+            'usar_cache': True,
+        })
+    db_session.execute(insert(Conversacion.__table__), filas)
+    db_session.commit()
+
+    # Todas las cronologías mezcladas en orden de fecha: los IDs se intercalan como en la realidad
+    rng = random.Random(semilla + 1)
+    cronologias = [_cronologia(semilla, id, tamano, ahora) for id, tamano in enumerate(tamanos, start=1)]
+    lote = []
+    insertados = 0
+    inicio = time.perf_counter()
+    for fecha, id, i in heapq.merge(*cronologias):
+        es_usuario = i % 2 == 0
+        texto, tokens = rng.choice(textos[es_usuario])
+        lote.append({
+            'conversacion_id': id, 'mensaje': texto, 'es_usuario': es_usuario,
+            'fecha_creacion': fecha, 'tokens': tokens, 'codificacion': CODIFICACION,
+        })
+        if len(lote) >= LOTE_GENERACION:
+            db_session.execute(insert(Mensaje.__table__), lote)
+            db_session.commit()
+            insertados += len(lote)
+            lote = []
+            ritmo = insertados / (time.perf_counter() - inicio)
+            print(f"\r  {insertados}/{mensajes} mensajes ({ritmo:.0f}/s)", end='', file=sys.stderr, flush=True)
+    if lote:
+        db_session.execute(insert(Mensaje.__table__), lote)
+        db_session.commit()
+    print(file=sys.stderr)
+    recalcular_actividad(db_session)
+    db_session.commit()
+
+
+def _percentil(ordenados, p):
+    """! @brief Percentil `p` (0-100) de una lista ordenada, por el método del rango más cercano."""
+    return ordenados[min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))]
+
+
+def muestra_conversaciones(db_session):
+    """
+    @brief Elige las conversaciones con las que se miden los casos que dependen del tamaño.
+    @param db_session Sesión de SQLAlchemy.
+    @return Diccionario `etiqueta -> (id, mensajes)` con `mediana`, `p99` y `mayor`, y `escritura`
+    (la conversación más pequeña, que reciben los casos que modifican datos).
+    """
+    from sqlalchemy import select, func
+    from chatgpt_api.models import Mensaje
+    tamanos = db_session.execute(
+        select(Mensaje.conversacion_id, func.count()).group_by(Mensaje.conversacion_id).order_by(func.count(), Mensaje.conversacion_id)
+    ).all()
+    return {
+        'mediana': tuple(tamanos[len(tamanos) // 2]),
+        'p99': tuple(_percentil(tamanos, 99)),
+        'mayor': tuple(tamanos[-1]),
+        'escritura': tuple(tamanos[0]),
+    }
+
+
+def casos(cliente, db_session, muestra):
+    """
+    @brief Construye los casos a medir.
+
+    @param cliente Cliente de pruebas de Flask.
+    @param db_session Sesión de SQLAlchemy.
+    @param muestra Resultado de `muestra_conversaciones`.
+
+    @return
+    - Lista de tuplas `(nombre, función sin argumentos que hace una petición y devuelve el código de estado)`.
+    """
+    from sqlalchemy import select
+    from chatgpt_api.models import Conversacion, Mensaje
+    from chatgpt_api.api.paginacion import codificar_cursor_fecha
+
+    def peticion(metodo, ruta, **opciones):
+        def funcion():
+            # Leer el cuerpo completo: las respuestas en streaming se serializan al recorrerlas
+            respuesta = cliente.open(ruta, method=metodo, **opciones)
+            respuesta.get_data()
+            respuesta.close()
+            return respuesta.status_code
+        return funcion
+
+    lista = []
+    for etiqueta in ('mediana', 'p99', 'mayor'):
+        id, tamano = muestra[etiqueta]
+        lista.append((f"GET /api/chat/<id> {etiqueta} ({tamano} msj)", peticion('GET', f"/api/chat/{id}")))
+    id, tamano = muestra['mayor']
+    mitad = db_session.execute(
+        select(Mensaje.id).where(Mensaje.conversacion_id == id).order_by(Mensaje.id).offset(tamano // 2).limit(1)
+    ).scalar()
+    lista.append(("GET /api/chat/<id> mayor, página intermedia", peticion('GET', f"/api/chat/{id}?before={mitad}")))
+    etag = cliente.get(f"/api/chat/{id}").headers.get('ETag')
+    lista.append(("GET /api/chat/<id> mayor, 304", peticion('GET', f"/api/chat/{id}", headers={'If-None-Match': etag})))
+
+    lista.append(("GET /api/historial", peticion('GET', '/api/historial')))
+    total = db_session.query(Conversacion).count()
+    intermedia = db_session.execute(
+        select(Conversacion.fecha_creacion, Conversacion.id)
+        .order_by(Conversacion.fecha_creacion.desc(), Conversacion.id.desc()).offset(total // 2).limit(1)
+    ).one()
+    cursor = codificar_cursor_fecha(*intermedia)
+    lista.append(("GET /api/historial página intermedia", peticion('GET', f"/api/historial?before={cursor}")))
+    etag = cliente.get('/api/historial').headers.get('ETag')
+    lista.append(("GET /api/historial 304", peticion('GET', '/api/historial', headers={'If-None-Match': etag})))
+    lista.append(("GET /api/historial?orden=actividad", peticion('GET', '/api/historial?orden=actividad')))
+    intermedia = db_session.execute(
+        select(Conversacion.fecha_actividad, Conversacion.id)
+        .order_by(Conversacion.fecha_actividad.desc(), Conversacion.id.desc()).offset(total // 2).limit(1)
+    ).one()
+    cursor = codificar_cursor_fecha(*intermedia)
+    lista.append(("GET /api/historial?orden=actividad página intermedia",
+                  peticion('GET', f"/api/historial?orden=actividad&before={cursor}")))
+
+    id, _ = muestra['escritura']
+    modelo = db_session.get(Conversacion, id).modelo
+    db_session.remove()
+    lista += [
+        ("GET /api/modelo/<id>", peticion('GET', f"/api/modelo/{id}")),
+        ("PUT /api/modelo/<id>", peticion('PUT', f"/api/modelo/{id}", json={'modelo': modelo})),
+        ("GET /api/contexto/<id>", peticion('GET', f"/api/contexto/{id}")),
+        ("POST /api/contexto/<id>", peticion('POST', f"/api/contexto/{id}")),
+        ("PUT /api/cambiar_nombre_conversacion/<id>",
+         peticion('PUT', f"/api/cambiar_nombre_conversacion/{id}", json={'nombre': 'Renombrada'})),
+        ("GET /api/models", peticion('GET', '/api/models')),
+    ]
+    return lista
+
+
+def casos_historial(db_session, muestra):
+    """
+    @brief Casos de `preparar_historial`, la parte local (sin OpenAI) de `POST /api/chat/<id>`.
+    @return Lista de casos como en `casos`, vacía si las codificaciones de tiktoken no están disponibles.
+    """
+    from chatgpt_api.models import Conversacion
+    from chatgpt_api.services.chat_service import preparar_historial
+    from chatgpt_api.services.openai_service import obtener_codificacion
+    try:
+        obtener_codificacion(MODELOS[0])
+    except Exception as e:
+        print(f"Se omite preparar_historial: tiktoken no puede cargar la codificación ({type(e).__name__})", file=sys.stderr)
+        return []
+
+    def preparar(id):
+        def funcion():
+            try:
+                preparar_historial(db_session, db_session.get(Conversacion, id), 'Hola, ¿puedes resumir lo anterior?')
+            finally:
+                db_session.remove()
+            return 200
+        return funcion
+
+    return [
+        (f"preparar_historial {etiqueta} ({muestra[etiqueta][1]} msj)", preparar(muestra[etiqueta][0]))
+        for etiqueta in ('mediana', 'p99', 'mayor')
+    ]
+
+
+def medir(funcion, repeticiones):
+    """
+    @brief Mide un caso.
+    @param funcion Función del caso (ver `casos`).
+    @param repeticiones Número de ejecuciones medidas (tras una de calentamiento).
+    @return Diccionario con `p50`, `p95`, `max` y `sql` (ms), `sentencias` por ejecución y `errores`.
+    """
+    from chatgpt_api.services.metricas_service import DURACION_DB
+    funcion()
+    tiempos = []
+    errores = 0
+    sentencias, sql = DURACION_DB.totales()
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        estado = funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+        errores += estado >= 400
+    sentencias_fin, sql_fin = DURACION_DB.totales()
+    tiempos.sort()
+    return {
+        'p50': statistics.median(tiempos),
+        'p95': _percentil(tiempos, 95),
+        'max': tiempos[-1],
+        'sql': (sql_fin - sql) * 1000 / repeticiones,
+        'sentencias': (sentencias_fin - sentencias) / repeticiones,
+        'errores': errores,
+    }
+
+
+def _imprimir(resultado, anterior=None):
+    """! @brief Muestra el informe y, si se indica un resultado anterior, la variación de la mediana."""
+    datos = resultado['datos']
+    print(f"Base de datos: {datos['conversaciones']} conversaciones, {datos['mensajes']} mensajes, "
+          f"{datos['bytes'] / 1e6:.0f} MB ({resultado['fecha']})\n")
+    cabecera = f"{'caso':<52}{'p50 ms':>9}{'p95 ms':>9}{'máx ms':>9}{'SQL ms':>9}{'sent.':>7}"
+    print(cabecera + (f"{'Δ p50':>9}" if anterior else ''))
+    for nombre, medida in resultado['casos'].items():
+        linea = (f"{nombre:<52}{medida['p50']:>9.2f}{medida['p95']:>9.2f}{medida['max']:>9.2f}"
+                 f"{medida['sql']:>9.2f}{medida['sentencias']:>7.1f}")
+        previa = (anterior or {}).get('casos', {}).get(nombre)
+        if previa and previa['p50']:
+            linea += f"{100 * (medida['p50'] - previa['p50']) / previa['p50']:>+8.0f}%"
+        if medida['errores']:
+            linea += f"  ({medida['errores']} errores)"
+        print(linea)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Consultas de la API sobre datos sintéticos a escala')
+    parser.add_argument('--db', default=os.path.join(BACKEND, 'benchmarks', 'escala.db'), help='Fichero SQLite del conjunto de datos')
+    parser.add_argument('--regenerar', action='store_true', help='Borrar y volver a generar la base de datos')
+    parser.add_argument('--conversaciones', type=int, default=10000)
+    parser.add_argument('--mensajes', type=int, default=1000000)
+    parser.add_argument('--sesgo', type=float, default=1.2, help='Parámetro de Pareto de los tamaños (menor = más desigual)')
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--repeticiones', type=int, default=20)
+    parser.add_argument('--salida', help='Guardar el resultado en este fichero JSON')
+    parser.add_argument('--comparar', help='Resultado JSON anterior con el que comparar')
+    args = parser.parse_args()
+
+    if args.regenerar:
+        for sufijo in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + sufijo):
+                os.remove(args.db + sufijo)
+    nueva = not os.path.exists(args.db)
+    # La aplicación lee la configuración al importarse
+    os.environ['DATABASE_URI'] = f"sqlite:///{os.path.abspath(args.db)}"
+    os.environ['CACHE_RESPUESTAS'] = '0'
+    os.environ.setdefault('TRABAJOS_HILOS', '0')
+    sys.path.insert(0, BACKEND)
+    import logging
+    logging.disable(logging.INFO)
+    from app import create_app
+    from chatgpt_api.db import db_session
+    from chatgpt_api.models import Conversacion, Mensaje
+
+    app = create_app()
+    if nueva:
+        print(f"Generando {args.conversaciones} conversaciones y {args.mensajes} mensajes en {args.db}", file=sys.stderr)
+        inicio = time.perf_counter()
+        generar(db_session, args.conversaciones, args.mensajes, args.sesgo, args.semilla)
+        print(f"Generado en {time.perf_counter() - inicio:.0f} s", file=sys.stderr)
+
+    muestra = muestra_conversaciones(db_session)
+    cliente = app.test_client()
+    lista = casos(cliente, db_session, muestra) + casos_historial(db_session, muestra)
+    resultado = {
+        'fecha': datetime.utcnow().isoformat(timespec='seconds'),
+        'datos': {
+            'conversaciones': db_session.query(Conversacion).count(),
+            'mensajes': db_session.query(Mensaje).count(),
+            'bytes': os.path.getsize(args.db),
+            'muestra': muestra,
+        },
+        'repeticiones': args.repeticiones,
+        'casos': {},
+    }
+    db_session.remove()
+    for nombre, funcion in lista:
+        resultado['casos'][nombre] = medir(funcion, args.repeticiones)
+
+    anterior = None
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as fichero:
+            anterior = json.load(fichero)
+    _imprimir(resultado, anterior)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as fichero:
+            json.dump(resultado, fichero, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+"""! @brief Servidor local compatible con la API de OpenAI para pruebas de carga"""
+##
+# @file openai_falso.py
+#
+# @brief Sustituto de la API de OpenAI, sin red ni coste, con latencia, velocidad de
+# generación y errores configurables.
+#
+# @section description_openai_falso Descripción
+# Implementa con la biblioteca estándar (`http.server`, un hilo por conexión y
+# keep-alive de HTTP/1.1) los endpoints que usa la aplicación:
+# - `POST /v1/chat/completions`, con y sin `stream` (SSE con `Transfer-Encoding: chunked`).
+#   La respuesta tiene `--tokens-respuesta` palabras (o `max_tokens`, si es menor) y
+#   `usage` aproximado (4 caracteres por token de entrada).
+# - `GET /v1/models`.
+# - `GET /v1/files`, `POST /v1/files` y `DELETE /v1/files/<id>` (en memoria).
+#
+# Cada respuesta de chat espera `--latencia` segundos (± `--variacion`) antes del primer
+# byte y luego genera a `--tokens-por-segundo`. Con `--errores` se devuelve una fracción
+# de las peticiones de chat con `--codigo-error` (con `Retry-After` en los 429), para
+# comprobar reintentos y métricas de error.
+#
+# La aplicación se dirige a este servidor con `OPENAI_BASE_URL` (ver `carga.py`).
+#
+# @section usage_openai_falso Uso
+# @code
+# python benchmarks/openai_falso.py --puerto 8089 --latencia 0.3 --tokens-por-segundo 80
+# OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=falsa flask --app app run
+# @endcode
+import argparse
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+'''! @brief Comportamiento simulado del servidor'''
+Configuracion = namedtuple('Configuracion', [
+    'latencia', 'variacion', 'tokens_por_segundo', 'tokens_respuesta', 'errores', 'codigo_error', 'modelos',
+])
+
+'''! @brief Configuración por defecto: respuestas de 0.2 s + 100 palabras a 100 tokens/s, sin errores'''
+CONFIGURACION_POR_DEFECTO = Configuracion(
+    latencia=0.2, variacion=0.05, tokens_por_segundo=100.0, tokens_respuesta=100, errores=0.0, codigo_error=429,
+    modelos=('gpt-3.5-turbo', 'gpt-4', 'gpt-4-turbo', 'gpt-4o', 'gpt-4o-mini', 'gpt-4.1'),
+)
+
+'''! @brief Palabras con las que se componen las respuestas'''
+PALABRAS = (
+    'el', 'modelo', 'responde', 'con', 'un', 'texto', 'de', 'prueba', 'generado', 'localmente',
+    'para', 'medir', 'la', 'latencia', 'y', 'el', 'rendimiento', 'del', 'servidor', 'sin', 'coste',
+)
+
+'''! @brief Escrituras por segundo, como máximo, de un stream (se agrupan varios tokens por fragmento)'''
+FRAGMENTOS_POR_SEGUNDO = 50
+
+# Tipo de error de OpenAI de cada código de estado inyectado
+_TIPOS_ERROR = {400: 'invalid_request_error', 401: 'invalid_api_key', 429: 'rate_limit_exceeded', 500: 'server_error', 503: 'server_error'}
+
+
+class ServidorFalso(ThreadingHTTPServer):
+    """
+    @brief Servidor HTTP con la configuración simulada, los ficheros subidos y los contadores.
+    @param direccion Tupla `(host, puerto)`; con el puerto 0 se elige uno libre (`server_address`).
+    @param configuracion `Configuracion` del comportamiento simulado.
+    """
+    daemon_threads = True
+
+    def __init__(self, direccion, configuracion=CONFIGURACION_POR_DEFECTO):
+        super().__init__(direccion, _Manejador)
+        self.configuracion = configuracion
+        self.ficheros = {}
+        self.peticiones = Counter()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def handle_error(self, peticion, direccion):
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(peticion, direccion)
+
+    def nuevo_id(self):
+        with self._lock:
+            return next(self._ids)
+
+    def contar(self, ruta, estado):
+        ruta = re.sub(r'^/v1/files/.+', '/v1/files/<id>', ruta)
+        with self._lock:
+            self.peticiones[(ruta, estado)] += 1
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'OpenAIFalso/1.0'
+
+    def log_message(self, formato, *args):
+        pass
+
+    # --- Utilidades ---
+    def _leer_cuerpo(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _responder(self, estado, datos, cabeceras=None):
+        cuerpo = json.dumps(datos).encode('utf-8')
+        self.send_response(estado)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+        self.server.contar(self.path.split('?')[0], estado)
+
+    def _error(self, estado, mensaje):
+        cabeceras = {'Retry-After': '1'} if estado == 429 else None
+        self._responder(estado, {'error': {
+            'message': mensaje, 'type': _TIPOS_ERROR.get(estado, 'server_error'), 'param': None, 'code': None,
+        }}, cabeceras)
+
+    def _fragmento(self, texto):
+        datos = texto.encode('utf-8')
+        self.wfile.write(f"{len(datos):x}\r\n".encode('ascii') + datos + b"\r\n")
+        self.wfile.flush()
+
+    # --- Endpoints ---
+    def do_GET(self):
+        ruta = self.path.split('?')[0]
+        if ruta == '/v1/models':
+            return self._responder(200, {'object': 'list', 'data': [
+                {'id': modelo, 'object': 'model', 'created': 0, 'owned_by': 'openai-falso'}
+                for modelo in self.server.configuracion.modelos
+            ]})
+        if ruta == '/v1/files':
+            return self._responder(200, {'object': 'list', 'data': list(self.server.ficheros.values()), 'has_more': False})
+        self._error(404, f"Ruta desconocida: {ruta}")
+
+    def do_DELETE(self):
+        ruta = self.path.split('?')[0]
+        if ruta.startswith('/v1/files/'):
+            id = ruta.rsplit('/', 1)[1]
+            if self.server.ficheros.pop(id, None) is None:
+                return self._error(404, f"No such File object: {id}")
+            return self._responder(200, {'id': id, 'object': 'file', 'deleted': True})
+        self._error(404, f"Ruta desconocida: {ruta}")
+
+    def do_POST(self):
+        ruta = self.path.split('?')[0]
+        cuerpo = self._leer_cuerpo()
+        if ruta == '/v1/chat/completions':
+            return self._chat(json.loads(cuerpo or b'{}'))
+        if ruta == '/v1/files':
+            return self._subir_fichero(cuerpo)
+        self._error(404, f"Ruta desconocida: {ruta}")
+
+    def _subir_fichero(self, cuerpo):
+        nombre = re.search(rb'filename="([^"]*)"', cuerpo)
+        proposito = re.search(rb'name="purpose"\r\n\r\n([^\r]*)', cuerpo)
+        id = f"file-falso{self.server.nuevo_id()}"
+        fichero = {
+            'id': id, 'object': 'file', 'bytes': len(cuerpo), 'created_at': int(time.time()),
+            'filename': nombre.group(1).decode('utf-8', 'replace') if nombre else 'fichero',
+            'purpose': proposito.group(1).decode() if proposito else 'assistants',
+            'status': 'processed',
+        }
+        self.server.ficheros[id] = fichero
+        self._responder(200, fichero)
+
+    def _chat(self, peticion):
+        configuracion = self.server.configuracion
+        if random.random() < configuracion.errores:
+            time.sleep(configuracion.latencia / 2)
+            return self._error(configuracion.codigo_error, 'Error inyectado por el servidor falso')
+        modelo = peticion.get('model', 'gpt-3.5-turbo')
+        entrada = sum(len(str(m.get('content') or '')) // 4 + 4 for m in peticion.get('messages', []))
+        cantidad = min(configuracion.tokens_respuesta, peticion.get('max_tokens') or configuracion.tokens_respuesta)
+        palabras = [PALABRAS[i % len(PALABRAS)] for i in range(cantidad)]
+        id = f"chatcmpl-falso{self.server.nuevo_id()}"
+        time.sleep(max(0.0, configuracion.latencia + random.uniform(-configuracion.variacion, configuracion.variacion)))
+        if peticion.get('stream'):
+            return self._chat_stream(id, modelo, palabras)
+        time.sleep(cantidad / configuracion.tokens_por_segundo)
+        self._responder(200, {
+            'id': id, 'object': 'chat.completion', 'created': int(time.time()), 'model': modelo,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ' '.join(palabras)}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': entrada, 'completion_tokens': cantidad, 'total_tokens': entrada + cantidad},
+        })
+
+    def _chat_stream(self, id, modelo, palabras):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        base = {'id': id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': modelo}
+
+        def evento(delta, fin=None):
+            datos = dict(base, choices=[{'index': 0, 'delta': delta, 'finish_reason': fin}])
+            self._fragmento(f"data: {json.dumps(datos)}\n\n")
+
+        tokens_por_fragmento = max(1, round(self.server.configuracion.tokens_por_segundo / FRAGMENTOS_POR_SEGUNDO))
+        pausa = tokens_por_fragmento / self.server.configuracion.tokens_por_segundo
+        try:
+            evento({'role': 'assistant', 'content': ''})
+            for inicio in range(0, len(palabras), tokens_por_fragmento):
+                time.sleep(pausa)
+                prefijo = ' ' if inicio else ''
+                evento({'content': prefijo + ' '.join(palabras[inicio:inicio + tokens_por_fragmento])})
+            evento({}, 'stop')
+            self._fragmento('data: [DONE]\n\n')
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        self.server.contar('/v1/chat/completions', 200)
+
+
+def crear_servidor(host='127.0.0.1', puerto=0, configuracion=CONFIGURACION_POR_DEFECTO):
+    """
+    @brief Crea el servidor (sin arrancarlo).
+
+    @param host Dirección en la que escuchar.
+    @param puerto Puerto; 0 para elegir uno libre.
+    @param configuracion `Configuracion` del comportamiento simulado.
+
+    @return
+    - `ServidorFalso`. Se arranca con `serve_forever()` (p. ej. en un hilo) y su URL base
+      es `http://host:server_address[1]/v1`.
+    """
+    return ServidorFalso((host, puerto), configuracion)
+
+
+def argumentos_configuracion(parser):
+    """! @brief Añade a un `ArgumentParser` las opciones de `Configuracion` (también las usa `carga.py`)."""
+    por_defecto = CONFIGURACION_POR_DEFECTO
+    parser.add_argument('--latencia', type=float, default=por_defecto.latencia, help='Segundos hasta el primer byte')
+    parser.add_argument('--variacion', type=float, default=por_defecto.variacion, help='± segundos aleatorios sobre la latencia')
+    parser.add_argument('--tokens-por-segundo', type=float, default=por_defecto.tokens_por_segundo)
+    parser.add_argument('--tokens-respuesta', type=int, default=por_defecto.tokens_respuesta)
+    parser.add_argument('--errores', type=float, default=por_defecto.errores, help='Fracción (0-1) de respuestas de chat con error')
+    parser.add_argument('--codigo-error', type=int, default=por_defecto.codigo_error)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor local compatible con la API de OpenAI')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=8089)
+    argumentos_configuracion(parser)
+    args = parser.parse_args()
+
+    configuracion = CONFIGURACION_POR_DEFECTO._replace(
+        latencia=args.latencia, variacion=args.variacion, tokens_por_segundo=args.tokens_por_segundo,
+        tokens_respuesta=args.tokens_respuesta, errores=args.errores, codigo_error=args.codigo_error,
+    )
+    servidor = crear_servidor(args.host, args.puerto, configuracion)
+    print(f"OpenAI falso en http://{args.host}:{servidor.server_address[1]}/v1", flush=True)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        for (ruta, estado), cantidad in sorted(servidor.peticiones.items()):
+            print(f"  {cantidad:7d}  {estado}  {ruta}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+from flask import Blueprint, request, jsonify
+from chatgpt_api.db import get_db
+from chatgpt_api.api.paginacion import (
+    leer_limite,
+    leer_id,
+    leer_cursor_puntuacion,
+    codificar_cursor_puntuacion,
+    CursorInvalido,
+)
+from chatgpt_api.services.busqueda_service import buscar, fts_disponible, ORDEN_RELEVANCIA, ORDEN_RECIENTE
+
+busqueda_bp = Blueprint('busqueda', __name__)
+
+@busqueda_bp.route('/api/search', methods=['GET'])
+def buscar_mensajes():
+    """
+    @brief Busca un texto en los mensajes de todas las conversaciones.
+
+    @details
+    Devuelve los mensajes que contienen todos los términos de `q` (el último también como
+    prefijo), sin distinguir mayúsculas ni acentos, con un fragmento del mensaje en el que las
+    coincidencias van entre `<mark>` y `</mark>` (el resto del fragmento ya está escapado).
+
+    Parámetros de la URL:
+    - `q`: texto a buscar (obligatorio).
+    - `sort`: `rank` (por relevancia, por defecto) o `recent` (del más nuevo al más antiguo;
+      más rápido cuando los términos aparecen en muchísimos mensajes).
+    - `limit`: número máximo de resultados (por defecto 50, máximo 500).
+    - `before`: valor de `siguiente_cursor` de la página anterior.
+
+    @return
+    - 200 OK: Resultados y `siguiente_cursor` (`null` si no hay más). `orden` indica el orden
+      aplicado: sin índice FTS5 (bases de datos que no son SQLite) siempre es `recent`.
+    - 400 Bad Request: Si falta `q` o algún parámetro no es válido.
+
+    @code
+    Ejemplo de solicitud:
+    GET /api/search?q=integrar%20api&limit=20
+
+    Respuesta esperada:
+    {
+        "orden": "rank",
+        "resultados": [
+            {
+                "mensaje_id": 5021,
+                "conversacion_id": 123,
+                "conversacion_nombre": "Integración",
+                "es_usuario": true,
+                "fecha_creacion": "2025-04-20T10:00:00",
+                "fragmento": "¿Cómo puedo <mark>integrar</mark> la <mark>API</mark> de OpenAI?",
+                "puntuacion": 7.1843
+            }
+        ],
+        "siguiente_cursor": "-7.1843..._5021"
+    }
+    @endcode
+    """
+    consulta = request.args.get('q', '').strip()
+    if not consulta:
+        return jsonify({'error': 'Falta el parámetro q'}), 400
+    orden = request.args.get('sort', ORDEN_RELEVANCIA)
+    if orden not in (ORDEN_RELEVANCIA, ORDEN_RECIENTE):
+        return jsonify({'error': f"sort no válido: {orden}"}), 400
+
+    db_session = get_db()
+    if not fts_disponible(db_session):
+        orden = ORDEN_RECIENTE
+    try:
+        limite = leer_limite()
+        antes_de = leer_cursor_puntuacion('before') if orden == ORDEN_RELEVANCIA else leer_id('before')
+    except CursorInvalido as e:
+        return jsonify({'error': str(e)}), 400
+
+    resultados, siguiente = buscar(db_session, consulta, limite, antes_de, orden)
+    if siguiente is not None and orden == ORDEN_RELEVANCIA:
+        siguiente = codificar_cursor_puntuacion(*siguiente)
+    return jsonify({'orden': orden, 'resultados': resultados, 'siguiente_cursor': siguiente})
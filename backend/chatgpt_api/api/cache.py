@@ -0,0 +1,101 @@
+from flask import Blueprint, request, jsonify
+from chatgpt_api.db import get_db
+from chatgpt_api.models import Conversacion
+from chatgpt_api.services.cache_service import cache_respuestas
+
+cache_bp = Blueprint('cache', __name__)
+
+@cache_bp.route('/api/cache/<int:id>', methods=['POST'])
+def cambiar_cache(id):
+    """
+    @brief Activa o desactiva el uso de la caché de respuestas en una conversación.
+
+    @details
+    Si el cuerpo de la petición incluye `usar_cache`, se asigna ese valor; si no, se
+    alterna el valor actual (igual que `/api/contexto/<id>`). Con la caché desactivada,
+    las respuestas de la conversación ni se leen ni se guardan en la caché.
+
+    @param id Identificador único de la conversación.
+
+    @return
+    - 200 OK: Devuelve el nuevo valor de `usar_cache`.
+    - 404 Not Found: Si no se encuentra una conversación con el ID proporcionado.
+
+    @code
+    Ejemplo de solicitud:
+    POST /api/cache/1
+    {
+        "usar_cache": false
+    }
+
+    Respuesta esperada:
+    {
+        "usar_cache": false
+    }
+    @endcode
+    """
+    db_session = get_db()
+    conv = db_session.query(Conversacion).filter_by(id=id).first()
+    if conv is None:
+        return jsonify({'error': 'Conversación no encontrada'}), 404
+    data = request.get_json(silent=True) or {}
+    conv.usar_cache = bool(data['usar_cache']) if 'usar_cache' in data else not conv.usar_cache
+    db_session.commit()
+    return jsonify({'usar_cache': conv.usar_cache})
+
+
+@cache_bp.route('/api/cache/<int:id>', methods=['GET'])
+def obtener_cache(id):
+    """
+    @brief Indica si una conversación usa la caché de respuestas.
+
+    @param id Identificador único de la conversación.
+
+    @return
+    - 200 OK: Devuelve el valor de `usar_cache`.
+    - 404 Not Found: Si no se encuentra una conversación con el ID proporcionado.
+
+    @code
+    Ejemplo de solicitud:
+    GET /api/cache/1
+
+    Respuesta esperada:
+    {
+        "usar_cache": true
+    }
+    @endcode
+    """
+    db_session = get_db()
+    conv = db_session.query(Conversacion).filter_by(id=id).first()
+    if conv is None:
+        return jsonify({'error': 'Conversación no encontrada'}), 404
+    return jsonify({'usar_cache': conv.usar_cache})
+
+
+@cache_bp.route('/api/cache/estadisticas', methods=['GET'])
+def estadisticas_cache():
+    """
+    @brief Devuelve los contadores de la caché de respuestas de este proceso.
+
+    @return
+    - 200 OK: Aciertos por nivel, fallos, respuestas guardadas y expulsadas, tasa de aciertos,
+      entradas en memoria y si la caché está activa.
+
+    @code
+    Ejemplo de solicitud:
+    GET /api/cache/estadisticas
+
+    Respuesta esperada:
+    {
+        "activa": true,
+        "aciertos_memoria": 12,
+        "aciertos_disco": 3,
+        "fallos": 40,
+        "guardados": 40,
+        "expulsados": 0,
+        "entradas_memoria": 52,
+        "tasa_aciertos": 0.2727
+    }
+    @endcode
+    """
+    return jsonify(cache_respuestas.estadisticas())
@@ -0,0 +1,41 @@
+"""! @brief Acciones al terminar de enviar una respuesta en streaming"""
+##
+# @file cierre.py
+#
+# @brief Ejecuta una función cuando termina el envío del cuerpo de una respuesta.
+#
+# @section description_cierre Descripción
+# En las respuestas en streaming, `after_request` se ejecuta antes de enviar el cuerpo.
+# Para medir la petición completa hay que esperar al último fragmento, lo que se consigue
+# envolviendo el iterador del cuerpo. Pero si el cliente se desconecta antes de leer el
+# primer fragmento, el generador no llega a arrancar y su `finally` no se ejecuta; en ese
+# caso sólo queda el cierre de la respuesta (`call_on_close`), que el servidor WSGI y el
+# adaptador de `asgi.py` llaman siempre. `al_terminar` usa los dos, y la función se
+# ejecuta una sola vez.
+
+
+def al_terminar(response, funcion):
+    """
+    @brief Llama a `funcion` (una sola vez) cuando se termina de enviar o se cierra una respuesta en streaming.
+
+    @param response Respuesta de Flask con `is_streamed` verdadero.
+    @param funcion Función sin argumentos.
+
+    @return
+    - La misma respuesta, con el cuerpo envuelto.
+    """
+    pendiente = [funcion]
+
+    def una_vez():
+        while pendiente:
+            pendiente.pop()()
+
+    def recorrer(iterable):
+        try:
+            yield from iterable
+        finally:
+            una_vez()
+
+    response.response = recorrer(response.response)
+    response.call_on_close(una_vez)
+    return response
@@ -1,14 +1,28 @@
+from datetime import datetime, timezone
 from flask import Blueprint, request, jsonify
+from sqlalchemy import and_, or_, func
 from chatgpt_api.db import get_db
 from chatgpt_api.models import Conversacion, Mensaje
+from chatgpt_api.api.paginacion import leer_limite, leer_cursor_fecha, codificar_cursor_fecha, CursorInvalido
+from chatgpt_api.api.etag import respuesta_condicional
+from chatgpt_api.services.conversacion_service import eliminar_conversaciones, eliminar_inactivas
 
 def conversacion_to_dict(conv):
     return {
         'id': conv.id,
         'nombre': conv.nombre,
-        'fecha_creacion': conv.fecha_creacion.isoformat() if conv.fecha_creacion else None
+        'fecha_creacion': conv.fecha_creacion.isoformat() if conv.fecha_creacion else None,
+        'fecha_actividad': conv.fecha_actividad.isoformat() if conv.fecha_actividad else None,
+        'num_mensajes': conv.num_mensajes,
+        'tokens_totales': conv.tokens_totales,
     }
 
+'''! @brief Columna de ordenación de `/api/historial` según el parámetro `orden` (cada una con su índice con `id`)'''
+ORDENES_HISTORIAL = {
+    'creacion': Conversacion.fecha_creacion,
+    'actividad': Conversacion.fecha_actividad,
+}
+
 conversacion_bp = Blueprint('conversacion', __name__)
 
 @conversacion_bp.route('/api/chat', methods=['POST'])
@@ -53,38 +67,110 @@ def nueva_conversacion():
     return jsonify({'id': nueva_conv.id, 'nombre': nueva_conv.nombre}), 201
 
 
+def _pagina_historial(db_session, orden, limite, antes_de, despues_de):
+    """! @brief Consulta y serializa una página de `/api/historial` (ver `historial`)."""
+    columna = ORDENES_HISTORIAL[orden]
+    consulta = db_session.query(Conversacion)
+    if despues_de is not None:
+        fecha, id = despues_de
+        consulta = consulta.filter(or_(
+            columna > fecha,
+            and_(columna == fecha, Conversacion.id > id),
+        ))
+        conversaciones = consulta.order_by(columna, Conversacion.id).limit(limite + 1).all()
+        hay_mas = len(conversaciones) > limite
+        conversaciones = conversaciones[:limite][::-1]
+        ultima = conversaciones[0] if hay_mas else None
+    else:
+        if antes_de is not None:
+            fecha, id = antes_de
+            consulta = consulta.filter(or_(
+                columna < fecha,
+                and_(columna == fecha, Conversacion.id < id),
+            ))
+        conversaciones = consulta.order_by(columna.desc(), Conversacion.id.desc()).limit(limite + 1).all()
+        hay_mas = len(conversaciones) > limite
+        conversaciones = conversaciones[:limite]
+        ultima = conversaciones[-1] if hay_mas else None
+    resultados = [conversacion_to_dict(conv) for conv in conversaciones]
+    siguiente_cursor = codificar_cursor_fecha(getattr(ultima, columna.key), ultima.id) if ultima else None
+    return jsonify({'conversaciones': resultados, 'siguiente_cursor': siguiente_cursor})
+
+
 @conversacion_bp.route('/api/historial', methods=['GET'])
 def historial():
     """
-    @brief Recupera el historial de todas las conversaciones.
+    @brief Recupera una página del historial de conversaciones.
 
     @details
-    Este endpoint devuelve una lista de todas las conversaciones almacenadas en la base de datos, 
-    ordenadas por fecha de creación en orden descendente. Cada conversación incluye su ID, nombre 
-    y fecha de creación.
+    Este endpoint devuelve las conversaciones almacenadas en la base de datos, ordenadas
+    por fecha de creación (o, con `orden=actividad`, por la fecha de su último mensaje) en
+    orden descendente y paginadas por cursor sobre (fecha, `id`). Sin cursor devuelve las
+    más recientes; con `before` las anteriores al cursor y con `after` las posteriores.
+    Cada conversación incluye su ID, nombre, fecha de creación, fecha de última actividad,
+    número de mensajes y tokens totales.
+
+    Los datos de actividad son campos de `Conversacion` que se mantienen al guardar cada
+    mensaje, así que cada página es una única consulta indexada, sin leer la tabla `mensaje`.
+
+    @param orden (query, opcional) `creacion` (por defecto) o `actividad`. Los cursores sólo valen para el mismo orden.
+    @param limit (query, opcional) Número de conversaciones por página (por defecto 50, máximo 500).
+    @param before (query, opcional) Cursor (`siguiente_cursor` de una página anterior).
+    @param after (query, opcional) Cursor a partir del cual se devuelven las conversaciones más nuevas.
 
     @return
-    - 200 OK: Devuelve un historial de conversaciones en formato JSON.
+    - 200 OK: Devuelve la página del historial en formato JSON y el cursor para continuar
+      en la misma dirección (`null` si no hay más conversaciones).
+    - 304 Not Modified: Si el ETag enviado en `If-None-Match` coincide (no se ha creado, borrado ni modificado
+      ninguna conversación, ni se han añadido mensajes).
+    - 400 Bad Request: Si `orden` o algún parámetro de paginación no es válido.
 
     @code
     Ejemplo de solicitud:
-    GET /api/historial
+    GET /api/historial?limit=20
 
     Respuesta esperada:
-    [
-        {
-            "id": 123,
-            "nombre": "Mi Conversación",
-            "fecha_creacion": "2025-04-14T10:00:00"
-        },
-        ...
-    ]
+    {
+        "conversaciones": [
+            {
+                "id": 123,
+                "nombre": "Mi Conversación",
+                "fecha_creacion": "2025-04-14T10:00:00",
+                "fecha_actividad": "2025-04-20T18:12:05",
+                "num_mensajes": 42,
+                "tokens_totales": 9120
+            },
+            ...
+        ],
+        "siguiente_cursor": "2025-04-10T08:30:00_97"
+    }
+
+    Página siguiente:
+    GET /api/historial?limit=20&before=2025-04-10T08:30:00_97
+
+    Conversaciones con actividad más reciente:
+    GET /api/historial?orden=actividad&limit=20
     @endcode
     """
+    orden = request.args.get('orden', 'creacion')
+    if orden not in ORDENES_HISTORIAL:
+        return jsonify({'error': f"orden no válido: {orden}"}), 400
+    try:
+        limite = leer_limite()
+        antes_de = leer_cursor_fecha('before')
+        despues_de = leer_cursor_fecha('after')
+    except CursorInvalido as e:
+        return jsonify({'error': str(e)}), 400
+
     db_session = get_db()
-    conversaciones = db_session.query(Conversacion).order_by(Conversacion.fecha_creacion.desc()).all()
-    resultados = [conversacion_to_dict(conv) for conv in conversaciones]
-    return jsonify(resultados)
+    # Validador: cambia al crear, borrar o modificar (nombre, modelo, mensajes...) cualquier conversación
+    validador = db_session.query(
+        func.count(Conversacion.id),
+        func.max(Conversacion.id),
+        func.max(Conversacion.fecha_creacion),
+        func.max(Conversacion.fecha_modificacion),
+    ).one()
+    return respuesta_condicional(tuple(validador), lambda: _pagina_historial(db_session, orden, limite, antes_de, despues_de))
 
 
 @conversacion_bp.route('/api/eliminar_conversacion/<int:id>', methods=['DELETE'])
@@ -115,19 +201,69 @@ def eliminar_conversacion(id):
     Puede lanzar una excepción si ocurre un error durante la ejecución de las operaciones de base de datos.
 
     @note
-    Este endpoint realiza dos operaciones de borrado: una para los mensajes y otra para la conversación.
-    El borrado se efectúa de forma transaccional.
+    Los mensajes se borran con sentencias `DELETE` sobre conjuntos, sin cargarlos en memoria,
+    en transacciones de como mucho `BORRADO_LOTE` mensajes (ver `conversacion_service`).
+    La conversación se borra en la última, así que sólo desaparece cuando ya no quedan mensajes.
     """
     db_session = get_db()
-    conv = db_session.query(Conversacion).filter_by(id=id).first()
-    if conv:
-        db_session.delete(conv)
-        db_session.commit()
+    if eliminar_conversaciones(db_session, [id]).conversaciones:
         return jsonify({'mensaje': 'Conversación eliminada correctamente'})
     else:
         return jsonify({'error': 'Conversación no encontrada'}), 404
 
 
+@conversacion_bp.route('/api/eliminar_conversaciones', methods=['POST'])
+def eliminar_varias():
+    """
+    @brief Elimina varias conversaciones, por lista de IDs o por antigüedad.
+
+    @details
+    Pensado para purgar datos antiguos: el borrado se hace por bloques, en transacciones
+    cortas, de modo que la aplicación sigue atendiendo escrituras mientras tanto.
+
+    @param ids Lista de IDs de las conversaciones a eliminar (los que no existen se ignoran).
+    @param anteriores_a Fecha ISO 8601 (UTC): elimina las conversaciones creadas antes de esa
+    fecha que no tengan mensajes posteriores. Se debe indicar `ids` o `anteriores_a`.
+
+    @return
+    - 200 OK: Número de conversaciones y de mensajes eliminados.
+    - 400 Bad Request: Si falta `ids` o `anteriores_a`, o alguno no es válido.
+
+    @code
+    Ejemplo de solicitud:
+    POST /api/eliminar_conversaciones
+    {
+        "anteriores_a": "2025-01-01T00:00:00"
+    }
+
+    Respuesta esperada:
+    {
+        "conversaciones": 312,
+        "mensajes": 48210
+    }
+    @endcode
+    """
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    anteriores_a = data.get('anteriores_a')
+    db_session = get_db()
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(id, int) and not isinstance(id, bool) for id in ids):
+            return jsonify({'error': 'ids debe ser una lista de enteros'}), 400
+        resultado = eliminar_conversaciones(db_session, ids)
+    elif anteriores_a:
+        try:
+            fecha = datetime.fromisoformat(anteriores_a)
+        except (TypeError, ValueError):
+            return jsonify({'error': f"Fecha no válida: {anteriores_a}"}), 400
+        if fecha.tzinfo is not None:  # Las fechas se guardan en UTC sin zona horaria
+            fecha = fecha.astimezone(timezone.utc).replace(tzinfo=None)
+        resultado = eliminar_inactivas(db_session, fecha)
+    else:
+        return jsonify({'error': 'Indique ids o anteriores_a'}), 400
+    return jsonify(resultado._asdict())
+
+
 @conversacion_bp.route('/api/cambiar_nombre_conversacion/<int:id>', methods=['PUT'])
 def cambiar_nombre(id):
     """
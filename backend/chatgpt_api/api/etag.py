@@ -0,0 +1,62 @@
+"""! @brief Respuestas condicionales (ETag / If-None-Match) para los endpoints de lectura"""
+##
+# @file etag.py
+#
+# @brief Cálculo de ETags a partir de validadores baratos y respuesta 304.
+#
+# @section description_etag Descripción
+# Cada endpoint calcula un validador con una consulta mínima (e.g., número de mensajes
+# e ID del último mensaje) en lugar de serializar la respuesta completa. Si el ETag
+# derivado coincide con la cabecera `If-None-Match` del cliente, se responde 304 sin
+# cuerpo y sin ejecutar la consulta principal ni la serialización.
+#
+# Las respuestas llevan `Cache-Control: no-cache`, de modo que el navegador guarda el
+# cuerpo pero revalida en cada petición enviando `If-None-Match` automáticamente.
+import hashlib
+from flask import request, make_response
+
+'''! @brief Política de caché de las respuestas con ETag: guardar, pero revalidar siempre'''
+CACHE_CONTROL = 'private, no-cache'
+
+
+def calcular_etag(validador):
+    """
+    @brief Deriva un ETag de un validador.
+
+    @details
+    El ETag incluye la ruta y los parámetros de la petición, porque el mismo validador
+    corresponde a respuestas distintas según la página solicitada.
+
+    @param validador Tupla (o cualquier valor con `repr` estable) que cambia cuando cambian los datos.
+
+    @return
+    - String con el ETag (sin comillas).
+    """
+    clave = f"{request.path}?{request.query_string.decode('latin-1')}|{validador!r}"
+    return hashlib.sha1(clave.encode('utf-8')).hexdigest()[:20]
+
+
+def respuesta_condicional(validador, generar):
+    """
+    @brief Devuelve 304 si el cliente ya tiene la versión actual, o la respuesta completa con su ETag.
+
+    @param validador Valor que identifica la versión de los datos (ver `calcular_etag`).
+    @param generar Función sin argumentos que construye la respuesta completa; sólo se llama
+    si el cliente no tiene la versión actual.
+
+    @return
+    - Respuesta de Flask (304 sin cuerpo, o la devuelta por `generar`) con las cabeceras `ETag` y `Cache-Control`.
+
+    @code
+    Ejemplo de uso:
+    return respuesta_condicional((total, ultimo_id), lambda: jsonify(listado()))
+    @endcode
+    """
+    etag = calcular_etag(validador)
+    if request.if_none_match.contains_weak(etag):
+        respuesta = make_response('', 304)
+    else:
+        respuesta = make_response(generar())
+    respuesta.set_etag(etag, weak=True)
+    respuesta.headers['Cache-Control'] = CACHE_CONTROL
+    return respuesta
@@ -0,0 +1,78 @@
+from datetime import datetime
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from chatgpt_api.db import get_db
+from chatgpt_api.services.exportacion_service import exportar, importar, ErrorImportacion
+
+exportacion_bp = Blueprint('exportacion', __name__)
+
+@exportacion_bp.route('/api/export', methods=['GET'])
+def exportar_conversaciones():
+    """
+    @brief Exporta todas las conversaciones y sus mensajes como NDJSON.
+
+    @details
+    La respuesta se genera a medida que se lee la base de datos, con memoria constante,
+    así que sirve para copias de seguridad de cualquier tamaño. El formato se describe en
+    `services/exportacion_service.py` y es el que acepta `POST /api/import`.
+
+    @return
+    - 200 OK: Cuerpo `application/x-ndjson` (una línea de cabecera y una línea por
+      conversación o mensaje), como fichero adjunto.
+
+    @code
+    Ejemplo de uso:
+    curl -o copia.ndjson http://localhost:5000/api/export
+
+    Contenido:
+    {"tipo": "exportacion", "version": 1, "fecha": "2025-04-20T10:00:00"}
+    {"tipo": "conversacion", "id": 123, "nombre": "Mi Conversación", "modelo": "gpt-4o", ...}
+    {"tipo": "mensaje", "conversacion_id": 123, "mensaje": "Hola", "es_usuario": true, ...}
+    @endcode
+    """
+    db_session = get_db()
+    nombre = f"chatgpt-{datetime.utcnow():%Y%m%d-%H%M%S}.ndjson"
+    return Response(
+        stream_with_context(exportar(db_session)),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename="{nombre}"'},
+    )
+
+@exportacion_bp.route('/api/import', methods=['POST'])
+def importar_conversaciones():
+    """
+    @brief Importa conversaciones y mensajes desde un cuerpo NDJSON.
+
+    @details
+    El cuerpo se lee línea a línea, sin cargarlo entero en memoria, y se inserta en bloques
+    con una transacción por bloque. Las conversaciones reciben IDs nuevos, así que puede
+    importarse en una base de datos que ya tenga conversaciones (o importarse dos veces,
+    duplicándolas).
+
+    @return
+    - 200 OK: Número de conversaciones y mensajes importados.
+    - 400 Bad Request: Si una línea no es válida. Incluye el número de línea y lo que se
+      importó en los bloques anteriores, que se conserva.
+
+    @code
+    Ejemplo de uso:
+    curl -X POST http://localhost:5000/api/import -H 'Content-Type: application/x-ndjson' \
+         --data-binary @copia.ndjson
+
+    Respuesta esperada:
+    {
+        "conversaciones": 120,
+        "mensajes": 48210
+    }
+    @endcode
+    """
+    db_session = get_db()
+    try:
+        resultado = importar(db_session, request.stream)
+    except ErrorImportacion as e:
+        return jsonify({
+            'error': str(e),
+            'linea': e.linea,
+            'conversaciones': e.resultado.conversaciones,
+            'mensajes': e.resultado.mensajes,
+        }), 400
+    return jsonify(resultado._asdict())
@@ -1,57 +1,137 @@
+import json
 import logging
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context, url_for
+from sqlalchemy import func, select
 from chatgpt_api.db import get_db
+from chatgpt_api.api.paginacion import leer_limite, leer_id, CursorInvalido
+from chatgpt_api.api.etag import respuesta_condicional
+from chatgpt_api.api.serializacion import lista_json
 from chatgpt_api.models import Mensaje, Conversacion
-from chatgpt_api.services.openai_service import obtener_respuesta_openai, obtener_resumen_historial, contar_tokens
+from chatgpt_api.services.openai_service import obtener_respuesta_openai, obtener_respuesta_openai_stream
+from chatgpt_api.services.chat_service import construir_historial, guardar_intercambio
+from chatgpt_api.services.trabajos_service import encolar, trabajo_to_dict
+from chatgpt_api.services.archivo_service import restaurar
+
+logger = logging.getLogger(__name__)
+
+'''! @brief Filas que se leen de la base de datos en cada lote al serializar una página de mensajes'''
+LOTE_MENSAJES = 100
 
 mensaje_bp = Blueprint('mensaje', __name__)
 
+def evento_sse(datos, evento=None):
+    """
+    @brief Formatea un evento Server-Sent Events.
+
+    @param datos Diccionario que se serializa como JSON en el campo `data`.
+    @param evento Nombre opcional del evento (`error`, `fin`...).
+
+    @return
+    - String con el evento listo para escribirse en la respuesta.
+    """
+    cabecera = f"event: {evento}\n" if evento else ""
+    return f"{cabecera}data: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+def _pagina_mensajes(db_session, id, limite, antes_de, despues_de):
+    """
+    @brief Consulta y serializa una página de `GET /api/chat/<id>` (ver `obtener_mensajes`).
+
+    @details
+    Primero se leen sólo los IDs de la página, que salen del índice `(conversacion_id, id)`
+    sin tocar los textos. Como una página es un tramo contiguo de la conversación, después
+    basta con recorrer ese rango de IDs en orden cronológico y escribir cada fila en la
+    respuesta a medida que llega del cursor, sin construir la lista entera en memoria.
+    """
+    consulta = select(Mensaje.id).where(Mensaje.conversacion_id == id)
+    if despues_de is not None:
+        consulta = consulta.where(Mensaje.id > despues_de).order_by(Mensaje.id)
+    else:
+        if antes_de is not None:
+            consulta = consulta.where(Mensaje.id < antes_de)
+        consulta = consulta.order_by(Mensaje.id.desc())
+    ids = db_session.execute(consulta.limit(limite + 1)).scalars().all()
+    hay_mas = len(ids) > limite
+    ids = ids[:limite]
+    # En ambos sentidos el último ID leído es el extremo desde el que continuar
+    siguiente_cursor = ids[-1] if hay_mas else None
+    filas = ()
+    if ids:
+        filas = db_session.execute(
+            select(Mensaje.id, Mensaje.mensaje, Mensaje.es_usuario, Mensaje.fecha_creacion)
+            .where(Mensaje.conversacion_id == id, Mensaje.id.between(min(ids[0], ids[-1]), max(ids[0], ids[-1])))
+            .order_by(Mensaje.id)
+            .execution_options(yield_per=LOTE_MENSAJES)
+        )
+    logger.debug(f"Mensajes recuperados de la conversación {id}: {len(ids)}")
+    mensajes = (
+        {'id': m_id, 'mensaje': texto, 'es_usuario': bool(es_usuario), 'fecha_creacion': fecha}
+        for m_id, texto, es_usuario, fecha in filas
+    )
+    return Response(
+        stream_with_context(lista_json('mensajes', mensajes, {'siguiente_cursor': siguiente_cursor})),
+        mimetype='application/json',
+    )
+
 @mensaje_bp.route('/api/chat/<int:id>', methods=['GET'])
 def obtener_mensajes(id):
     """
-    @brief Recupera los mensajes de una conversación específica.
+    @brief Recupera una página de mensajes de una conversación específica.
 
     @details
-    Este endpoint permite obtener todos los mensajes asociados a una conversación 
-    específica en orden de fecha de creación. Devuelve tanto los mensajes de los usuarios 
-    como los del sistema (si existen).
+    Este endpoint devuelve los mensajes asociados a una conversación paginados por cursor
+    sobre `Mensaje.id`. Sin cursor devuelve la página más reciente; con `before` devuelve
+    los mensajes anteriores a ese ID y con `after` los posteriores. Devuelve tanto los
+    mensajes de los usuarios como los del asistente.
 
     @param id Identificador único de la conversación cuyos mensajes se desean obtener.
+    @param limit (query, opcional) Número de mensajes por página (por defecto 50, máximo 500).
+    @param before (query, opcional) Devuelve los mensajes con ID menor que éste.
+    @param after (query, opcional) Devuelve los mensajes con ID mayor que éste.
 
     @return
-    - 200 OK: Devuelve una lista de mensajes de la conversación en formato JSON.
+    - 200 OK: Devuelve la página de mensajes en formato JSON y el cursor para continuar
+      en la misma dirección (`null` si no hay más mensajes).
+    - 304 Not Modified: Si el ETag enviado en `If-None-Match` coincide (no hay mensajes nuevos ni borrados).
+    - 400 Bad Request: Si algún parámetro de paginación no es válido.
 
     @note
-    El historial de mensajes se devuelve ordenado por la fecha de creación de cada mensaje.
+    Los mensajes de cada página se devuelven siempre en orden cronológico (por `id`).
     Incluye información de si el mensaje es del usuario o de OpenAI (es_usuario)
 
     @code
     Ejemplo de solicitud:
-    GET /api/chat/123
+    GET /api/chat/123?limit=2
 
     Respuesta esperada:
-    [
-        {
-            "mensaje": "Hola, ¿cómo estás?",
-            "es_usuario": true,
-            "fecha_creacion": "2025-04-14T10:00:00"
-        },
-        ...
-    ]
+    {
+        "mensajes": [
+            {
+                "id": 41,
+                "mensaje": "Hola, ¿cómo estás?",
+                "es_usuario": true,
+                "fecha_creacion": "2025-04-14T10:00:00"
+            },
+            ...
+        ],
+        "siguiente_cursor": 41
+    }
+
+    Página anterior:
+    GET /api/chat/123?limit=2&before=41
     @endcode
     """
+    try:
+        limite = leer_limite()
+        antes_de = leer_id('before')
+        despues_de = leer_id('after')
+    except CursorInvalido as e:
+        return jsonify({'error': str(e)}), 400
+
     db_session = get_db()
-    mensajes = db_session.query(Mensaje).filter_by(conversacion_id=id).order_by(Mensaje.fecha_creacion).all()
-    resultado = [
-        {
-            'mensaje': m.mensaje,
-            'es_usuario': bool(m.es_usuario),
-            'fecha_creacion': m.fecha_creacion.isoformat() if m.fecha_creacion else None
-        }
-        for m in mensajes
-    ]
-    logging.info(f"[DEBUG] Mensajes recuperados: {resultado}")
-    return jsonify(resultado)
+    restaurar(db_session, id)  # Conversación archivada: sus mensajes vuelven a `mensaje`
+    # Validador: los mensajes no se editan, así que basta con el número de mensajes y el último ID
+    validador = db_session.query(func.count(Mensaje.id), func.max(Mensaje.id)).filter_by(conversacion_id=id).one()
+    return respuesta_condicional(tuple(validador), lambda: _pagina_mensajes(db_session, id, limite, antes_de, despues_de))
 
 @mensaje_bp.route('/api/chat/<int:id>', methods=['POST'])
 def enviar_mensaje(id):
@@ -61,20 +141,24 @@ def enviar_mensaje(id):
     @details
     Este endpoint permite enviar un mensaje de usuario a la conversación especificada.
     Después de recibir el mensaje, el sistema genera una respuesta utilizando la API de OpenAI.
-    Si el contexto está activado, se conserva el historial de mensajes, y si el número de tokens 
-    excede el límite, el historial se resume. El modelo de conversación también se consulta 
+    Si el contexto está activado, se conserva el historial de mensajes, y si el número de tokens
+    excede el límite, el historial se resume. El modelo de conversación también se consulta
     antes de generar una respuesta.
 
     @param id Identificador único de la conversación a la que se está enviando el mensaje.
 
     @return
     - 200 OK: Si el mensaje es procesado correctamente, devuelve la respuesta del asistente en formato JSON.
+    - 202 Accepted: Con la cabecera `Prefer: respond-async`, devuelve el trabajo en segundo plano creado
+      (su estado y resultado se consultan en `GET /api/jobs/<id>`, indicado en la cabecera `Location`).
     - 400 Bad Request: Si el mensaje proporcionado está vacío.
     - 500 Internal Server Error: Si ocurre un error al comunicarse con OpenAI.
 
     @note
     Si el contexto está activado en la conversación, el sistema almacenará y procesará el historial de mensajes.
     Si se excede el límite de tokens, el historial será resumido para ajustarse al límite.
+    Si la solicitud incluye la cabecera `Accept: text/event-stream`, la respuesta se envía en
+    streaming (ver `enviar_mensaje_stream`).
 
     @code
     Ejemplo de solicitud:
@@ -89,39 +173,151 @@ def enviar_mensaje(id):
     }
     @endcode
     """
+    if 'respond-async' in request.headers.get('Prefer', ''):
+        return encolar_mensaje(id)
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        return enviar_mensaje_stream(id)
     data = request.get_json()
     mensaje_usuario = data.get('mensaje')
     if not mensaje_usuario:
         return jsonify({'error': 'Mensaje vacío'}), 400
 
     db_session = get_db()
-    mensajes_db = db_session.query(Mensaje).filter_by(conversacion_id=id).order_by(Mensaje.fecha_creacion).all()
-    mensajes_historial = [
-        {'role': 'user' if msg.es_usuario else 'assistant', 'content': msg.mensaje}
-        for msg in mensajes_db
-    ]
     conv = db_session.query(Conversacion).filter_by(id=id).first()
     if not conv:
         return jsonify({'error': 'Conversación no encontrada'}), 404
-    contexto_activado = conv.contexto
-    if contexto_activado:
-        mensajes_historial.append({'role': 'user', 'content': mensaje_usuario})
-        num_tokens = contar_tokens(mensajes_historial)
-        if num_tokens > 1000:
-            resumen = obtener_resumen_historial(mensajes_historial)
-            mensajes_historial = [{'role': 'user', 'content': mensaje_usuario}, {'role': 'assistant', 'content': resumen}]
-    else:
-        mensajes_historial = [{'role': 'user', 'content': mensaje_usuario}]
+    mensajes_historial = construir_historial(db_session, conv, mensaje_usuario)
     modelo = conv.modelo
-    if not any(msg['role'] == 'system' for msg in mensajes_historial):
-        mensajes_historial.insert(0, {"role": "system", "content": "Salida formato Markdown"})
-    logging.info(f"[DEBUG] Enviando historial al modelo {modelo}.")
-    respuesta = obtener_respuesta_openai(mensajes_historial, modelo)
+    logger.debug(f"Enviando historial al modelo {modelo}.")
+    respuesta = obtener_respuesta_openai(mensajes_historial, modelo, usar_cache=conv.usar_cache)
     if "Error" in respuesta:
         return jsonify({'error': respuesta}), 500
-    nuevo_mensaje = Mensaje(conversacion_id=id, mensaje=mensaje_usuario, es_usuario=True)
-    db_session.add(nuevo_mensaje)
-    nuevo_mensaje_ia = Mensaje(conversacion_id=id, mensaje=respuesta, es_usuario=False)
-    db_session.add(nuevo_mensaje_ia)
-    db_session.commit()
+    guardar_intercambio(db_session, id, mensaje_usuario, respuesta, modelo)
     return jsonify({'respuesta': respuesta})
+
+def encolar_mensaje(id):
+    """
+    @brief Guarda el mensaje como trabajo en segundo plano y responde sin esperar a OpenAI.
+
+    @details
+    Variante de `enviar_mensaje` para `Prefer: respond-async`. Los hilos de
+    `trabajos_service` generan la respuesta y guardan los mensajes en la conversación.
+
+    @param id Identificador único de la conversación.
+
+    @return
+    - 202 Accepted: El trabajo creado (ver `GET /api/jobs/<id>`), con la cabecera `Location`.
+    - 400 Bad Request: Si el mensaje proporcionado está vacío.
+    - 404 Not Found: Si la conversación no existe.
+
+    @code
+    Ejemplo de solicitud:
+    POST /api/chat/123
+    Prefer: respond-async
+    {
+        "mensaje": "Escribe un informe detallado sobre..."
+    }
+
+    Respuesta esperada (202):
+    {
+        "id": 7,
+        "conversacion_id": 123,
+        "estado": "pendiente",
+        ...
+    }
+    @endcode
+    """
+    data = request.get_json()
+    mensaje_usuario = data.get('mensaje')
+    if not mensaje_usuario:
+        return jsonify({'error': 'Mensaje vacío'}), 400
+
+    db_session = get_db()
+    if db_session.query(Conversacion.id).filter_by(id=id).first() is None:
+        return jsonify({'error': 'Conversación no encontrada'}), 404
+    trabajo = encolar(db_session, id, mensaje_usuario)
+    return jsonify(trabajo_to_dict(trabajo)), 202, {
+        'Location': url_for('trabajo.obtener_trabajo', id=trabajo.id),
+        'Preference-Applied': 'respond-async',
+    }
+
+@mensaje_bp.route('/api/chat/<int:id>/stream', methods=['POST'])
+def enviar_mensaje_stream(id):
+    """
+    @brief Envía un mensaje de usuario y devuelve la respuesta del asistente en streaming (SSE).
+
+    @details
+    Igual que `enviar_mensaje`, pero la respuesta se reenvía al cliente como eventos
+    Server-Sent Events a medida que OpenAI la genera, de forma que el primer fragmento
+    llega en cuanto el modelo empieza a responder.
+
+    Los mensajes del usuario y del asistente se guardan cuando termina el streaming. Si el
+    cliente cierra la conexión o se produce un error a mitad de la generación, se guarda
+    el contenido parcial recibido hasta ese momento; si el error llega antes del primer
+    fragmento, se guarda sólo el mensaje del usuario.
+
+    @param id Identificador único de la conversación a la que se está enviando el mensaje.
+
+    @return
+    - 200 OK: Flujo `text/event-stream` con los eventos:
+        - `data: {"delta": "..."}` por cada fragmento de la respuesta.
+        - `event: fin` con `{"fin": true}` cuando la respuesta está completa y guardada.
+        - `event: error` con `{"error": "..."}` si falla la comunicación con OpenAI.
+    - 400 Bad Request: Si el mensaje proporcionado está vacío.
+    - 404 Not Found: Si la conversación no existe.
+
+    @code
+    Ejemplo de solicitud:
+    POST /api/chat/123/stream
+    {
+        "mensaje": "¿Cómo puedo integrar la API de OpenAI?"
+    }
+
+    Respuesta esperada:
+    data: {"delta": "Para"}
+
+    data: {"delta": " integrar"}
+
+    event: fin
+    data: {"fin": true}
+    @endcode
+    """
+    data = request.get_json()
+    mensaje_usuario = data.get('mensaje')
+    if not mensaje_usuario:
+        return jsonify({'error': 'Mensaje vacío'}), 400
+
+    db_session = get_db()
+    conv = db_session.query(Conversacion).filter_by(id=id).first()
+    if not conv:
+        return jsonify({'error': 'Conversación no encontrada'}), 404
+    mensajes_historial = construir_historial(db_session, conv, mensaje_usuario)
+    modelo = conv.modelo
+    usar_cache = conv.usar_cache
+    logger.debug(f"Enviando historial al modelo {modelo} (streaming).")
+
+    def generar():
+        partes = []
+        completado = fallido = False
+        try:
+            for delta in obtener_respuesta_openai_stream(mensajes_historial, modelo, usar_cache):
+                partes.append(delta)
+                yield evento_sse({'delta': delta})
+            completado = True
+        except Exception as e:
+            fallido = True
+            logger.error(f"Error en el streaming de OpenAI: {str(e)}")
+            yield evento_sse({'error': f"Error al obtener respuesta de OpenAI: {str(e)}"}, 'error')
+        finally:
+            # Se ejecuta también si el cliente corta la conexión (GeneratorExit)
+            if partes or fallido:
+                # Sin ningún fragmento se guarda sólo el mensaje del usuario
+                guardar_intercambio(db_session, id, mensaje_usuario, ''.join(partes) or None, modelo)
+        if completado:
+            yield evento_sse({'fin': True}, 'fin')
+
+    return Response(
+        stream_with_context(generar()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
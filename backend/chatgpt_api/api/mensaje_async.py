@@ -0,0 +1,205 @@
+"""! @brief Endpoints de chat asíncronos para el punto de entrada ASGI"""
+##
+# @file mensaje_async.py
+#
+# @brief Versión asíncrona de `POST /api/chat/<id>` y `POST /api/chat/<id>/stream`.
+#
+# @section description_mensaje_async Descripción
+# Estos manejadores ASGI se usan desde `asgi.py`. Mientras se espera a OpenAI no
+# ocupan ningún hilo, de modo que un único proceso puede mantener cientos de
+# generaciones en curso. El acceso a la base de datos se delega en el pool de
+# hilos mediante `ejecutar_en_db`.
+#
+# El contrato (cuerpo de la petición, códigos de estado y formato de la respuesta)
+# es idéntico al de los endpoints equivalentes de `mensaje.py`.
+import asyncio
+import json
+import logging
+from chatgpt_api.db import ejecutar_en_db
+from chatgpt_api.models import Conversacion
+from chatgpt_api.api.mensaje import evento_sse
+from chatgpt_api.services.chat_service import (
+    preparar_historial,
+    completar_historial,
+    resumen_valido,
+    guardar_resumen,
+    guardar_intercambio,
+    MAX_RONDAS_RESUMEN,
+)
+from chatgpt_api.services.openai_service import (
+    obtener_respuesta_openai_async,
+    obtener_respuesta_openai_stream_async,
+    obtener_resumen_historial_async,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def leer_cuerpo(receive):
+    """
+    @brief Lee el cuerpo completo de una petición HTTP ASGI.
+    @param receive Canal `receive` de ASGI.
+    @return Bytes con el cuerpo de la petición.
+    """
+    cuerpo = b''
+    while True:
+        evento = await receive()
+        if evento['type'] == 'http.disconnect':
+            break
+        cuerpo += evento.get('body', b'')
+        if not evento.get('more_body', False):
+            break
+    return cuerpo
+
+
+async def enviar_json(send, estado, datos):
+    """
+    @brief Envía una respuesta JSON completa por el canal ASGI.
+    @param send Canal `send` de ASGI.
+    @param estado Código de estado HTTP.
+    @param datos Objeto serializable a JSON.
+    """
+    cuerpo = json.dumps(datos, ensure_ascii=False).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': estado,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(cuerpo)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': cuerpo})
+
+
+def _preparar(db_session, id, mensaje_usuario):
+    """
+    @brief Carga la conversación y prepara el historial (se ejecuta en el pool de hilos).
+    @return `None` si la conversación no existe, o la tupla `(modelo, usar_cache, plan)`.
+    """
+    conv = db_session.query(Conversacion).filter_by(id=id).first()
+    if conv is None:
+        return None
+    return conv.modelo, conv.usar_cache, preparar_historial(db_session, conv, mensaje_usuario)
+
+
+async def _historial(send, id, cuerpo):
+    """
+    @brief Valida la petición y construye el historial que se enviará a OpenAI.
+
+    @return
+    - `None` si ya se ha respondido con un error (400/404).
+    - Tupla `(mensaje_usuario, modelo, usar_cache, mensajes_historial)` en caso contrario.
+    """
+    try:
+        data = json.loads(cuerpo or b'{}')
+    except ValueError:
+        await enviar_json(send, 400, {'error': 'JSON inválido'})
+        return None
+    mensaje_usuario = data.get('mensaje') if isinstance(data, dict) else None
+    if not mensaje_usuario:
+        await enviar_json(send, 400, {'error': 'Mensaje vacío'})
+        return None
+
+    preparado = await ejecutar_en_db(_preparar, id, mensaje_usuario)
+    if preparado is None:
+        await enviar_json(send, 404, {'error': 'Conversación no encontrada'})
+        return None
+    modelo, usar_cache, plan = preparado
+    for _ in range(MAX_RONDAS_RESUMEN):
+        if not plan.a_resumir:
+            break
+        resumen = await obtener_resumen_historial_async(plan.a_resumir)
+        if not resumen_valido(resumen):
+            logger.error(f"No se pudo actualizar el resumen de la conversación {id}: {resumen}")
+            break
+        await ejecutar_en_db(guardar_resumen, id, resumen, plan.resumen_hasta_id)
+        preparado = await ejecutar_en_db(_preparar, id, mensaje_usuario)
+        if preparado is None:
+            # Se ha eliminado la conversación mientras se resumía
+            await enviar_json(send, 404, {'error': 'Conversación no encontrada'})
+            return None
+        _, _, plan = preparado
+    return mensaje_usuario, modelo, usar_cache, completar_historial(plan, mensaje_usuario)
+
+
+async def enviar_mensaje(id, receive, send):
+    """
+    @brief Versión asíncrona de `POST /api/chat/<id>`.
+
+    @param id Identificador único de la conversación.
+    @param receive Canal `receive` de ASGI.
+    @param send Canal `send` de ASGI.
+    """
+    preparado = await _historial(send, id, await leer_cuerpo(receive))
+    if preparado is None:
+        return
+    mensaje_usuario, modelo, usar_cache, mensajes_historial = preparado
+    logger.debug(f"Enviando historial al modelo {modelo} (async).")
+    respuesta = await obtener_respuesta_openai_async(mensajes_historial, modelo, usar_cache)
+    if "Error" in respuesta:
+        await enviar_json(send, 500, {'error': respuesta})
+        return
+    await ejecutar_en_db(guardar_intercambio, id, mensaje_usuario, respuesta, modelo)
+    await enviar_json(send, 200, {'respuesta': respuesta})
+
+
+async def enviar_mensaje_stream(id, receive, send):
+    """
+    @brief Versión asíncrona de `POST /api/chat/<id>/stream` (Server-Sent Events).
+
+    @details
+    Se vigila en paralelo el evento `http.disconnect` para dejar de consumir el stream de
+    OpenAI en cuanto el cliente se desconecta. En ese caso, igual que en la versión WSGI,
+    se guarda la respuesta parcial recibida hasta el momento.
+
+    @param id Identificador único de la conversación.
+    @param receive Canal `receive` de ASGI.
+    @param send Canal `send` de ASGI.
+    """
+    preparado = await _historial(send, id, await leer_cuerpo(receive))
+    if preparado is None:
+        return
+    mensaje_usuario, modelo, usar_cache, mensajes_historial = preparado
+    logger.debug(f"Enviando historial al modelo {modelo} (async, streaming).")
+
+    desconectado = asyncio.Event()
+
+    async def vigilar_desconexion():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        desconectado.set()
+
+    vigilante = asyncio.create_task(vigilar_desconexion())
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+
+    partes = []
+    completado = fallido = False
+    deltas = obtener_respuesta_openai_stream_async(mensajes_historial, modelo, usar_cache)
+    try:
+        async for delta in deltas:
+            if desconectado.is_set():
+                break
+            partes.append(delta)
+            await send({'type': 'http.response.body', 'body': evento_sse({'delta': delta}).encode('utf-8'), 'more_body': True})
+        else:
+            completado = True
+    except Exception as e:
+        fallido = True
+        logger.error(f"Error en el streaming de OpenAI: {str(e)}")
+        error = evento_sse({'error': f"Error al obtener respuesta de OpenAI: {str(e)}"}, 'error')
+        await send({'type': 'http.response.body', 'body': error.encode('utf-8'), 'more_body': True})
+    finally:
+        vigilante.cancel()
+        await deltas.aclose()
+        if partes or fallido:
+            # shield: la respuesta parcial (o sólo el mensaje del usuario) se guarda aunque la tarea se cancele
+            respuesta = ''.join(partes) or None
+            await asyncio.shield(ejecutar_en_db(guardar_intercambio, id, mensaje_usuario, respuesta, modelo))
+
+    fin = evento_sse({'fin': True}, 'fin') if completado else ''
+    await send({'type': 'http.response.body', 'body': fin.encode('utf-8'), 'more_body': False})
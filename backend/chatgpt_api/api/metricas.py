@@ -0,0 +1,109 @@
+import time
+from flask import Blueprint, Response, g, request
+from chatgpt_api.db import db_engine
+from chatgpt_api.api.cierre import al_terminar
+from chatgpt_api.services.cache_service import cache_respuestas
+from chatgpt_api.services.planificador_service import planificador
+from chatgpt_api.services.metricas_service import (
+    registro,
+    MetricaCalculada,
+    TIPO_CONTENIDO,
+    instrumentar_motor,
+    registrar_peticion,
+)
+
+metricas_bp = Blueprint('metricas', __name__)
+
+'''! @brief Etiqueta `ruta` de las peticiones que no coinciden con ninguna ruta (404)'''
+RUTA_DESCONOCIDA = 'desconocida'
+
+@metricas_bp.route('/metrics', methods=['GET'])
+def metricas():
+    """
+    @brief Publica las métricas del proceso en formato de texto de Prometheus.
+
+    @details
+    Incluye los contadores e histogramas de `metricas_service` (peticiones HTTP, sentencias
+    SQL, recuento de tokens, respuestas y llamadas a OpenAI) y, calculados en el momento,
+    los contadores de la caché de respuestas y el estado del planificador. No requiere
+    autenticación: conviene restringir la ruta en el proxy.
+
+    @return
+    - 200 OK: Cuerpo `text/plain; version=0.0.4`.
+
+    @code
+    Ejemplo de uso:
+    curl http://localhost:5000/metrics
+
+    Respuesta esperada (fragmento):
+    # HELP flaskchat_peticiones_total Peticiones HTTP atendidas
+    # TYPE flaskchat_peticiones_total counter
+    flaskchat_peticiones_total{metodo="GET",ruta="/api/conversaciones",estado="200"} 12
+    @endcode
+    """
+    return Response(registro.exponer(), content_type=TIPO_CONTENIDO)
+
+@registro.colector
+def _metricas_cache():
+    """! @brief Consultas a la caché de respuestas por resultado."""
+    datos = cache_respuestas.estadisticas()
+    return [MetricaCalculada(
+        'flaskchat_cache_consultas_total', 'counter', 'Consultas a la caché de respuestas', ['resultado'],
+        [(('acierto_memoria',), datos['aciertos_memoria']),
+         (('acierto_disco',), datos['aciertos_disco']),
+         (('fallo',), datos['fallos'])],
+    )]
+
+@registro.colector
+def _metricas_planificador():
+    """! @brief Peticiones en cola y saldos del planificador por modelo."""
+    datos = sorted(planificador.estadisticas().items())
+    return [
+        MetricaCalculada(
+            'flaskchat_planificador_en_cola', 'gauge', 'Peticiones a OpenAI esperando turno', ['modelo'],
+            [((modelo,), d['en_cola']) for modelo, d in datos],
+        ),
+        MetricaCalculada(
+            'flaskchat_planificador_tokens_disponibles', 'gauge', 'Tokens por minuto disponibles', ['modelo'],
+            [((modelo,), d['tokens_disponibles']) for modelo, d in datos],
+        ),
+        MetricaCalculada(
+            'flaskchat_planificador_peticiones_disponibles', 'gauge', 'Peticiones por minuto disponibles', ['modelo'],
+            [((modelo,), d['peticiones_disponibles']) for modelo, d in datos],
+        ),
+    ]
+
+def instrumentar_app(app):
+    """
+    @brief Registra en las métricas todas las peticiones atendidas por la aplicación Flask.
+
+    @details
+    La duración se mide desde `before_request` hasta `after_request` o, en las respuestas
+    en streaming, hasta que se envía (o se interrumpe) el último fragmento o se cierra la
+    respuesta (ver `cierre.al_terminar`). La etiqueta `ruta` es la plantilla de la regla (`/api/chat/<int:id>`) para
+    no crear una serie por cada ID. También se miden las sentencias SQL del motor de la
+    aplicación.
+
+    @param app Aplicación Flask.
+    """
+    instrumentar_motor(db_engine)
+
+    @app.before_request
+    def _iniciar_cronometro():
+        g.inicio_metricas = time.perf_counter()
+
+    @app.after_request
+    def _registrar_peticion(response):
+        inicio = g.pop('inicio_metricas', None)
+        if inicio is None:
+            return response
+        metodo, estado = request.method, response.status_code
+        ruta = request.url_rule.rule if request.url_rule else RUTA_DESCONOCIDA
+        def registrar():
+            registrar_peticion(metodo, ruta, estado, time.perf_counter() - inicio)
+
+        if response.is_streamed:
+            al_terminar(response, registrar)
+        else:
+            registrar()
+        return response
@@ -1,7 +1,8 @@
 from flask import Blueprint, request, jsonify
 from chatgpt_api.db import get_db
 from chatgpt_api.models import Conversacion
-from chatgpt_api.services.openai_service import get_available_models
+from chatgpt_api.services.modelos_service import registro_modelos
+from chatgpt_api.api.etag import respuesta_condicional
 
 modelo_bp = Blueprint('modelo', __name__)
 
@@ -18,6 +19,7 @@ def obtener_modelo(id):
 
     @return
     - 200 OK: Si la conversación se encuentra, devuelve el modelo asociado.
+    - 304 Not Modified: Si el ETag enviado en `If-None-Match` coincide con la versión actual.
     - 404 Not Found: Si no se encuentra una conversación con el ID proporcionado.
 
     @note
@@ -37,7 +39,7 @@ def obtener_modelo(id):
     conv = db_session.query(Conversacion).filter_by(id=id).first()
     if conv is None:
         return jsonify({'error': 'Conversación no encontrada'}), 404
-    return jsonify({'modelo': conv.modelo})
+    return respuesta_condicional((conv.id, conv.fecha_modificacion), lambda: jsonify({'modelo': conv.modelo}))
 
 
 @modelo_bp.route('/api/modelo/<int:id>', methods=['PUT'])
@@ -48,7 +50,7 @@ def actualizar_modelo(id):
     @details
     Este endpoint permite actualizar el modelo de una conversación almacenada
     en la base de datos. Se valida que el nuevo modelo sea uno de los permitidos
-    (dinámicamente desde la caché OpenAI).
+    (dinámicamente desde el registro de modelos de OpenAI).
 
     @param id Identificador único de la conversación.
     @param modelo El modelo a actualizar, que debe ser uno de los modelos permitidos.
@@ -60,8 +62,7 @@ def actualizar_modelo(id):
     db_session = get_db()
     data = request.get_json()
     nuevo_modelo = data.get('modelo')
-    modelos_disponibles = [m["id"] for m in get_available_models()]
-    if nuevo_modelo not in modelos_disponibles:
+    if not registro_modelos.existe(nuevo_modelo):
         return jsonify({'error': 'Modelo no permitido'}), 400
     conv = db_session.query(Conversacion).filter_by(id=id).first()
     if conv is None:
@@ -74,7 +75,14 @@ def actualizar_modelo(id):
 @modelo_bp.route('/api/models', methods=['GET'])
 def listar_modelos():
     """
-    @brief Devuelve la lista de modelos disponibles (dinámicamente desde la caché OpenAI).
+    @brief Devuelve la lista de modelos disponibles (dinámicamente desde el registro de modelos de OpenAI).
+
+    @note
+    Cada modelo incluye, además de los campos de la API de OpenAI, su ventana de contexto
+    (`contexto`) y su codificación (`codificacion`). La respuesta lleva un ETag derivado de
+    la fecha de la última actualización del registro; si no ha cambiado, se responde 304.
     """
-    modelos = get_available_models()
-    return jsonify({"models": modelos})
+    return respuesta_condicional(
+        registro_modelos.ultima_actualizacion(),
+        lambda: jsonify({"models": registro_modelos.listar()}),
+    )
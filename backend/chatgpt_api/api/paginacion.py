@@ -0,0 +1,129 @@
+"""! @brief Utilidades de paginación por cursor (keyset) para los endpoints de listado"""
+##
+# @file paginacion.py
+#
+# @brief Lectura del parámetro `limit` y codificación de cursores.
+#
+# @section description_paginacion Descripción
+# La paginación por cursor evita `OFFSET`: cada página se obtiene con una condición
+# sobre la clave de ordenación (`id`, o `fecha_creacion` + `id`) a partir del último
+# elemento devuelto, de forma que el coste no crece con el número de páginas.
+from datetime import datetime
+from flask import request
+
+'''! @brief Número de elementos por página si no se indica `limit`'''
+LIMITE_POR_DEFECTO = 50
+
+'''! @brief Máximo de elementos por página que puede solicitarse'''
+LIMITE_MAXIMO = 500
+
+
+class CursorInvalido(ValueError):
+    """! @brief Se lanza cuando un parámetro de paginación no es válido."""
+
+
+def leer_limite():
+    """
+    @brief Lee el parámetro `limit` de la petición.
+
+    @return
+    - Integer entre 1 y `LIMITE_MAXIMO` (por defecto `LIMITE_POR_DEFECTO`).
+
+    @throws CursorInvalido Si `limit` no es un entero positivo.
+    """
+    valor = request.args.get('limit', LIMITE_POR_DEFECTO)
+    try:
+        limite = int(valor)
+    except (TypeError, ValueError):
+        raise CursorInvalido(f"limit no válido: {valor}")
+    if limite < 1:
+        raise CursorInvalido(f"limit no válido: {valor}")
+    return min(limite, LIMITE_MAXIMO)
+
+
+def leer_id(nombre):
+    """
+    @brief Lee un cursor numérico (`before`/`after` sobre un `id`) de la petición.
+
+    @param nombre Nombre del parámetro.
+
+    @return
+    - Integer con el ID, o `None` si el parámetro no se ha enviado.
+
+    @throws CursorInvalido Si el valor no es un entero.
+    """
+    valor = request.args.get(nombre)
+    if valor is None:
+        return None
+    try:
+        return int(valor)
+    except ValueError:
+        raise CursorInvalido(f"{nombre} no válido: {valor}")
+
+
+def codificar_cursor_fecha(fecha, id):
+    """
+    @brief Codifica un cursor compuesto por fecha e ID.
+
+    @param fecha `datetime` de la clave de ordenación.
+    @param id ID del elemento (desempata elementos con la misma fecha).
+
+    @return
+    - String `<fecha ISO>_<id>`.
+    """
+    return f"{fecha.isoformat()}_{id}"
+
+
+def leer_cursor_fecha(nombre):
+    """
+    @brief Lee un cursor compuesto por fecha e ID de la petición.
+
+    @param nombre Nombre del parámetro.
+
+    @return
+    - Tupla `(fecha, id)`, o `None` si el parámetro no se ha enviado.
+
+    @throws CursorInvalido Si el cursor no tiene el formato de `codificar_cursor_fecha`.
+    """
+    valor = request.args.get(nombre)
+    if valor is None:
+        return None
+    try:
+        fecha, id = valor.rsplit('_', 1)
+        return datetime.fromisoformat(fecha), int(id)
+    except ValueError:
+        raise CursorInvalido(f"{nombre} no válido: {valor}")
+
+
+def codificar_cursor_puntuacion(puntuacion, id):
+    """
+    @brief Codifica un cursor compuesto por una puntuación (e.g., el `rank` de FTS5) e ID.
+
+    @param puntuacion Float de la clave de ordenación; se codifica con `repr` para no perder precisión.
+    @param id ID del elemento (desempata elementos con la misma puntuación).
+
+    @return
+    - String `<puntuación>_<id>`.
+    """
+    return f"{puntuacion!r}_{id}"
+
+
+def leer_cursor_puntuacion(nombre):
+    """
+    @brief Lee un cursor compuesto por puntuación e ID de la petición.
+
+    @param nombre Nombre del parámetro.
+
+    @return
+    - Tupla `(puntuacion, id)`, o `None` si el parámetro no se ha enviado.
+
+    @throws CursorInvalido Si el cursor no tiene el formato de `codificar_cursor_puntuacion`.
+    """
+    valor = request.args.get(nombre)
+    if valor is None:
+        return None
+    try:
+        puntuacion, id = valor.rsplit('_', 1)
+        return float(puntuacion), int(id)
+    except ValueError:
+        raise CursorInvalido(f"{nombre} no válido: {valor}")
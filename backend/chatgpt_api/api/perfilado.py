@@ -0,0 +1,90 @@
+"""! @brief Perfilado opcional de peticiones de la aplicación Flask"""
+##
+# @file perfilado.py
+#
+# @brief Hooks que perfilan las peticiones marcadas (o muestreadas) con
+# `perfilado_service.Perfil`.
+#
+# @section description_perfilado Descripción
+# Con `PERFILADO=1` se perfilan las peticiones con la cabecera `X-Perfilar: 1` o el
+# parámetro `?perfilar=1`, y una fracción `PERFILADO_MUESTREO` de las demás. La respuesta
+# lleva la cabecera `X-Perfil` con el prefijo de los ficheros escritos (salvo en las
+# respuestas en streaming, cuyo perfil se guarda al enviar el último fragmento).
+#
+# Las rutas de chat que `asgi.py` atiende de forma asíncrona no pasan por estos hooks.
+import logging
+import os
+import random
+from flask import g, request
+from flask.json.provider import DefaultJSONProvider
+from chatgpt_api.api.cierre import al_terminar
+from chatgpt_api.services import perfilado_service
+from chatgpt_api.services.perfilado_service import Perfil, medir
+
+logger = logging.getLogger(__name__)
+
+
+class ProveedorJSONMedido(DefaultJSONProvider):
+    """! @brief Proveedor JSON de Flask que atribuye la (de)serialización a la parte `json` del perfil."""
+
+    def dumps(self, obj, **kwargs):
+        with medir('json'):
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        with medir('json'):
+            return super().loads(s, **kwargs)
+
+
+def _pide_perfil():
+    """! @brief Indica si la petición actual debe perfilarse."""
+    if request.headers.get('X-Perfilar') == '1' or request.args.get('perfilar') == '1':
+        return True
+    return random.random() < perfilado_service.PERFILADO_MUESTREO
+
+
+def _guardar(perfil):
+    """! @brief Detiene y guarda un perfil sin que un error de escritura afecte a la respuesta."""
+    perfil.terminar()
+    try:
+        return perfil.guardar()
+    except OSError as e:
+        logger.error(f"No se pudo guardar el perfil de {perfil.nombre}: {e}")
+        return None
+
+
+def activar_perfilado(app):
+    """
+    @brief Instala los hooks de perfilado si `PERFILADO=1` (si no, no hace nada).
+
+    @details
+    El perfil se inicia en `before_request` y se detiene en `after_request` o, en las
+    respuestas en streaming, cuando se termina de enviar el cuerpo o se cierra la respuesta
+    (ver `cierre.al_terminar`). Además sustituye el
+    proveedor JSON de Flask por `ProveedorJSONMedido` para medir la serialización.
+
+    @param app Aplicación Flask.
+    """
+    if not perfilado_service.PERFILADO:
+        return
+    app.json = ProveedorJSONMedido(app)
+    os.makedirs(perfilado_service.PERFILADO_DIR, exist_ok=True)
+    logger.warning(f"Perfilado activo: los perfiles se guardan en {os.path.abspath(perfilado_service.PERFILADO_DIR)}")
+
+    @app.before_request
+    def _iniciar_perfil():
+        if _pide_perfil():
+            g.perfil = Perfil(f"{request.method} {request.path}")
+            g.perfil.iniciar()
+
+    @app.after_request
+    def _terminar_perfil(response):
+        perfil = g.pop('perfil', None)
+        if perfil is None:
+            return response
+        if response.is_streamed:
+            return al_terminar(response, lambda: _guardar(perfil))
+        base = _guardar(perfil)
+        if base:
+            response.headers['X-Perfil'] = os.path.basename(base)
+        return response
@@ -0,0 +1,89 @@
+"""! @brief Serialización JSON rápida y en streaming de listados grandes"""
+##
+# @file serializacion.py
+#
+# @brief Codificador JSON (orjson si está instalado) y generador de respuestas JSON
+# que se escriben a medida que se leen las filas de la base de datos.
+#
+# @section description_serializacion Descripción
+# `jsonify` construye la lista completa de diccionarios y la serializa de una vez, así
+# que la memoria y el tiempo hasta el primer byte crecen con el tamaño de la página.
+# `lista_json` serializa fila a fila desde el cursor y envía el resultado en bloques de
+# `JSON_BLOQUE` bytes, igual que la exportación NDJSON.
+#
+# orjson es opcional: si no está instalado se usa `json` de la biblioteca estándar. En
+# ambos casos la salida es UTF-8 sin escapar y sin espacios, y las fechas se escriben en
+# ISO 8601 (orjson las serializa directamente, sin `isoformat()` por fila).
+#
+# El tiempo de serialización se atribuye a la parte `json` del perfil activo, como hace
+# `ProveedorJSONMedido` con `jsonify`.
+#
+# @code
+# Ejemplo de uso:
+# filas = ({'id': id, 'texto': texto} for id, texto in db_session.execute(consulta))
+# return Response(stream_with_context(lista_json('mensajes', filas, {'siguiente_cursor': 41})),
+#                 mimetype='application/json')
+# @endcode
+import json
+import time
+from datetime import date, datetime
+from chatgpt_api.services.perfilado_service import sumar as sumar_perfil
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+'''! @brief Tamaño aproximado (bytes) de cada bloque de las respuestas JSON en streaming'''
+JSON_BLOQUE = 64 * 1024
+
+
+def _por_defecto(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    raise TypeError(f"Tipo no serializable en JSON: {type(valor).__name__}")
+
+
+def dumps(obj):
+    """
+    @brief Serializa un valor a JSON.
+    @param obj Valor con diccionarios, listas, strings, números, booleanos, None y fechas.
+    @return bytes con el JSON en UTF-8.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_por_defecto).encode('utf-8')
+
+
+def lista_json(clave, filas, extra=None, bloque=JSON_BLOQUE):
+    """
+    @brief Genera un objeto JSON `{clave: [filas...], extra...}` en bloques.
+
+    @param clave Nombre del campo con la lista.
+    @param filas Iterable de valores serializables (normalmente un generador sobre un cursor).
+    @param extra Diccionario opcional con los demás campos del objeto, que se escriben después de la lista.
+    @param bloque Tamaño aproximado de cada bloque en bytes.
+
+    @return
+    - Generador de bytes; la concatenación de todos es el documento JSON.
+    """
+    pendientes, tamano = [b'{', dumps(clave), b':['], 0
+    separador = b''
+    duracion = 0.0
+    for fila in filas:
+        inicio = time.perf_counter()
+        texto = dumps(fila)
+        duracion += time.perf_counter() - inicio
+        pendientes += (separador, texto)
+        separador = b','
+        tamano += len(texto)
+        if tamano >= bloque:
+            sumar_perfil('json', duracion)
+            yield b''.join(pendientes)
+            pendientes, tamano, duracion = [], 0, 0.0
+    pendientes.append(b']')
+    for nombre, valor in (extra or {}).items():
+        pendientes += (b',', dumps(nombre), b':', dumps(valor))
+    pendientes.append(b'}')
+    sumar_perfil('json', duracion)
+    yield b''.join(pendientes)
@@ -17,7 +17,7 @@
 # @file tools.py
 
 from flask import Blueprint, request, jsonify
-import openai
+from chatgpt_api.services.transporte_service import obtener_cliente
 
 # Definición del Blueprint
 tools_bp = Blueprint('tools', __name__, url_prefix='/api/tools')
@@ -70,7 +70,7 @@ def list_openai_files():
     '''
     try:
         #! Solicita a la API de OpenAI la lista completa de archivos subidos
-        response = openai.files.list()
+        response = obtener_cliente().files.list()
 
         #! Procesa los archivos recibidos, filtrando sólo aquellos con propósito 'assistants'
         files_info = [
@@ -126,7 +126,7 @@ def upload_file_to_openai():
             return jsonify({'error': 'No se proporcionó el archivo'}), 400
 
         #! Carga el archivo en la API de OpenAI
-        response = openai.files.create(file=file, purpose='assistants')
+        response = obtener_cliente().files.create(file=file, purpose='assistants')
 
         #! Retorna la información del archivo cargado
         return jsonify({
@@ -198,7 +198,7 @@ def delete_file_from_openai():
 
     try:
         #! Se solicita el borrado del archivo en la API de OpenAI
-        response = openai.files.delete(file_id)
+        response = obtener_cliente().files.delete(file_id)
 
         #! Se devuelve la confirmación del borrado
         return jsonify({
@@ -0,0 +1,46 @@
+from flask import Blueprint, jsonify
+from chatgpt_api.db import get_db
+from chatgpt_api.models import Trabajo
+from chatgpt_api.services.trabajos_service import trabajo_to_dict
+
+trabajo_bp = Blueprint('trabajo', __name__)
+
+@trabajo_bp.route('/api/jobs/<int:id>', methods=['GET'])
+def obtener_trabajo(id):
+    """
+    @brief Devuelve el estado de una generación en segundo plano.
+
+    @details
+    Los trabajos se crean con `POST /api/chat/<id>` y la cabecera `Prefer: respond-async`.
+    El campo `estado` pasa de `pendiente` a `en_curso` y termina en `completado` (con la
+    respuesta, que ya está guardada en la conversación) o en `error`.
+
+    @param id Identificador del trabajo.
+
+    @return
+    - 200 OK: Devuelve el trabajo.
+    - 404 Not Found: Si no existe un trabajo con el ID proporcionado.
+
+    @code
+    Ejemplo de solicitud:
+    GET /api/jobs/7
+
+    Respuesta esperada:
+    {
+        "id": 7,
+        "conversacion_id": 123,
+        "estado": "completado",
+        "respuesta": "Para integrar la API de OpenAI, necesitas obtener una clave de API...",
+        "error": null,
+        "intentos": 1,
+        "fecha_creacion": "2025-05-01T10:00:00",
+        "fecha_inicio": "2025-05-01T10:00:01",
+        "fecha_fin": "2025-05-01T10:00:40"
+    }
+    @endcode
+    """
+    db_session = get_db()
+    trabajo = db_session.get(Trabajo, id)
+    if trabajo is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(trabajo_to_dict(trabajo))
@@ -0,0 +1,7 @@
+from chatgpt_api.migraciones import aplicar_migraciones, rellenar_pendientes
+
+if __name__ == "__main__":
+    # Equivale a `flask migrar`: las migraciones no calculan los recuentos al arrancar
+    aplicar_migraciones()
+    total = rellenar_pendientes()
+    print(f"Recuento de tokens completado: {total} mensajes actualizados.")
@@ -0,0 +1,374 @@
+"""! @brief Migraciones versionadas del esquema de la base de datos"""
+##
+# @file migraciones.py
+#
+# @brief Crea y actualiza el esquema de `models.py` mediante migraciones numeradas.
+#
+# @section description_migraciones Descripción
+# Cada migración tiene un número de versión y una función que recibe una conexión
+# de SQLAlchemy. Las versiones aplicadas se registran en la tabla `version_esquema`,
+# de forma que `aplicar_migraciones` sólo ejecuta las pendientes, en orden.
+#
+# Cada migración se ejecuta en su propia transacción junto con el registro de su
+# versión: si falla, no queda aplicada a medias. El registro se inserta antes que el
+# DDL, de forma que si dos procesos arrancan a la vez, el segundo espera al primero
+# y descarta la migración al encontrarla ya registrada. En SQLite la espera está limitada
+# por `busy_timeout`: si se agota ("database is locked"), se reintenta durante
+# `MIGRACION_ESPERA` segundos en lugar de fallar al arrancar.
+#
+# Las migraciones se aplican al arrancar cada proceso, así que sólo hacen cambios de
+# esquema y cálculos en SQL. Los datos derivados que necesitan tiktoken (recuentos de
+# tokens de los mensajes existentes) los calcula `rellenar_pendientes` (`flask migrar`),
+# con un commit por lote.
+#
+# Las migraciones son además idempotentes (comprueban si la columna o el índice ya
+# existen), porque las bases de datos creadas con los scripts de `db_init/` pueden
+# tener ya parte del esquema sin tener la tabla `version_esquema`, y porque en motores
+# distintos de SQLite la migración 1 crea directamente el esquema completo.
+#
+# @section nueva_migracion Añadir una migración
+# 1. Cambiar el modelo en `models.py`.
+# 2. Añadir al final de `MIGRACIONES` una `Migracion` con la siguiente versión, usando
+#    `agregar_columna` / `crear_indice` (en SQLite ambas operaciones se hacen sin copiar la tabla).
+#    Las tablas nuevas se crean con `Modelo.__table__.create(conn, checkfirst=True)`.
+import logging
+import os
+import time
+from collections import namedtuple
+from sqlalchemy import inspect, select, text, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from chatgpt_api.db import db_engine
+from chatgpt_api.models import Base, Trabajo, Archivo, Conversacion
+from chatgpt_api.services.archivo_service import mensajes_archivados
+from chatgpt_api.services.conversacion_service import recalcular_actividad, rellenar_tokens
+
+logger = logging.getLogger(__name__)
+
+'''
+@brief Migración del esquema.
+- `version`: número de versión, consecutivo.
+- `descripcion`: texto que se guarda en `version_esquema`.
+- `aplicar`: función `aplicar(conn)` que realiza los cambios.
+'''
+Migracion = namedtuple('Migracion', ['version', 'descripcion', 'aplicar'])
+
+'''! @brief Segundos que un proceso reintenta una migración bloqueada por otro que la está aplicando'''
+MIGRACION_ESPERA = int(os.getenv('MIGRACION_ESPERA', '600'))
+
+'''! @brief Segundos entre reintentos de una migración bloqueada'''
+MIGRACION_PAUSA = 1.0
+
+
+def columnas(conn, tabla):
+    """
+    @brief Devuelve los nombres de las columnas de una tabla.
+    @param conn Conexión de SQLAlchemy.
+    @param tabla Nombre de la tabla.
+    @return Conjunto con los nombres de las columnas.
+    """
+    return {col['name'] for col in inspect(conn).get_columns(tabla)}
+
+
+def agregar_columna(conn, tabla, columna, definicion):
+    """
+    @brief Añade una columna a una tabla si no existe.
+
+    @param conn Conexión de SQLAlchemy.
+    @param tabla Nombre de la tabla.
+    @param columna Nombre de la columna.
+    @param definicion Tipo y restricciones SQL de la columna (e.g., "INTEGER", "TEXT NOT NULL DEFAULT 'x'").
+    """
+    if columna not in columnas(conn, tabla):
+        logger.info(f"Añadiendo la columna {tabla}.{columna}")
+        conn.execute(text(f"ALTER TABLE {tabla} ADD COLUMN {columna} {definicion}"))
+
+
+def crear_indice(conn, nombre, tabla, columnas_indice):
+    """
+    @brief Crea un índice si no existe.
+
+    @param conn Conexión de SQLAlchemy.
+    @param nombre Nombre del índice (el mismo que en `models.py`).
+    @param tabla Nombre de la tabla.
+    @param columnas_indice Lista de columnas del índice, en orden.
+    """
+    logger.info(f"Creando el índice {nombre}")
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {nombre} ON {tabla} ({', '.join(columnas_indice)})"))
+
+
+def _tablas_base(conn):
+    if conn.dialect.name != 'sqlite':
+        # Bases de datos nuevas en otros motores: el DDL lo genera SQLAlchemy a partir de
+        # `models.py` y las migraciones siguientes no tienen nada que añadir
+        Base.metadata.create_all(conn)
+        return
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS conversacion (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            contexto BOOLEAN NOT NULL DEFAULT 1,
+            fecha_creacion DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    '''))
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS mensaje (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversacion_id INTEGER,
+            mensaje TEXT NOT NULL,
+            es_usuario BOOLEAN NOT NULL,
+            fecha_creacion DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (conversacion_id) REFERENCES conversacion(id)
+        )
+    '''))
+
+
+def _modelo_conversacion(conn):
+    agregar_columna(conn, 'conversacion', 'modelo', "TEXT NOT NULL DEFAULT 'gpt-3.5-turbo'")
+
+
+def _tokens_mensaje(conn):
+    agregar_columna(conn, 'mensaje', 'tokens', 'INTEGER')
+    agregar_columna(conn, 'mensaje', 'codificacion', 'TEXT')
+    # Los recuentos de los mensajes existentes los calcula `rellenar_pendientes`
+
+
+def _resumen_conversacion(conn):
+    agregar_columna(conn, 'conversacion', 'resumen', 'TEXT')
+    agregar_columna(conn, 'conversacion', 'resumen_hasta_id', 'INTEGER')
+
+
+def _indices_consultas(conn):
+    # Mensajes de una conversación por orden (lectura del chat y del historial para OpenAI)
+    crear_indice(conn, 'ix_mensaje_conversacion_id_id', 'mensaje', ['conversacion_id', 'id'])
+    crear_indice(conn, 'ix_mensaje_conversacion_id_fecha', 'mensaje', ['conversacion_id', 'fecha_creacion'])
+    # Listado de conversaciones (`/api/historial`)
+    crear_indice(conn, 'ix_conversacion_fecha_creacion_id', 'conversacion', ['fecha_creacion', 'id'])
+
+
+def _cache_conversacion(conn):
+    agregar_columna(conn, 'conversacion', 'usar_cache', 'BOOLEAN NOT NULL DEFAULT 1')
+
+
+def _fecha_modificacion_conversacion(conn):
+    agregar_columna(conn, 'conversacion', 'fecha_modificacion', 'DATETIME')
+    conn.execute(text("UPDATE conversacion SET fecha_modificacion = fecha_creacion WHERE fecha_modificacion IS NULL"))
+    # MAX(fecha_modificacion) se calcula en cada petición a `/api/historial` (ETag)
+    crear_indice(conn, 'ix_conversacion_fecha_modificacion', 'conversacion', ['fecha_modificacion'])
+
+
+def _tabla_trabajos(conn):
+    # Tabla nueva: el DDL (con su índice) se genera a partir de `models.py` en cualquier motor
+    Trabajo.__table__.create(conn, checkfirst=True)
+
+
+def _busqueda_mensajes(conn):
+    # Índice de texto completo de `mensaje.mensaje` (ver `services/busqueda_service.py`).
+    # En otros motores, o si SQLite no incluye FTS5, la búsqueda recurre a LIKE.
+    if conn.dialect.name != 'sqlite':
+        return
+    if not conn.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar():
+        logger.warning("SQLite no incluye FTS5: /api/search usará LIKE")
+        return
+    # Tabla de contenido externo: el índice no duplica el texto, lo lee de `mensaje`.
+    # Los índices de prefijos de 2 a 4 caracteres evitan expandir `con*` en miles de términos.
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS mensaje_fts USING fts5("
+        "mensaje, content='mensaje', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')"
+    ))
+    conn.execute(text('''
+        CREATE TRIGGER IF NOT EXISTS mensaje_fts_insertar AFTER INSERT ON mensaje BEGIN
+            INSERT INTO mensaje_fts (rowid, mensaje) VALUES (new.id, new.mensaje);
+        END
+    '''))
+    conn.execute(text('''
+        CREATE TRIGGER IF NOT EXISTS mensaje_fts_borrar AFTER DELETE ON mensaje BEGIN
+            INSERT INTO mensaje_fts (mensaje_fts, rowid, mensaje) VALUES ('delete', old.id, old.mensaje);
+        END
+    '''))
+    conn.execute(text('''
+        CREATE TRIGGER IF NOT EXISTS mensaje_fts_actualizar AFTER UPDATE OF mensaje ON mensaje BEGIN
+            INSERT INTO mensaje_fts (mensaje_fts, rowid, mensaje) VALUES ('delete', old.id, old.mensaje);
+            INSERT INTO mensaje_fts (rowid, mensaje) VALUES (new.id, new.mensaje);
+        END
+    '''))
+    logger.info("Indexando los mensajes existentes para la búsqueda")
+    conn.execute(text("INSERT INTO mensaje_fts (mensaje_fts) VALUES ('rebuild')"))
+    conn.execute(text("INSERT INTO mensaje_fts (mensaje_fts) VALUES ('optimize')"))
+
+
+def _tabla_archivo(conn):
+    Archivo.__table__.create(conn, checkfirst=True)
+
+
+def _actividad_conversacion(conn):
+    agregar_columna(conn, 'conversacion', 'fecha_actividad', 'DATETIME')
+    agregar_columna(conn, 'conversacion', 'num_mensajes', 'INTEGER NOT NULL DEFAULT 0')
+    agregar_columna(conn, 'conversacion', 'tokens_totales', 'INTEGER NOT NULL DEFAULT 0')
+    logger.info("Calculando la actividad de las conversaciones existentes")
+    # Los mensajes sin recuento de tokens se suman al total cuando se calculan
+    recalcular_actividad(conn)
+    # Las conversaciones archivadas no tienen filas en `mensaje`: sus datos salen del blob
+    archivadas = conn.execute(select(Archivo.conversacion_id)).scalars().all()
+    for conversacion_id in archivadas:
+        datos, fecha = conn.execute(
+            select(Archivo.datos, Archivo.fecha_ultimo_mensaje).where(Archivo.conversacion_id == conversacion_id)
+        ).one()
+        registros = mensajes_archivados(datos)
+        valores = {
+            'num_mensajes': Conversacion.num_mensajes + len(registros),
+            'tokens_totales': Conversacion.tokens_totales + sum(r['tokens'] or 0 for r in registros),
+            'fecha_modificacion': Conversacion.fecha_modificacion,
+        }
+        if fecha is not None:
+            valores['fecha_actividad'] = fecha
+        conn.execute(update(Conversacion).where(Conversacion.id == conversacion_id).values(**valores))
+    # Listado del historial por actividad (`/api/historial?orden=actividad`)
+    crear_indice(conn, 'ix_conversacion_fecha_actividad_id', 'conversacion', ['fecha_actividad', 'id'])
+
+
+def _renovacion_trabajo(conn):
+    agregar_columna(conn, 'trabajo', 'fecha_renovacion', 'DATETIME')
+
+
+'''! @brief Migraciones del esquema, en orden de versión'''
+MIGRACIONES = [
+    Migracion(1, 'Tablas conversacion y mensaje', _tablas_base),
+    Migracion(2, 'Columna conversacion.modelo', _modelo_conversacion),
+    Migracion(3, 'Recuento de tokens por mensaje', _tokens_mensaje),
+    Migracion(4, 'Resumen incremental por conversación', _resumen_conversacion),
+    Migracion(5, 'Índices para el chat y el historial', _indices_consultas),
+    Migracion(6, 'Columna conversacion.usar_cache', _cache_conversacion),
+    Migracion(7, 'Columna conversacion.fecha_modificacion', _fecha_modificacion_conversacion),
+    Migracion(8, 'Tabla trabajo (generaciones en segundo plano)', _tabla_trabajos),
+    Migracion(9, 'Índice de texto completo de los mensajes (FTS5)', _busqueda_mensajes),
+    Migracion(10, 'Tabla archivo (mensajes archivados comprimidos)', _tabla_archivo),
+    Migracion(11, 'Actividad de las conversaciones (último mensaje, mensajes y tokens)', _actividad_conversacion),
+    Migracion(12, 'Columna trabajo.fecha_renovacion (renovación de los trabajos en curso)', _renovacion_trabajo),
+]
+
+
+def _crear_tabla_versiones(engine):
+    with engine.begin() as conn:
+        conn.execute(text('''
+            CREATE TABLE IF NOT EXISTS version_esquema (
+                version INTEGER PRIMARY KEY,
+                descripcion TEXT NOT NULL,
+                fecha_aplicacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        '''))
+
+
+def version_actual(engine=db_engine):
+    """
+    @brief Devuelve la versión del esquema de la base de datos.
+    @param engine Motor de SQLAlchemy.
+    @return Integer con la última versión aplicada (0 si no se ha aplicado ninguna).
+    """
+    _crear_tabla_versiones(engine)
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM version_esquema")).scalar()
+
+
+def columnas_pendientes(engine=db_engine):
+    """
+    @brief Compara el esquema de la base de datos con el de `models.py`.
+
+    @param engine Motor de SQLAlchemy.
+
+    @return
+    - Lista de `tabla.columna` definidas en los modelos que no existen en la base de datos.
+      Si no está vacía, falta una migración.
+    """
+    with engine.connect() as conn:
+        inspector = inspect(conn)
+        tablas = set(inspector.get_table_names())
+        pendientes = []
+        for tabla in Base.metadata.sorted_tables:
+            existentes = columnas(conn, tabla.name) if tabla.name in tablas else set()
+            pendientes += [f"{tabla.name}.{col.name}" for col in tabla.columns if col.name not in existentes]
+        return pendientes
+
+
+def _bloqueada(error):
+    """! @brief Indica si un `OperationalError` se debe a que otro proceso tiene el bloqueo de escritura."""
+    return 'database is locked' in str(error.orig)
+
+
+def _aplicar(engine, migracion, espera):
+    """
+    @brief Aplica una migración en su propia transacción.
+    @return True si se ha aplicado; False si ya la había aplicado otro proceso.
+    """
+    limite = time.monotonic() + espera
+    while True:
+        try:
+            with engine.begin() as conn:
+                # El INSERT abre la transacción de escritura antes del DDL (ver descripción del módulo)
+                conn.execute(
+                    text("INSERT INTO version_esquema (version, descripcion) VALUES (:version, :descripcion)"),
+                    {'version': migracion.version, 'descripcion': migracion.descripcion},
+                )
+                migracion.aplicar(conn)
+            return True
+        except IntegrityError:
+            logger.info(f"La migración {migracion.version} ya la ha aplicado otro proceso")
+            return False
+        except OperationalError as e:
+            if not _bloqueada(e) or time.monotonic() >= limite:
+                raise
+            logger.info(f"Base de datos bloqueada; esperando para aplicar la migración {migracion.version}")
+            time.sleep(MIGRACION_PAUSA)
+
+
+def aplicar_migraciones(engine=db_engine, espera=MIGRACION_ESPERA):
+    """
+    @brief Aplica las migraciones pendientes.
+
+    @param engine Motor de SQLAlchemy.
+    @param espera Segundos que se reintenta una migración mientras otro proceso tiene la base de datos bloqueada.
+
+    @return
+    - Lista con las versiones aplicadas en esta llamada (vacía si el esquema estaba al día).
+
+    @note
+    Se llama al arrancar la aplicación (`create_app`) y desde el comando `flask migrar`.
+    """
+    actual = version_actual(engine)
+    aplicadas = []
+    for migracion in MIGRACIONES:
+        if migracion.version <= actual or not _aplicar(engine, migracion, espera):
+            continue
+        logger.info(f"Migración {migracion.version} aplicada: {migracion.descripcion}")
+        aplicadas.append(migracion.version)
+    pendientes = columnas_pendientes(engine)
+    if pendientes:
+        logger.warning(f"Columnas de models.py sin migración: {', '.join(pendientes)}")
+    return aplicadas
+
+
+def rellenar_pendientes(engine=db_engine):
+    """
+    @brief Calcula los datos derivados que las migraciones no calculan al arrancar.
+
+    @details
+    Por ahora, los recuentos de tokens de los mensajes que no los tienen (ver
+    `conversacion_service.rellenar_tokens`). Se hace commit de cada lote, de modo que puede
+    ejecutarse con la aplicación en marcha.
+
+    @param engine Motor de SQLAlchemy.
+
+    @return
+    - Número de mensajes cuyos tokens se han calculado.
+    """
+    with engine.connect() as conn:
+        total = rellenar_tokens(conn, confirmar_lotes=True)
+        conn.commit()
+    return total
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    versiones = aplicar_migraciones()
+    print(f"Migraciones aplicadas: {versiones or 'ninguna'}. Versión del esquema: {version_actual()}")
+    print(f"Tokens calculados de {rellenar_pendientes()} mensajes existentes.")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Index, LargeBinary
 from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime
 
@@ -11,7 +11,24 @@ class Conversacion(Base):
     contexto = Column(Boolean, nullable=False, default=True)
     modelo = Column(String, nullable=False, default='gpt-3.5-turbo')
     fecha_creacion = Column(DateTime, default=datetime.utcnow)
+    fecha_modificacion = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Validador de `/api/historial`
+    resumen = Column(Text, nullable=True)  # Resumen acumulado de los mensajes antiguos
+    resumen_hasta_id = Column(Integer, nullable=True)  # ID del último mensaje incluido en `resumen`
+    usar_cache = Column(Boolean, nullable=False, default=True)  # Permite reutilizar respuestas cacheadas
+    # Actividad, mantenida al guardar mensajes (ver `conversacion_service.recalcular_actividad`)
+    fecha_actividad = Column(DateTime, default=datetime.utcnow)  # Último mensaje, o la creación si no tiene
+    num_mensajes = Column(Integer, nullable=False, default=0)  # Incluye los archivados
+    tokens_totales = Column(Integer, nullable=False, default=0)  # Suma de `Mensaje.tokens`
     mensajes = relationship('Mensaje', back_populates='conversacion', cascade="all, delete-orphan")
+    trabajos = relationship('Trabajo', back_populates='conversacion', cascade="all, delete-orphan")
+    archivo = relationship('Archivo', uselist=False, cascade="all, delete-orphan")
+
+    # Los índices se crean con las migraciones de `migraciones.py`
+    __table_args__ = (
+        Index('ix_conversacion_fecha_creacion_id', 'fecha_creacion', 'id'),
+        Index('ix_conversacion_fecha_modificacion', 'fecha_modificacion'),
+        Index('ix_conversacion_fecha_actividad_id', 'fecha_actividad', 'id'),
+    )
 
 class Mensaje(Base):
     __tablename__ = 'mensaje'
@@ -20,4 +37,42 @@ class Mensaje(Base):
     mensaje = Column(Text, nullable=False)
     es_usuario = Column(Boolean, nullable=False)
     fecha_creacion = Column(DateTime, default=datetime.utcnow)
+    tokens = Column(Integer, nullable=True)  # Tokens del contenido según `codificacion`
+    codificacion = Column(String, nullable=True)  # Codificación tiktoken usada para `tokens`
     conversacion = relationship('Conversacion', back_populates='mensajes')
+
+    __table_args__ = (
+        Index('ix_mensaje_conversacion_id_id', 'conversacion_id', 'id'),
+        Index('ix_mensaje_conversacion_id_fecha', 'conversacion_id', 'fecha_creacion'),
+    )
+
+class Trabajo(Base):
+    """! @brief Generación de una respuesta en segundo plano (ver `services/trabajos_service.py`)."""
+    __tablename__ = 'trabajo'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    conversacion_id = Column(Integer, ForeignKey('conversacion.id'), nullable=False)
+    mensaje = Column(Text, nullable=False)  # Mensaje del usuario que se responde
+    estado = Column(String, nullable=False, default='pendiente')  # pendiente, en_curso, completado o error
+    respuesta = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    intentos = Column(Integer, nullable=False, default=0)
+    fecha_creacion = Column(DateTime, default=datetime.utcnow)
+    fecha_inicio = Column(DateTime, nullable=True)  # Inicio del último intento
+    fecha_renovacion = Column(DateTime, nullable=True)  # Última renovación del intento en curso
+    fecha_fin = Column(DateTime, nullable=True)
+    conversacion = relationship('Conversacion', back_populates='trabajos')
+
+    __table_args__ = (
+        Index('ix_trabajo_estado_id', 'estado', 'id'),
+    )
+
+class Archivo(Base):
+    """! @brief Mensajes archivados de una conversación inactiva (ver `services/archivo_service.py`)."""
+    __tablename__ = 'archivo'
+    conversacion_id = Column(Integer, ForeignKey('conversacion.id'), primary_key=True)
+    datos = Column(LargeBinary, nullable=False)  # Mensajes en JSON comprimido con zlib
+    mensajes = Column(Integer, nullable=False)
+    bytes_originales = Column(Integer, nullable=False)  # Tamaño del JSON sin comprimir
+    bytes_comprimidos = Column(Integer, nullable=False)
+    fecha_ultimo_mensaje = Column(DateTime, nullable=True)
+    fecha_archivado = Column(DateTime, default=datetime.utcnow)
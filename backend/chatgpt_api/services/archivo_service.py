@@ -0,0 +1,244 @@
+"""! @brief Archivado comprimido de los mensajes de conversaciones inactivas"""
+##
+# @file archivo_service.py
+#
+# @brief Mueve los mensajes de las conversaciones sin actividad a la tabla `archivo`
+# (un blob comprimido por conversación) y los restaura cuando se vuelven a usar.
+#
+# @section description_archivo_service Descripción
+# Las respuestas largas del asistente ocupan la mayor parte de la tabla `mensaje`. Las
+# conversaciones sin mensajes en los últimos `ARCHIVO_DIAS` días se archivan: sus
+# mensajes se serializan en JSON, se comprimen con zlib en una sola fila de `archivo` y
+# se borran de `mensaje` (y, por los triggers, del índice de búsqueda). Así la tabla y
+# el índice de mensajes sólo contienen las conversaciones en uso.
+#
+# La restauración es transparente: `preparar_historial` (enviar un mensaje, por
+# cualquiera de los endpoints o trabajos) y `GET /api/chat/<id>` llaman a `restaurar`,
+# que devuelve los mensajes a `mensaje` con sus IDs originales (la tabla usa
+# AUTOINCREMENT, así que no se reutilizan), de modo que el resumen
+# (`resumen_hasta_id`) y los cursores de paginación siguen siendo válidos.
+#
+# Limitaciones:
+# - Los mensajes archivados no aparecen en `/api/search` hasta que se restauran.
+# - SQLite no reduce el fichero al borrar filas: las páginas libres se reutilizan para
+#   datos nuevos, y `flask archivar --vacuum` las devuelve al sistema.
+#
+# @section uso_archivo_service Uso
+# @code
+# flask --app app archivar --dias 90   # Archiva y muestra el informe
+# flask --app app archivo              # Sólo el informe
+# @endcode
+import json
+import logging
+import os
+import zlib
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, delete, exists, func, text
+from chatgpt_api.db import db_engine
+from chatgpt_api.models import Archivo, Conversacion, Mensaje
+
+logger = logging.getLogger(__name__)
+
+'''! @brief Días sin mensajes tras los que una conversación se archiva'''
+ARCHIVO_DIAS = int(os.getenv('ARCHIVO_DIAS', '90'))
+
+'''! @brief Nivel de compresión de zlib (se comprime una vez y se lee pocas veces)'''
+ARCHIVO_NIVEL = 9
+
+'''! @brief Conversaciones candidatas que se consultan en cada bloque'''
+ARCHIVO_CONVERSACIONES = 100
+
+'''! @brief Resultado de `archivar`'''
+ResultadoArchivado = namedtuple('ResultadoArchivado', ['conversaciones', 'mensajes', 'bytes_originales', 'bytes_comprimidos'])
+
+'''! @brief Resultado de `informe`'''
+InformeArchivo = namedtuple('InformeArchivo', [
+    'conversaciones', 'mensajes', 'bytes_originales', 'bytes_comprimidos',
+    'mensajes_activos', 'bytes_fichero', 'bytes_libres',
+])
+
+
+def _fecha(valor):
+    return valor.isoformat() if valor else None
+
+
+def _leer_fecha(valor):
+    return datetime.fromisoformat(valor) if valor else None
+
+
+def archivar_conversacion(db_session, conversacion_id):
+    """
+    @brief Archiva los mensajes de una conversación en una sola transacción.
+
+    @details
+    Si llega un mensaje nuevo mientras se comprimen los anteriores, el número de mensajes
+    borrados no coincide con el de archivados y se deshace todo (la conversación vuelve
+    a estar activa).
+
+    @param db_session Sesión de SQLAlchemy. Se hace commit (o rollback) al terminar.
+    @param conversacion_id ID de la conversación.
+
+    @return
+    - `ResultadoArchivado` de la conversación, o None si no se ha archivado.
+    """
+    filas = db_session.execute(
+        select(Mensaje.__table__).where(Mensaje.conversacion_id == conversacion_id).order_by(Mensaje.id)
+    ).all()
+    if not filas:
+        return None
+    original = json.dumps([
+        {
+            'id': fila.id,
+            'mensaje': fila.mensaje,
+            'es_usuario': bool(fila.es_usuario),
+            'fecha_creacion': _fecha(fila.fecha_creacion),
+            'tokens': fila.tokens,
+            'codificacion': fila.codificacion,
+        }
+        for fila in filas
+    ], ensure_ascii=False).encode('utf-8')
+    datos = zlib.compress(original, ARCHIVO_NIVEL)
+    db_session.add(Archivo(
+        conversacion_id=conversacion_id,
+        datos=datos,
+        mensajes=len(filas),
+        bytes_originales=len(original),
+        bytes_comprimidos=len(datos),
+        fecha_ultimo_mensaje=max((f.fecha_creacion for f in filas if f.fecha_creacion), default=None),
+    ))
+    borrados = db_session.execute(
+        delete(Mensaje).where(Mensaje.conversacion_id == conversacion_id).execution_options(synchronize_session=False)
+    ).rowcount
+    if borrados != len(filas):
+        db_session.rollback()
+        return None
+    db_session.commit()
+    return ResultadoArchivado(1, len(filas), len(original), len(datos))
+
+
+def restaurar(db_session, conversacion_id):
+    """
+    @brief Devuelve a `mensaje` los mensajes archivados de una conversación.
+
+    @details
+    Si la conversación no está archivada sólo cuesta una consulta por clave primaria.
+    La fila de `archivo` se borra con `DELETE ... RETURNING` antes de insertar los
+    mensajes, de modo que dos peticiones simultáneas no los restauran dos veces.
+
+    @param db_session Sesión de SQLAlchemy. Se hace commit si se restaura algo.
+    @param conversacion_id ID de la conversación.
+
+    @return
+    - Número de mensajes restaurados (0 si la conversación no estaba archivada).
+    """
+    archivada = db_session.execute(
+        select(Archivo.conversacion_id).where(Archivo.conversacion_id == conversacion_id)
+    ).first()
+    if archivada is None:
+        return 0
+    datos = db_session.execute(
+        delete(Archivo.__table__).where(Archivo.conversacion_id == conversacion_id).returning(Archivo.datos)
+    ).scalar()
+    if datos is None:  # Otra petición se ha adelantado
+        db_session.rollback()
+        return 0
+    filas = [
+        dict(registro, conversacion_id=conversacion_id, fecha_creacion=_leer_fecha(registro['fecha_creacion']))
+        for registro in mensajes_archivados(datos)
+    ]
+    db_session.execute(insert(Mensaje.__table__), filas)
+    db_session.commit()
+    logger.info(f"Restaurados {len(filas)} mensajes archivados de la conversación {conversacion_id}")
+    return len(filas)
+
+
+def mensajes_archivados(datos):
+    """
+    @brief Descomprime el blob de un archivo.
+    @param datos Contenido de `Archivo.datos`.
+    @return Lista de diccionarios con los campos de cada mensaje (`fecha_creacion` en ISO 8601).
+    """
+    return json.loads(zlib.decompress(datos))
+
+
+def archivar(db_session, dias=ARCHIVO_DIAS):
+    """
+    @brief Archiva todas las conversaciones sin mensajes en los últimos `dias` días.
+
+    @details
+    Cada conversación se archiva en su propia transacción (ver `archivar_conversacion`).
+    Las candidatas se buscan en bloques de `ARCHIVO_CONVERSACIONES` con el índice
+    `ix_mensaje_conversacion_id_fecha`.
+
+    @param db_session Sesión de SQLAlchemy.
+    @param dias Días de inactividad.
+
+    @return
+    - `ResultadoArchivado` con las conversaciones y mensajes archivados y los bytes antes y
+      después de comprimir.
+    """
+    limite = datetime.utcnow() - timedelta(days=dias)
+    tiene_mensajes = exists().where(Mensaje.conversacion_id == Conversacion.id)
+    reciente = exists().where(Mensaje.conversacion_id == Conversacion.id, Mensaje.fecha_creacion >= limite)
+    archivada = exists().where(Archivo.conversacion_id == Conversacion.id)
+    total = ResultadoArchivado(0, 0, 0, 0)
+    ultimo_id = 0
+    while True:
+        ids = db_session.execute(
+            select(Conversacion.id)
+            .where(Conversacion.id > ultimo_id, tiene_mensajes, ~reciente, ~archivada)
+            .order_by(Conversacion.id)
+            .limit(ARCHIVO_CONVERSACIONES)
+        ).scalars().all()
+        if not ids:
+            return total
+        for id in ids:
+            resultado = archivar_conversacion(db_session, id)
+            if resultado is not None:
+                total = ResultadoArchivado(*(a + b for a, b in zip(total, resultado)))
+        ultimo_id = ids[-1]
+
+
+def informe(db_session):
+    """
+    @brief Resume el estado del archivo.
+
+    @param db_session Sesión de SQLAlchemy.
+
+    @return
+    - `InformeArchivo` con las conversaciones y mensajes archivados, sus bytes antes y
+      después de comprimir, los mensajes activos y, en SQLite, el tamaño del fichero y el
+      espacio libre que recuperaría `VACUUM` (None en otros motores).
+    """
+    conversaciones, mensajes, originales, comprimidos = db_session.execute(select(
+        func.count(Archivo.conversacion_id),
+        func.coalesce(func.sum(Archivo.mensajes), 0),
+        func.coalesce(func.sum(Archivo.bytes_originales), 0),
+        func.coalesce(func.sum(Archivo.bytes_comprimidos), 0),
+    )).one()
+    activos = db_session.execute(select(func.count(Mensaje.id))).scalar()
+    bytes_fichero = bytes_libres = None
+    if db_session.get_bind().dialect.name == 'sqlite':
+        pagina = db_session.execute(text('PRAGMA page_size')).scalar()
+        bytes_fichero = db_session.execute(text('PRAGMA page_count')).scalar() * pagina
+        bytes_libres = db_session.execute(text('PRAGMA freelist_count')).scalar() * pagina
+    return InformeArchivo(conversaciones, mensajes, originales, comprimidos, activos, bytes_fichero, bytes_libres)
+
+
+def compactar():
+    """
+    @brief Ejecuta `VACUUM` para devolver al sistema el espacio libre del fichero SQLite.
+
+    @details
+    Reescribe la base de datos completa y bloquea las escrituras mientras tanto: conviene
+    ejecutarlo fuera de las horas de uso. En otros motores no hace nada.
+
+    @return
+    - True si se ha ejecutado.
+    """
+    if db_engine.dialect.name != 'sqlite':
+        return False
+    with db_engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text('VACUUM'))
+    return True
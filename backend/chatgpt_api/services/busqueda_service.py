@@ -0,0 +1,211 @@
+"""! @brief Búsqueda de texto completo en los mensajes de todas las conversaciones"""
+##
+# @file busqueda_service.py
+#
+# @brief Consultas sobre el índice FTS5 `mensaje_fts` (migración 9), con fragmentos
+# resaltados y paginación por cursor.
+#
+# @section description_busqueda_service Descripción
+# El índice se mantiene sincronizado con `mensaje` mediante triggers, así que no hay que
+# hacer nada al guardar o borrar mensajes. Los términos de la búsqueda se combinan con
+# AND y el último se busca también como prefijo (`integra` encuentra "integración").
+# Las mayúsculas y los acentos se ignoran.
+#
+# Hay dos órdenes:
+# - `rank` (por defecto): por relevancia (BM25). SQLite tiene que puntuar todas las
+#   coincidencias, de modo que el coste crece con el número de mensajes que contienen
+#   los términos (con un millón de mensajes, milisegundos para términos poco frecuentes
+#   y segundos para términos que aparecen en casi todos).
+# - `recent`: del mensaje más nuevo al más antiguo. El índice se recorre por `rowid` y
+#   la consulta se detiene al llenar la página, por lo que sigue siendo rápida aunque
+#   millones de mensajes contengan los términos.
+#
+# Si la base de datos no tiene el índice (otro motor, o SQLite sin FTS5) se usa una
+# búsqueda con LIKE, sólo en orden `recent` y sin puntuación.
+import html
+import re
+from sqlalchemy import text, DateTime, Boolean
+from chatgpt_api.models import Mensaje, Conversacion
+
+'''! @brief Máximo de términos que se tienen en cuenta en una búsqueda'''
+MAX_TERMINOS = 16
+
+'''! @brief Palabras aproximadas de cada fragmento'''
+PALABRAS_FRAGMENTO = 16
+
+'''! @brief Caracteres de contexto a cada lado de la coincidencia en la búsqueda con LIKE'''
+CONTEXTO_FRAGMENTO = 60
+
+'''! @brief Órdenes admitidos'''
+ORDEN_RELEVANCIA, ORDEN_RECIENTE = 'rank', 'recent'
+
+# Marcas que rodean las coincidencias en los fragmentos. Son caracteres de control que no
+# aparecen en los mensajes: se sustituyen por <mark> después de escapar el HTML del texto.
+_INICIO, _FIN = '\x02', '\x03'
+
+_fts_disponible = None
+
+
+def terminos(consulta):
+    """
+    @brief Extrae los términos de búsqueda de la consulta del usuario.
+    @param consulta Texto del parámetro `q`.
+    @return Lista de palabras (como mucho `MAX_TERMINOS`).
+    """
+    return re.findall(r'\w+', consulta)[:MAX_TERMINOS]
+
+
+def expresion_fts(lista_terminos):
+    """
+    @brief Construye la expresión MATCH de FTS5 para una lista de términos.
+
+    @details
+    Cada término va entre comillas, de forma que los operadores de FTS5 (`AND`, `NEAR`,
+    `*`, `"`...) que escriba el usuario se buscan como texto y nunca producen un error de
+    sintaxis. El último término se busca además como prefijo, salvo si tiene una sola
+    letra (coincidiría con casi todos los mensajes).
+
+    @param lista_terminos Lista devuelta por `terminos`.
+    @return String con la expresión.
+    """
+    citados = ['"' + termino.replace('"', '""') + '"' for termino in lista_terminos]
+    if len(lista_terminos[-1]) > 1:
+        citados[-1] += '*'
+    return ' '.join(citados)
+
+
+def fts_disponible(db_session):
+    """
+    @brief Indica si la base de datos tiene el índice `mensaje_fts`.
+    @param db_session Sesión de SQLAlchemy.
+    @return True si existe el índice (la comprobación se hace una vez por proceso si existe).
+    """
+    global _fts_disponible
+    if _fts_disponible is None:
+        if db_session.get_bind().dialect.name != 'sqlite':
+            _fts_disponible = False
+        else:
+            existe = db_session.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'mensaje_fts'"
+            )).first()
+            if not existe:
+                return False  # Puede crearse después con las migraciones
+            _fts_disponible = True
+    return _fts_disponible
+
+
+def resaltar(fragmento):
+    """
+    @brief Escapa el HTML de un fragmento y convierte las marcas de coincidencia en `<mark>`.
+    @param fragmento Texto con las coincidencias rodeadas por las marcas internas.
+    @return String seguro para insertarse como HTML.
+    """
+    return html.escape(fragmento).replace(_INICIO, '<mark>').replace(_FIN, '</mark>')
+
+
+def _fragmento_like(texto, lista_terminos):
+    """! @brief Fragmento alrededor de la primera coincidencia (búsqueda con LIKE)."""
+    minusculas = texto.lower()
+    posicion = min((p for p in (minusculas.find(t.lower()) for t in lista_terminos) if p >= 0), default=0)
+    inicio = max(0, posicion - CONTEXTO_FRAGMENTO)
+    fragmento = texto[inicio:posicion + CONTEXTO_FRAGMENTO * 2]
+    patron = re.compile('|'.join(re.escape(t) for t in lista_terminos), re.IGNORECASE)
+    fragmento = patron.sub(lambda m: f"{_INICIO}{m.group(0)}{_FIN}", fragmento)
+    return ('…' if inicio > 0 else '') + fragmento + ('…' if inicio + len(fragmento) < len(texto) else '')
+
+
+def _resultado(fila, fragmento, puntuacion):
+    return {
+        'mensaje_id': fila.id,
+        'conversacion_id': fila.conversacion_id,
+        'conversacion_nombre': fila.nombre,
+        'es_usuario': bool(fila.es_usuario),
+        'fecha_creacion': fila.fecha_creacion.isoformat() if fila.fecha_creacion else None,
+        'fragmento': resaltar(fragmento),
+        'puntuacion': puntuacion,
+    }
+
+
+def _buscar_fts(db_session, lista_terminos, limite, antes_de, orden):
+    condiciones = ["mensaje_fts MATCH :expresion"]
+    parametros = {
+        'expresion': expresion_fts(lista_terminos), 'limite': limite + 1,
+        'inicio': _INICIO, 'fin': _FIN, 'palabras': PALABRAS_FRAGMENTO,
+    }
+    if orden == ORDEN_RELEVANCIA:
+        if antes_de is not None:
+            condiciones.append("(mensaje_fts.rank > :rank OR (mensaje_fts.rank = :rank AND mensaje_fts.rowid > :id))")
+            parametros['rank'], parametros['id'] = antes_de
+        orden_sql = "mensaje_fts.rank, mensaje_fts.rowid"
+    else:
+        if antes_de is not None:
+            condiciones.append("mensaje_fts.rowid < :id")
+            parametros['id'] = antes_de
+        orden_sql = "mensaje_fts.rowid DESC"
+    consulta = text(f"""
+        SELECT m.id, m.conversacion_id, c.nombre, m.es_usuario, m.fecha_creacion,
+               snippet(mensaje_fts, 0, :inicio, :fin, '…', :palabras) AS fragmento,
+               mensaje_fts.rank AS rank
+        FROM mensaje_fts
+        JOIN mensaje m ON m.id = mensaje_fts.rowid
+        JOIN conversacion c ON c.id = m.conversacion_id
+        WHERE {' AND '.join(condiciones)}
+        ORDER BY {orden_sql}
+        LIMIT :limite
+    """).columns(fecha_creacion=DateTime, es_usuario=Boolean)
+    filas = db_session.execute(consulta, parametros).fetchall()
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+    resultados = [_resultado(f, f.fragmento, round(-f.rank, 4)) for f in filas]
+    siguiente = None
+    if hay_mas:
+        ultima = filas[-1]
+        siguiente = (ultima.rank, ultima.id) if orden == ORDEN_RELEVANCIA else ultima.id
+    return resultados, siguiente
+
+
+def _patron_like(termino):
+    """! @brief Patrón LIKE que busca `termino` literalmente (`\\`, `%` y `_` escapados con `\\`)."""
+    escapado = termino.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escapado}%"
+
+
+def _buscar_like(db_session, lista_terminos, limite, antes_de):
+    consulta = (
+        db_session.query(Mensaje.id, Mensaje.conversacion_id, Conversacion.nombre, Mensaje.es_usuario,
+                         Mensaje.fecha_creacion, Mensaje.mensaje)
+        .join(Conversacion, Conversacion.id == Mensaje.conversacion_id)
+    )
+    for termino in lista_terminos:
+        consulta = consulta.filter(Mensaje.mensaje.ilike(_patron_like(termino), escape='\\'))
+    if antes_de is not None:
+        consulta = consulta.filter(Mensaje.id < antes_de)
+    filas = consulta.order_by(Mensaje.id.desc()).limit(limite + 1).all()
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+    resultados = [_resultado(f, _fragmento_like(f.mensaje, lista_terminos), None) for f in filas]
+    return resultados, (filas[-1].id if hay_mas else None)
+
+
+def buscar(db_session, consulta, limite, antes_de=None, orden=ORDEN_RELEVANCIA):
+    """
+    @brief Busca mensajes que contengan todos los términos de la consulta.
+
+    @param db_session Sesión de SQLAlchemy.
+    @param consulta Texto buscado (parámetro `q`).
+    @param limite Número máximo de resultados.
+    @param antes_de Cursor de la página anterior: tupla `(rank, id)` en orden `rank`, o ID en orden `recent`.
+    @param orden `ORDEN_RELEVANCIA` (`rank`) u `ORDEN_RECIENTE` (`recent`). Sin índice FTS5 se
+    usa siempre `recent` (ver `fts_disponible`).
+
+    @return
+    - Tupla `(resultados, siguiente)`: lista de diccionarios con el mensaje, su conversación, el
+      fragmento resaltado y la puntuación (mayor es más relevante; `None` sin FTS5), y el cursor de
+      la página siguiente (`None` si no hay más).
+    """
+    lista_terminos = terminos(consulta)
+    if not lista_terminos:
+        return [], None
+    if fts_disponible(db_session):
+        return _buscar_fts(db_session, lista_terminos, limite, antes_de, orden)
+    return _buscar_like(db_session, lista_terminos, limite, antes_de)
@@ -0,0 +1,252 @@
+"""! @brief Caché de respuestas de OpenAI por coincidencia exacta de la petición"""
+##
+# @file cache_service.py
+#
+# @brief Caché de dos niveles (memoria + SQLite) de las respuestas del modelo.
+#
+# @section description_cache_service Descripción
+# La clave es un hash SHA-256 del modelo, los mensajes enviados y los parámetros de
+# muestreo, de modo que sólo se reutiliza una respuesta si la petición es idéntica
+# (caso típico: conversaciones sin contexto, donde se envía el mensaje de sistema y
+# el mensaje del usuario).
+#
+# - Nivel 1: diccionario LRU en memoria, limitado a `CACHE_MAX_MEMORIA` entradas.
+# - Nivel 2: tabla en un fichero SQLite propio (`CACHE_DB`), limitada a `CACHE_MAX_DISCO`
+#   entradas, que sobrevive a los reinicios y se comparte entre procesos.
+#
+# Las entradas caducan a los `CACHE_TTL` segundos. La caché está desactivada salvo que
+# se defina `CACHE_RESPUESTAS=1`, y cada conversación puede excluirse con
+# `Conversacion.usar_cache`.
+#
+# El nivel de disco no se recorre en cada inserción: el número de entradas se lleva en
+# memoria, y las caducadas y las que sobran se expulsan juntas cuando se supera
+# `CACHE_MAX_DISCO` (dejando un margen de `CACHE_HOLGURA`) o cada `CACHE_LIMPIEZA`
+# segundos, que es cuando se vuelve a contar la tabla (otros procesos pueden compartirla).
+#
+# Las operaciones hacen E/S de SQLite bajo un `threading.Lock`; desde el bucle de eventos
+# se usan `buscar_en_cache_async` y `guardar_en_cache_async`, que las ejecutan en un hilo.
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+'''! @brief Activa la caché de respuestas ("1") o la desactiva (cualquier otro valor)'''
+CACHE_RESPUESTAS = os.getenv('CACHE_RESPUESTAS', '0') == '1'
+
+'''! @brief Segundos que una respuesta permanece válida en la caché'''
+CACHE_TTL = int(os.getenv('CACHE_TTL', str(7 * 24 * 3600)))
+
+'''! @brief Máximo de respuestas en el nivel de memoria'''
+CACHE_MAX_MEMORIA = int(os.getenv('CACHE_MAX_MEMORIA', '1000'))
+
+'''! @brief Máximo de respuestas en el nivel de disco'''
+CACHE_MAX_DISCO = int(os.getenv('CACHE_MAX_DISCO', '20000'))
+
+'''! @brief Fichero SQLite del nivel de disco'''
+CACHE_DB = os.getenv('CACHE_DB', os.path.join(os.path.dirname(__file__), 'respuestas_cache.db'))
+
+'''! @brief Segundos entre limpiezas del nivel de disco (caducadas y recuento de entradas)'''
+CACHE_LIMPIEZA = int(os.getenv('CACHE_LIMPIEZA', '3600'))
+
+'''! @brief Fracción de `CACHE_MAX_DISCO` que se deja libre al expulsar por tamaño'''
+CACHE_HOLGURA = 0.1
+
+
+def clave_cache(modelo, mensajes, parametros):
+    """
+    @brief Calcula la clave de caché de una petición al modelo.
+
+    @param modelo Nombre del modelo.
+    @param mensajes Lista de diccionarios `role`/`content` que se envían.
+    @param parametros Diccionario con los parámetros de muestreo (`max_tokens`, `temperature`...).
+
+    @return
+    - String hexadecimal con el SHA-256 de la petición.
+    """
+    peticion = json.dumps(
+        {'modelo': modelo, 'mensajes': mensajes, 'parametros': parametros},
+        sort_keys=True, ensure_ascii=False, separators=(',', ':'),
+    )
+    return hashlib.sha256(peticion.encode('utf-8')).hexdigest()
+
+
+class CacheRespuestas:
+    """
+    @brief Caché LRU en memoria respaldada por una tabla SQLite.
+
+    @details
+    Es segura para usarse desde varios hilos. La conexión a SQLite se abre en el primer
+    acceso, de forma que importar el módulo no crea el fichero.
+    """
+
+    def __init__(self, ruta_db=CACHE_DB, ttl=CACHE_TTL, max_memoria=CACHE_MAX_MEMORIA, max_disco=CACHE_MAX_DISCO,
+                 limpieza=CACHE_LIMPIEZA):
+        self.ruta_db = ruta_db
+        self.ttl = ttl
+        self.max_memoria = max_memoria
+        self.max_disco = max_disco
+        self.limpieza = limpieza
+        self._entradas = 0  # Entradas en disco, aproximado entre limpiezas
+        self._ultima_limpieza = 0.0  # La primera inserción limpia y cuenta la tabla
+        self._memoria = OrderedDict()  # clave -> (respuesta, creado)
+        self._lock = threading.Lock()
+        self._conexion = None
+        self._contadores = {'aciertos_memoria': 0, 'aciertos_disco': 0, 'fallos': 0, 'guardados': 0, 'expulsados': 0}
+
+    def _db(self):
+        if self._conexion is None:
+            self._conexion = sqlite3.connect(self.ruta_db, check_same_thread=False, isolation_level=None)
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute("PRAGMA busy_timeout=5000")
+            self._conexion.execute(
+                "CREATE TABLE IF NOT EXISTS respuesta ("
+                "clave TEXT PRIMARY KEY, respuesta TEXT NOT NULL, creado REAL NOT NULL, usado REAL NOT NULL)"
+            )
+            self._conexion.execute("CREATE INDEX IF NOT EXISTS ix_respuesta_usado ON respuesta (usado)")
+        return self._conexion
+
+    def _en_memoria(self, clave, respuesta, creado):
+        self._memoria[clave] = (respuesta, creado)
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_memoria:
+            self._memoria.popitem(last=False)
+
+    def _limpiar(self, db, ahora):
+        """! @brief Expulsa las entradas caducadas y, si sobran, las menos usadas; vuelve a contar la tabla."""
+        expulsadas = db.execute("DELETE FROM respuesta WHERE creado <= ?", (ahora - self.ttl,)).rowcount
+        entradas = db.execute("SELECT COUNT(*) FROM respuesta").fetchone()[0]
+        if entradas > self.max_disco:
+            sobrantes = entradas - int(self.max_disco * (1 - CACHE_HOLGURA))
+            borradas = db.execute(
+                "DELETE FROM respuesta WHERE clave IN (SELECT clave FROM respuesta ORDER BY usado LIMIT ?)",
+                (sobrantes,),
+            ).rowcount
+            expulsadas += borradas
+            entradas -= borradas
+        self._contadores['expulsados'] += expulsadas
+        self._entradas = entradas
+        self._ultima_limpieza = ahora
+
+    def obtener(self, clave):
+        """
+        @brief Busca una respuesta en la caché.
+        @param clave Clave calculada con `clave_cache`.
+        @return String con la respuesta, o `None` si no está o ha caducado.
+        """
+        ahora = time.time()
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is not None and ahora - entrada[1] < self.ttl:
+                self._memoria.move_to_end(clave)
+                self._contadores['aciertos_memoria'] += 1
+                return entrada[0]
+            self._memoria.pop(clave, None)
+            try:
+                fila = self._db().execute(
+                    "SELECT respuesta, creado FROM respuesta WHERE clave = ? AND creado > ?",
+                    (clave, ahora - self.ttl),
+                ).fetchone()
+                if fila is not None:
+                    self._db().execute("UPDATE respuesta SET usado = ? WHERE clave = ?", (ahora, clave))
+            except sqlite3.Error as e:
+                logger.error(f"Error al leer la caché de respuestas: {str(e)}")
+                fila = None
+            if fila is None:
+                self._contadores['fallos'] += 1
+                return None
+            self._contadores['aciertos_disco'] += 1
+            self._en_memoria(clave, fila[0], fila[1])
+            return fila[0]
+
+    def guardar(self, clave, respuesta):
+        """
+        @brief Guarda una respuesta en los dos niveles de la caché.
+        @param clave Clave calculada con `clave_cache`.
+        @param respuesta Texto de la respuesta del modelo.
+        """
+        ahora = time.time()
+        with self._lock:
+            self._en_memoria(clave, respuesta, ahora)
+            self._contadores['guardados'] += 1
+            try:
+                db = self._db()
+                db.execute(
+                    "INSERT OR REPLACE INTO respuesta (clave, respuesta, creado, usado) VALUES (?, ?, ?, ?)",
+                    (clave, respuesta, ahora, ahora),
+                )
+                # Un reemplazo también cuenta: como mucho adelanta la siguiente limpieza
+                self._entradas += 1
+                if self._entradas > self.max_disco or ahora - self._ultima_limpieza >= self.limpieza:
+                    self._limpiar(db, ahora)
+            except sqlite3.Error as e:
+                logger.error(f"Error al guardar en la caché de respuestas: {str(e)}")
+
+    def estadisticas(self):
+        """
+        @brief Devuelve los contadores de uso de la caché.
+        @return Diccionario con aciertos por nivel, fallos, guardados, expulsados, tasa de acierto y tamaño en memoria.
+        """
+        with self._lock:
+            datos = dict(self._contadores)
+            datos['entradas_memoria'] = len(self._memoria)
+        consultas = datos['aciertos_memoria'] + datos['aciertos_disco'] + datos['fallos']
+        datos['tasa_aciertos'] = round((datos['aciertos_memoria'] + datos['aciertos_disco']) / consultas, 4) if consultas else 0.0
+        datos['activa'] = CACHE_RESPUESTAS
+        return datos
+
+
+'''! @brief Instancia compartida de la caché de respuestas'''
+cache_respuestas = CacheRespuestas()
+
+
+def buscar_en_cache(modelo, mensajes, parametros, usar_cache=True):
+    """
+    @brief Consulta la caché para una petición al modelo.
+
+    @param modelo Nombre del modelo.
+    @param mensajes Lista de diccionarios `role`/`content` que se envían.
+    @param parametros Parámetros de muestreo de la petición.
+    @param usar_cache False si la conversación ha desactivado la caché.
+
+    @return
+    - Tupla `(clave, respuesta)`. `clave` es `None` si la caché no se usa para esta petición
+      (y entonces tampoco debe guardarse la respuesta); `respuesta` es `None` si no hay acierto.
+    """
+    if not (CACHE_RESPUESTAS and usar_cache):
+        return None, None
+    clave = clave_cache(modelo, mensajes, parametros)
+    return clave, cache_respuestas.obtener(clave)
+
+
+async def buscar_en_cache_async(modelo, mensajes, parametros, usar_cache=True):
+    """
+    @brief Versión de `buscar_en_cache` para el bucle de eventos.
+
+    @details
+    La consulta (que puede leer SQLite y esperar el `threading.Lock` de la caché) se
+    ejecuta en el ejecutor por defecto del bucle. Si la caché no se usa, no sale del bucle.
+
+    @return
+    - Tupla `(clave, respuesta)`, como `buscar_en_cache`.
+    """
+    if not (CACHE_RESPUESTAS and usar_cache):
+        return None, None
+    return await asyncio.get_running_loop().run_in_executor(
+        None, buscar_en_cache, modelo, mensajes, parametros, usar_cache
+    )
+
+
+async def guardar_en_cache_async(clave, respuesta):
+    """
+    @brief Guarda una respuesta en la caché desde el bucle de eventos, en el ejecutor por defecto.
+    @param clave Clave devuelta por `buscar_en_cache_async`.
+    @param respuesta Texto de la respuesta del modelo.
+    """
+    await asyncio.get_running_loop().run_in_executor(None, cache_respuestas.guardar, clave, respuesta)
@@ -0,0 +1,283 @@
+"""! @brief Lógica de negocio compartida por los endpoints de chat"""
+##
+# @file chat_service.py
+#
+# @brief Construcción del historial que se envía a OpenAI y persistencia
+# de los mensajes intercambiados.
+#
+# @section description_chat_service Descripción
+# Las funciones de este módulo no dependen del contexto de Flask, de forma
+# que pueden reutilizarse tanto desde el endpoint síncrono como desde el
+# endpoint en streaming.
+#
+# @section resumen_chat_service Resumen incremental
+# El historial se envía tal cual mientras quepa en el presupuesto de tokens del
+# modelo (ver `contexto_service`). Los mensajes más antiguos que no caben se
+# condensan en un resumen que se guarda en `Conversacion.resumen`.
+# `Conversacion.resumen_hasta_id` marca el último mensaje incluido en él, de modo
+# que en cada turno sólo se leen (y, si hace falta, se resumen) los mensajes
+# posteriores, junto con el resumen previo.
+import logging
+from collections import namedtuple
+from sqlalchemy import or_, update
+from chatgpt_api.models import Mensaje, Conversacion
+from chatgpt_api.services.openai_service import (
+    obtener_resumen_historial,
+    obtener_codificacion,
+    contar_tokens_texto,
+    TOKENS_POR_MENSAJE,
+    TOKENS_POR_PETICION,
+    MODELO_RESUMEN,
+    MAX_TOKENS_RESUMEN,
+)
+from chatgpt_api.services.planificador_service import PRIORIDAD_RESUMEN
+from chatgpt_api.services.contexto_service import presupuesto_contexto, corte_por_presupuesto, corte_desde_inicio
+from chatgpt_api.services.archivo_service import restaurar
+from chatgpt_api.services.conversacion_service import sumar_tokens
+
+logger = logging.getLogger(__name__)
+
+'''! @brief Mensaje de sistema que se antepone a todas las peticiones'''
+MENSAJE_SISTEMA = {"role": "system", "content": "Salida formato Markdown"}
+
+'''! @brief Máximo de resúmenes consecutivos que puede hacer una petición para ponerse al día'''
+MAX_RONDAS_RESUMEN = 4
+
+'''
+@brief Resultado de `preparar_historial`.
+- `mensajes`: mensajes recientes que se envían tal cual.
+- `resumen`: resumen guardado de los mensajes anteriores (o `None`).
+- `a_resumir`: `None`, o los mensajes que hay que condensar en un nuevo resumen.
+- `resumen_hasta_id`: ID del último mensaje incluido en `a_resumir`.
+'''
+PlanHistorial = namedtuple('PlanHistorial', ['mensajes', 'resumen', 'a_resumir', 'resumen_hasta_id'])
+
+
+def mensaje_resumen(resumen):
+    """
+    @brief Mensaje con el que se presenta al modelo el resumen de la conversación.
+    @param resumen Texto del resumen.
+    @return Diccionario `role`/`content`.
+    """
+    return {'role': 'system', 'content': f"Resumen de la conversación hasta ahora: {resumen}"}
+
+
+def tokens_mensaje(msg, modelo):
+    """
+    @brief Devuelve los tokens del contenido de un mensaje guardado.
+
+    @details
+    Usa el recuento almacenado en `Mensaje.tokens` si se calculó con la misma codificación
+    que la del modelo indicado. En caso contrario (mensaje antiguo sin recuento, o cambio de
+    modelo en la conversación) lo recalcula y lo asigna al objeto para que se guarde con el
+    siguiente `commit`. El llamante debe sumar la diferencia a `Conversacion.tokens_totales`
+    (ver `conversacion_service.sumar_tokens`).
+
+    @param msg Instancia de `Mensaje`.
+    @param modelo Modelo de la conversación.
+
+    @return
+    - Integer con el número de tokens del contenido.
+    """
+    codificacion = obtener_codificacion(modelo).name
+    if msg.tokens is None or msg.codificacion != codificacion:
+        msg.tokens = contar_tokens_texto(msg.mensaje, modelo)
+        msg.codificacion = codificacion
+    return msg.tokens
+
+
+def _a_mensajes(mensajes_db):
+    """! @brief Convierte filas `Mensaje` en diccionarios `role`/`content`."""
+    return [
+        {'role': 'user' if msg.es_usuario else 'assistant', 'content': msg.mensaje}
+        for msg in mensajes_db
+    ]
+
+
+def preparar_historial(db_session, conv, mensaje_usuario):
+    """
+    @brief Prepara el historial que se enviará al modelo sin realizar llamadas de red.
+
+    @details
+    Si el contexto de la conversación está activado, el historial posterior al resumen
+    guardado se rellena desde el mensaje más reciente hacia atrás hasta agotar el
+    presupuesto de tokens del modelo de la conversación (reservando espacio para la
+    respuesta). Si todo cabe no se resume nada. Si no, los mensajes más antiguos que no
+    caben se indican en `a_resumir` (junto con el resumen previo), limitados a lo que admite
+    el modelo de resumen; el llamante obtiene el resumen, lo guarda con `guardar_resumen` y
+    vuelve a preparar el historial. Si el contexto está desactivado sólo se envía el
+    mensaje del usuario.
+
+    @param db_session Sesión de SQLAlchemy.
+    @param conv Instancia de `Conversacion` a la que pertenece el mensaje.
+    @param mensaje_usuario Texto del nuevo mensaje del usuario.
+
+    @return
+    - `PlanHistorial` con los mensajes que se envían tal cual y, si procede, los mensajes a resumir.
+
+    @note
+    Si la conversación estaba archivada, antes se restauran sus mensajes (ver `archivo_service.restaurar`).
+    """
+    restaurar(db_session, conv.id)
+    if not conv.contexto:
+        return PlanHistorial([], None, None, None)
+    consulta = db_session.query(Mensaje).filter_by(conversacion_id=conv.id)
+    if conv.resumen_hasta_id is not None:
+        consulta = consulta.filter(Mensaje.id > conv.resumen_hasta_id)
+    mensajes_db = consulta.order_by(Mensaje.id).all()
+
+    # Sólo se codifica el mensaje nuevo: el resto de recuentos están guardados en la BD
+    guardados = sum(msg.tokens or 0 for msg in mensajes_db)
+    tokens = [tokens_mensaje(msg, conv.modelo) + TOKENS_POR_MENSAJE for msg in mensajes_db]
+    if db_session.dirty:
+        # Guarda los recuentos que faltaban y los suma al total de la conversación
+        sumar_tokens(db_session, conv.id, sum(msg.tokens for msg in mensajes_db) - guardados)
+        db_session.commit()
+    fijos = TOKENS_POR_PETICION + 2 * TOKENS_POR_MENSAJE
+    fijos += contar_tokens_texto(MENSAJE_SISTEMA['content'], conv.modelo)
+    fijos += contar_tokens_texto(mensaje_usuario, conv.modelo)
+    tokens_resumen = 0
+    if conv.resumen:
+        tokens_resumen = contar_tokens_texto(mensaje_resumen(conv.resumen)['content'], conv.modelo) + TOKENS_POR_MENSAJE
+    presupuesto = presupuesto_contexto(conv.modelo) - fijos
+
+    corte = corte_por_presupuesto(tokens, presupuesto - tokens_resumen)
+    if corte == 0:
+        return PlanHistorial(_a_mensajes(mensajes_db), conv.resumen, None, None)
+
+    # No cabe todo: se reserva sitio para el nuevo resumen y se resume lo más antiguo. El
+    # resumen guardado puede ser más largo que uno nuevo (importado o de otra versión): si se
+    # reservara menos de lo que ocupa, el corte podría ser 0 y no se resumiría ningún mensaje.
+    reserva = max(tokens_resumen, MAX_TOKENS_RESUMEN + TOKENS_POR_MENSAJE)
+    corte = max(corte_por_presupuesto(tokens, presupuesto - reserva), 1)
+    presupuesto_resumen = presupuesto_contexto(MODELO_RESUMEN, MAX_TOKENS_RESUMEN) - tokens_resumen - fijos
+    # Al menos un mensaje, para que `resumen_hasta_id` avance sólo sobre mensajes resumidos
+    fin = max(min(corte_desde_inicio(tokens[:corte], presupuesto_resumen), corte), 1)
+    a_resumir = _a_mensajes(mensajes_db[:fin])
+    if conv.resumen:
+        a_resumir.insert(0, mensaje_resumen(conv.resumen))
+    return PlanHistorial(_a_mensajes(mensajes_db[corte:]), conv.resumen, a_resumir, mensajes_db[fin - 1].id)
+
+
+def completar_historial(plan, mensaje_usuario):
+    """
+    @brief Completa el historial preparado con el resumen (si lo hay) y el mensaje de sistema.
+
+    @param plan `PlanHistorial` devuelto por `preparar_historial`.
+    @param mensaje_usuario Texto del nuevo mensaje del usuario.
+
+    @return
+    - Lista de diccionarios `role`/`content` lista para enviar a OpenAI.
+    """
+    mensajes_historial = [dict(MENSAJE_SISTEMA)]
+    if plan.resumen:
+        mensajes_historial.append(mensaje_resumen(plan.resumen))
+    return mensajes_historial + plan.mensajes + [{'role': 'user', 'content': mensaje_usuario}]
+
+
+def resumen_valido(resumen):
+    """
+    @brief Indica si el texto devuelto por `obtener_resumen_historial` es un resumen y no un error.
+    @param resumen Texto devuelto por el servicio de resumen.
+    @return True si puede guardarse como resumen.
+    """
+    return bool(resumen) and not resumen.startswith("Error")
+
+
+def guardar_resumen(db_session, conversacion_id, resumen, resumen_hasta_id):
+    """
+    @brief Guarda el resumen de la conversación y la marca del último mensaje resumido.
+
+    @details
+    La actualización es condicional: si otra petición concurrente ya ha guardado un resumen
+    que cubre más mensajes, éste no lo sobrescribe.
+
+    @param db_session Sesión de SQLAlchemy.
+    @param conversacion_id ID de la conversación.
+    @param resumen Texto del resumen.
+    @param resumen_hasta_id ID del último mensaje incluido en el resumen.
+    """
+    db_session.query(Conversacion).filter(
+        Conversacion.id == conversacion_id,
+        or_(Conversacion.resumen_hasta_id.is_(None), Conversacion.resumen_hasta_id < resumen_hasta_id),
+    ).update({'resumen': resumen, 'resumen_hasta_id': resumen_hasta_id}, synchronize_session=False)
+    db_session.commit()
+
+
+def construir_historial(db_session, conv, mensaje_usuario, prioridad=PRIORIDAD_RESUMEN):
+    """
+    @brief Construye la lista de mensajes que se enviará al modelo.
+
+    @details
+    Versión síncrona que encadena `preparar_historial`, las peticiones de resumen a
+    OpenAI que hagan falta (como máximo `MAX_RONDAS_RESUMEN`), `guardar_resumen` y
+    `completar_historial`. Si un resumen falla se conserva el resumen anterior, no se
+    avanza la marca y se envían sólo los mensajes recientes que caben en el presupuesto.
+
+    @param db_session Sesión de SQLAlchemy.
+    @param conv Instancia de `Conversacion` a la que pertenece el mensaje.
+    @param mensaje_usuario Texto del nuevo mensaje del usuario.
+    @param prioridad Prioridad de los resúmenes en el planificador (los trabajos en segundo
+    plano pasan la suya para no adelantarse a los chats).
+
+    @return
+    - Lista de diccionarios `role`/`content` lista para enviar a OpenAI.
+    """
+    plan = preparar_historial(db_session, conv, mensaje_usuario)
+    for _ in range(MAX_RONDAS_RESUMEN):
+        if not plan.a_resumir:
+            break
+        resumen = obtener_resumen_historial(plan.a_resumir, prioridad)
+        if not resumen_valido(resumen):
+            logger.error(f"No se pudo actualizar el resumen de la conversación {conv.id}: {resumen}")
+            break
+        guardar_resumen(db_session, conv.id, resumen, plan.resumen_hasta_id)
+        plan = preparar_historial(db_session, conv, mensaje_usuario)
+    return completar_historial(plan, mensaje_usuario)
+
+
+def guardar_intercambio(db_session, conversacion_id, mensaje_usuario, respuesta, modelo):
+    """
+    @brief Persiste el mensaje del usuario y la respuesta del asistente.
+
+    @details
+    El número de tokens de cada mensaje se calcula una única vez, aquí, y se guarda junto
+    al mensaje para no tener que volver a codificar el historial en cada petición.
+    En la misma transacción se actualizan los campos de actividad de la conversación
+    (`fecha_actividad`, `num_mensajes` y `tokens_totales`).
+
+    @param db_session Sesión de SQLAlchemy.
+    @param conversacion_id ID de la conversación.
+    @param mensaje_usuario Texto enviado por el usuario.
+    @param respuesta Texto generado por el asistente (puede ser parcial si el streaming se interrumpió),
+    o None para guardar sólo el mensaje del usuario (el streaming falló antes del primer fragmento).
+    @param modelo Modelo de la conversación, cuya codificación se usa para contar los tokens.
+    """
+    codificacion = obtener_codificacion(modelo).name
+    mensajes = [(mensaje_usuario, True)]
+    if respuesta is not None:
+        mensajes.append((respuesta, False))
+    total = 0
+    for texto, es_usuario in mensajes:
+        tokens = contar_tokens_texto(texto, modelo)
+        total += tokens
+        ultimo = Mensaje(
+            conversacion_id=conversacion_id,
+            mensaje=texto,
+            es_usuario=es_usuario,
+            tokens=tokens,
+            codificacion=codificacion,
+        )
+        db_session.add(ultimo)
+    db_session.flush()
+    # Incremento en SQL: correcto aunque otro proceso guarde mensajes en la misma conversación
+    db_session.execute(
+        update(Conversacion)
+        .where(Conversacion.id == conversacion_id)
+        .values(
+            fecha_actividad=ultimo.fecha_creacion,
+            num_mensajes=Conversacion.num_mensajes + len(mensajes),
+            tokens_totales=Conversacion.tokens_totales + total,
+        )
+    )
+    db_session.commit()
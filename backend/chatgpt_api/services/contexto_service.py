@@ -0,0 +1,116 @@
+"""! @brief Presupuesto de tokens del contexto según el modelo"""
+##
+# @file contexto_service.py
+#
+# @brief Tamaño de la ventana de contexto de cada modelo y selección de los
+# mensajes del historial que caben en ella.
+#
+# @section description_contexto_service Descripción
+# El historial se rellena desde el mensaje más reciente hacia atrás hasta agotar
+# el presupuesto. El presupuesto es la ventana del modelo menos los tokens
+# reservados para la respuesta (`MAX_TOKENS_RESPUESTA`), limitado además por
+# `PRESUPUESTO_CONTEXTO` para acotar el coste de cada petición en modelos con
+# ventanas muy grandes.
+import os
+from chatgpt_api.services.openai_service import MAX_TOKENS_RESPUESTA
+
+'''
+@brief Ventana de contexto (en tokens) por prefijo de nombre de modelo.
+Se usa el prefijo más largo que coincida con el nombre del modelo.
+'''
+LIMITES_CONTEXTO = {
+    'gpt-3.5-turbo': 16385,
+    'gpt-3.5-turbo-instruct': 4096,
+    'gpt-4': 8192,
+    'gpt-4-32k': 32768,
+    'gpt-4-turbo': 128000,
+    'gpt-4-1106': 128000,
+    'gpt-4-0125': 128000,
+    'gpt-4o': 128000,
+    'gpt-4.1': 1047576,
+    'gpt-4.5': 128000,
+    'gpt-5': 400000,
+    'o1': 200000,
+    'o1-mini': 128000,
+    'o3': 200000,
+    'o4-mini': 200000,
+}
+
+'''! @brief Ventana de contexto supuesta para modelos desconocidos'''
+CONTEXTO_POR_DEFECTO = 4096
+
+'''! @brief Máximo de tokens de historial por petición, sea cual sea la ventana del modelo'''
+PRESUPUESTO_CONTEXTO = int(os.getenv('PRESUPUESTO_CONTEXTO', '16000'))
+
+'''! @brief Margen que se deja libre para absorber las diferencias de recuento de tokens'''
+MARGEN_TOKENS = 64
+
+
+def limite_contexto(modelo):
+    """
+    @brief Devuelve el tamaño de la ventana de contexto de un modelo.
+
+    @param modelo Nombre del modelo (e.g., "gpt-4o-mini").
+
+    @return
+    - Integer con el número de tokens de la ventana; `CONTEXTO_POR_DEFECTO` si el modelo no se conoce.
+    """
+    coincidencias = [prefijo for prefijo in LIMITES_CONTEXTO if modelo.startswith(prefijo)]
+    if not coincidencias:
+        return CONTEXTO_POR_DEFECTO
+    return LIMITES_CONTEXTO[max(coincidencias, key=len)]
+
+
+def presupuesto_contexto(modelo, reservado=MAX_TOKENS_RESPUESTA):
+    """
+    @brief Devuelve cuántos tokens de entrada pueden enviarse a un modelo.
+
+    @param modelo Nombre del modelo.
+    @param reservado Tokens que se reservan para la salida del modelo.
+
+    @return
+    - Integer con el presupuesto de tokens para los mensajes de entrada.
+    """
+    return min(limite_contexto(modelo) - reservado - MARGEN_TOKENS, PRESUPUESTO_CONTEXTO)
+
+
+def corte_por_presupuesto(tokens, presupuesto):
+    """
+    @brief Calcula cuántos de los mensajes más recientes caben en un presupuesto.
+
+    @details
+    Recorre los recuentos desde el final (mensaje más reciente) hacia el principio y se
+    detiene en el primero que no cabe, de forma que el bloque seleccionado es siempre
+    contiguo y termina en el último mensaje.
+
+    @param tokens Lista con los tokens de cada mensaje, en orden cronológico.
+    @param presupuesto Tokens disponibles.
+
+    @return
+    - Índice `corte` tal que `tokens[corte:]` cabe en el presupuesto. `0` si cabe todo.
+    """
+    usados = 0
+    for indice in range(len(tokens) - 1, -1, -1):
+        if usados + tokens[indice] > presupuesto:
+            return indice + 1
+        usados += tokens[indice]
+    return 0
+
+
+def corte_desde_inicio(tokens, presupuesto):
+    """
+    @brief Calcula cuántos de los mensajes más antiguos caben en un presupuesto.
+
+    @param tokens Lista con los tokens de cada mensaje, en orden cronológico.
+    @param presupuesto Tokens disponibles.
+
+    @return
+    - Número `n` de mensajes tal que `tokens[:n]` cabe en el presupuesto (al menos 1 si hay mensajes,
+      para garantizar que siempre se avanza).
+    """
+    usados = 0
+    for indice, cantidad in enumerate(tokens):
+        if usados + cantidad > presupuesto:
+            return max(indice, 1)
+        usados += cantidad
+    return len(tokens)
@@ -0,0 +1,259 @@
+"""! @brief Borrado de conversaciones con sentencias sobre conjuntos, por bloques"""
+##
+# @file conversacion_service.py
+#
+# @brief Elimina conversaciones junto con sus mensajes, trabajos y mensajes archivados
+# sin cargarlos en memoria, en transacciones cortas.
+#
+# @section description_conversacion_service Descripción
+# `db_session.delete(conv)` carga todos los mensajes de la conversación para borrarlos
+# uno a uno (cascada del ORM). Aquí se usan sentencias `DELETE ... WHERE conversacion_id
+# IN (...)`, y los mensajes se borran en bloques de `BORRADO_LOTE` filas, cada uno en su
+# propia transacción, de modo que purgar datos antiguos no bloquea la base de datos
+# durante mucho tiempo. Entre bloques se hace una pausa (`BORRADO_PAUSA`) para que las
+# escrituras que esperan el bloqueo de SQLite puedan entrar.
+#
+# Los mensajes se borran antes que la conversación: si el proceso se interrumpe, la
+# conversación sigue existiendo (con menos mensajes) y basta con volver a borrarla.
+#
+# @section actividad_conversacion_service Actividad
+# `Conversacion.fecha_actividad`, `num_mensajes` y `tokens_totales` permiten listar las
+# conversaciones por actividad con una sola consulta indexada. `guardar_intercambio` los
+# incrementa en la misma transacción que inserta los mensajes; `recalcular_actividad` los
+# calcula desde cero a partir de la tabla `mensaje` (importación y migración). Los recuentos
+# de tokens que faltan se suman a `tokens_totales` cuando se calculan (`rellenar_tokens`).
+import logging
+import time
+from collections import Counter, namedtuple
+from sqlalchemy import select, update, delete, exists, and_, func, text
+from chatgpt_api.models import Conversacion, Mensaje, Trabajo, Archivo
+
+logger = logging.getLogger(__name__)
+
+'''! @brief Mensajes borrados como máximo en cada transacción'''
+BORRADO_LOTE = 2000
+
+'''! @brief Conversaciones que se borran juntas en cada bloque'''
+BORRADO_CONVERSACIONES = 100
+
+'''! @brief Segundos de pausa entre transacciones de borrado'''
+BORRADO_PAUSA = 0.05
+
+'''! @brief Mensajes que se leen y actualizan en cada lote al rellenar `Mensaje.tokens`'''
+RECUENTO_LOTE = 1000
+
+'''! @brief Resultado de un borrado: número de conversaciones y de mensajes eliminados'''
+ResultadoBorrado = namedtuple('ResultadoBorrado', ['conversaciones', 'mensajes'])
+
+
+def _borrar(db_session, sentencia):
+    return db_session.execute(sentencia.execution_options(synchronize_session=False)).rowcount
+
+
+def _eliminar_bloque(db_session, ids, lote, pausa):
+    """! @brief Elimina un bloque de conversaciones (ver `eliminar_conversaciones`)."""
+    mensajes = 0
+    while True:
+        borrados = _borrar(db_session, delete(Mensaje).where(Mensaje.id.in_(
+            select(Mensaje.id).where(Mensaje.conversacion_id.in_(ids)).limit(lote)
+        )))
+        db_session.commit()
+        mensajes += borrados
+        if borrados < lote:
+            break
+        time.sleep(pausa)
+    # Se repite el borrado de mensajes por si ha llegado alguno desde el último bloque
+    mensajes += _borrar(db_session, delete(Mensaje).where(Mensaje.conversacion_id.in_(ids)))
+    _borrar(db_session, delete(Trabajo).where(Trabajo.conversacion_id.in_(ids)))
+    _borrar(db_session, delete(Archivo).where(Archivo.conversacion_id.in_(ids)))
+    conversaciones = _borrar(db_session, delete(Conversacion).where(Conversacion.id.in_(ids)))
+    db_session.commit()
+    return ResultadoBorrado(conversaciones, mensajes)
+
+
+def eliminar_conversaciones(db_session, ids, lote=BORRADO_LOTE, pausa=BORRADO_PAUSA):
+    """
+    @brief Elimina conversaciones con todos sus mensajes (también los archivados) y trabajos.
+
+    @param db_session Sesión de SQLAlchemy. Se hace commit de cada bloque.
+    @param ids Iterable de IDs de conversación (los que no existen se ignoran).
+    @param lote Mensajes borrados como máximo en cada transacción.
+    @param pausa Segundos de espera entre transacciones.
+
+    @return
+    - `ResultadoBorrado` con el número de conversaciones y mensajes eliminados.
+
+    @code
+    Ejemplo de uso:
+    resultado = eliminar_conversaciones(db_session, [12, 15])
+    @endcode
+    """
+    ids = list(ids)
+    total = ResultadoBorrado(0, 0)
+    for inicio in range(0, len(ids), BORRADO_CONVERSACIONES):
+        resultado = _eliminar_bloque(db_session, ids[inicio:inicio + BORRADO_CONVERSACIONES], lote, pausa)
+        total = ResultadoBorrado(total.conversaciones + resultado.conversaciones, total.mensajes + resultado.mensajes)
+    return total
+
+
+def eliminar_inactivas(db_session, anteriores_a, lote=BORRADO_LOTE, pausa=BORRADO_PAUSA):
+    """
+    @brief Elimina las conversaciones sin actividad desde una fecha.
+
+    @details
+    Una conversación está inactiva si se creó antes de `anteriores_a` y no tiene mensajes
+    posteriores, ni activos ni archivados (la comprobación usa el índice
+    `ix_mensaje_conversacion_id_fecha` y la clave primaria de `archivo`). Las
+    conversaciones se seleccionan y se borran en bloques de `BORRADO_CONVERSACIONES`.
+
+    @param db_session Sesión de SQLAlchemy. Se hace commit de cada bloque.
+    @param anteriores_a `datetime` (UTC) límite.
+    @param lote Mensajes borrados como máximo en cada transacción.
+    @param pausa Segundos de espera entre transacciones.
+
+    @return
+    - `ResultadoBorrado` con el número de conversaciones y mensajes eliminados.
+    """
+    activa = exists().where(and_(
+        Mensaje.conversacion_id == Conversacion.id,
+        Mensaje.fecha_creacion >= anteriores_a,
+    ))
+    archivada_activa = exists().where(and_(
+        Archivo.conversacion_id == Conversacion.id,
+        Archivo.fecha_ultimo_mensaje >= anteriores_a,
+    ))
+    total = ResultadoBorrado(0, 0)
+    ultimo_id = 0
+    while True:
+        ids = db_session.execute(
+            select(Conversacion.id)
+            .where(Conversacion.id > ultimo_id, Conversacion.fecha_creacion < anteriores_a, ~activa, ~archivada_activa)
+            .order_by(Conversacion.id)
+            .limit(BORRADO_CONVERSACIONES)
+        ).scalars().all()
+        if not ids:
+            return total
+        resultado = _eliminar_bloque(db_session, ids, lote, pausa)
+        total = ResultadoBorrado(total.conversaciones + resultado.conversaciones, total.mensajes + resultado.mensajes)
+        ultimo_id = ids[-1]
+        time.sleep(pausa)
+
+
+def recalcular_actividad(conexion, ids=None):
+    """
+    @brief Recalcula los campos de actividad de las conversaciones a partir de sus mensajes.
+
+    @details
+    Sólo tiene en cuenta la tabla `mensaje`: los mensajes archivados no se cuentan (ver la
+    migración que rellena los campos). Los mensajes sin recuento de tokens suman 0 y se
+    añaden al total cuando se calculan (`rellenar_tokens`, `chat_service.tokens_mensaje`).
+    `fecha_modificacion` se conserva: no es un cambio de la conversación.
+
+    @param conexion Sesión o conexión de SQLAlchemy. No se hace commit.
+    @param ids Iterable de IDs de conversación, o None para recalcular todas.
+    """
+    de_la_conversacion = Mensaje.conversacion_id == Conversacion.id
+    sentencia = update(Conversacion).values(
+        num_mensajes=select(func.count(Mensaje.id)).where(de_la_conversacion).scalar_subquery(),
+        tokens_totales=select(func.coalesce(func.sum(Mensaje.tokens), 0)).where(de_la_conversacion).scalar_subquery(),
+        fecha_actividad=func.coalesce(
+            select(func.max(Mensaje.fecha_creacion)).where(de_la_conversacion).scalar_subquery(),
+            Conversacion.fecha_creacion,
+        ),
+        # Evita el `onupdate` de la columna
+        fecha_modificacion=Conversacion.fecha_modificacion,
+    )
+    if ids is not None:
+        sentencia = sentencia.where(Conversacion.id.in_(list(ids)))
+    conexion.execute(sentencia.execution_options(synchronize_session=False))
+
+
+def sumar_tokens(conexion, conversacion_id, tokens):
+    """
+    @brief Suma tokens a `Conversacion.tokens_totales` sin cambiar `fecha_modificacion`.
+
+    @details
+    Para los recuentos de mensajes que se calculan después de guardarlos (ver
+    `chat_service.tokens_mensaje`).
+
+    @param conexion Sesión o conexión de SQLAlchemy. No se hace commit.
+    @param conversacion_id ID de la conversación.
+    @param tokens Tokens a sumar (pueden ser negativos si cambia la codificación).
+    """
+    conexion.execute(
+        update(Conversacion)
+        .where(Conversacion.id == conversacion_id)
+        .values(
+            tokens_totales=Conversacion.tokens_totales + tokens,
+            fecha_modificacion=Conversacion.fecha_modificacion,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def rellenar_tokens(conn, conversaciones=None, lote=RECUENTO_LOTE, confirmar_lotes=False):
+    """
+    @brief Calcula `Mensaje.tokens` de los mensajes que no lo tienen, con la codificación del modelo de su conversación.
+
+    @details
+    Los mensajes se leen y se actualizan en lotes de `lote` filas, así que la memoria no
+    depende del tamaño de la tabla. Los tokens calculados se suman a
+    `Conversacion.tokens_totales` (ver `sumar_tokens`). Si tiktoken no puede cargar alguna
+    codificación (e.g., sin acceso a la red), no se calcula nada: los recuentos que falten
+    se calculan al leer el historial (ver `chat_service.tokens_mensaje`) o más tarde con
+    `flask migrar`.
+
+    @param conn Sesión o conexión de SQLAlchemy.
+    @param conversaciones Iterable de IDs de conversación, o None para todos los mensajes.
+    @param lote Mensajes por lote.
+    @param confirmar_lotes Si es True se hace commit de cada lote, para no bloquear las
+    escrituras de otros procesos mientras se recorre la tabla. Si es False no se hace commit.
+
+    @return
+    - Número de mensajes actualizados.
+    """
+    from chatgpt_api.services.openai_service import obtener_codificacion, contar_tokens_texto
+    filtro = ''
+    if conversaciones is not None:
+        conversaciones = [int(id) for id in conversaciones]
+        if not conversaciones:
+            return 0
+        filtro = f" AND m.conversacion_id IN ({', '.join(map(str, conversaciones))})"
+    modelos = conn.execute(text(
+        "SELECT DISTINCT c.modelo FROM mensaje m JOIN conversacion c ON c.id = m.conversacion_id "
+        f"WHERE m.tokens IS NULL{filtro}"
+    )).scalars().all()
+    try:
+        codificaciones = {modelo: obtener_codificacion(modelo).name for modelo in modelos}
+    except Exception as e:
+        logger.warning(f"No se pueden contar los tokens de los mensajes existentes ({e}); se calcularán al leerlos")
+        return 0
+    total = 0
+    ultimo_id = 0
+    while True:
+        filas = conn.execute(text(
+            "SELECT m.id, m.conversacion_id, m.mensaje, c.modelo FROM mensaje m "
+            "JOIN conversacion c ON c.id = m.conversacion_id "
+            f"WHERE m.tokens IS NULL AND m.id > :ultimo_id{filtro} ORDER BY m.id LIMIT :limite"
+        ), {'ultimo_id': ultimo_id, 'limite': lote}).all()
+        if not filas:
+            break
+        recuentos = [
+            {'id': id, 'tokens': contar_tokens_texto(mensaje, modelo), 'codificacion': codificaciones[modelo]}
+            for id, _, mensaje, modelo in filas
+        ]
+        conn.execute(
+            text("UPDATE mensaje SET tokens = :tokens, codificacion = :codificacion WHERE id = :id"), recuentos
+        )
+        por_conversacion = Counter()
+        for fila, recuento in zip(filas, recuentos):
+            por_conversacion[fila.conversacion_id] += recuento['tokens']
+        for conversacion_id, tokens in por_conversacion.items():
+            sumar_tokens(conn, conversacion_id, tokens)
+        if confirmar_lotes:
+            conn.commit()
+        ultimo_id = filas[-1][0]
+        total += len(filas)
+        if total % (lote * 100) < lote:
+            logger.info(f"Tokens calculados de {total} mensajes")
+    return total
@@ -0,0 +1,323 @@
+"""! @brief Exportación e importación de conversaciones en formato NDJSON"""
+##
+# @file exportacion_service.py
+#
+# @brief Copia de seguridad, migración y carga inicial de conversaciones y mensajes
+# como NDJSON (un objeto JSON por línea).
+#
+# @section formato_exportacion_service Formato
+# La primera línea es una cabecera con la versión del formato; después, cada
+# conversación seguida de sus mensajes en orden cronológico:
+# @code
+# {"tipo": "exportacion", "version": 1, "fecha": "2025-04-14T10:00:00"}
+# {"tipo": "conversacion", "id": 7, "nombre": "Mi Conversación", "modelo": "gpt-4o", ...}
+# {"tipo": "mensaje", "conversacion_id": 7, "mensaje": "Hola", "es_usuario": true, ...}
+# @endcode
+# Los IDs sólo sirven para relacionar los mensajes con su conversación: al importar
+# se asignan IDs nuevos, de modo que un fichero puede cargarse en una base de datos
+# que ya tenga conversaciones. El mensaje con `"fin_resumen": true` es el último que
+# incluye el resumen de la conversación (`Conversacion.resumen_hasta_id`).
+#
+# @section memoria_exportacion_service Memoria
+# - Exportar: las conversaciones y los mensajes se leen con dos cursores ordenados
+#   (`yield_per`) que se recorren a la vez, así que la memoria no depende del tamaño
+#   de la base de datos. Toda la exportación se lee en la misma transacción, por lo
+#   que es una copia coherente aunque lleguen mensajes mientras tanto. Los mensajes
+#   archivados (ver `archivo_service`) se descomprimen de uno en uno por conversación
+#   y se exportan como el resto.
+# - Importar: las filas se insertan en bloques de `IMPORTACION_LOTE` con un `INSERT`
+#   por bloque y un commit por bloque. Sólo se guarda en memoria la correspondencia
+#   entre los IDs del fichero y los nuevos IDs de las conversaciones.
+import json
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import select, insert, update
+from chatgpt_api.models import Conversacion, Mensaje, Archivo
+from chatgpt_api.services.archivo_service import mensajes_archivados
+from chatgpt_api.services.conversacion_service import recalcular_actividad, rellenar_tokens
+
+'''! @brief Versión del formato que se escribe en la cabecera'''
+FORMATO_VERSION = 1
+
+'''! @brief Filas que se leen de la base de datos en cada lote al exportar'''
+EXPORTACION_LOTE = 1000
+
+'''! @brief Archivos (blobs comprimidos) que se leen de la base de datos en cada lote al exportar'''
+EXPORTACION_LOTE_ARCHIVO = 10
+
+'''! @brief Tamaño aproximado (caracteres) de cada bloque de la respuesta al exportar'''
+EXPORTACION_BLOQUE = 64 * 1024
+
+'''! @brief Líneas que se insertan en cada transacción al importar'''
+IMPORTACION_LOTE = 5000
+
+'''! @brief Resultado de `importar`: número de conversaciones y de mensajes insertados'''
+ResultadoImportacion = namedtuple('ResultadoImportacion', ['conversaciones', 'mensajes'])
+
+
+class ErrorImportacion(ValueError):
+    """
+    @brief Línea no válida en un fichero de importación.
+
+    @details
+    Los bloques anteriores a la línea ya están guardados: `resultado` indica cuántas
+    conversaciones y mensajes se han importado.
+    """
+
+    def __init__(self, linea, mensaje, resultado=None):
+        super().__init__(f"Línea {linea}: {mensaje}")
+        self.linea = linea
+        self.resultado = resultado
+
+
+def _fecha(valor):
+    return valor.isoformat() if valor else None
+
+
+def _leer_fecha(valor):
+    return datetime.fromisoformat(valor) if valor else datetime.utcnow()
+
+
+def _linea(registro):
+    return json.dumps(registro, ensure_ascii=False) + '\n'
+
+
+def _registro_mensaje(conv, id, campos):
+    registro = {
+        'tipo': 'mensaje',
+        'conversacion_id': conv.id,
+        'mensaje': campos['mensaje'],
+        'es_usuario': bool(campos['es_usuario']),
+        'fecha_creacion': campos['fecha_creacion'],
+        'tokens': campos['tokens'],
+        'codificacion': campos['codificacion'],
+    }
+    if id == conv.resumen_hasta_id:
+        registro['fin_resumen'] = True
+    return registro
+
+
+def lineas_exportacion(db_session, lote=EXPORTACION_LOTE):
+    """
+    @brief Genera las líneas NDJSON de todas las conversaciones y sus mensajes.
+
+    @param db_session Sesión de SQLAlchemy. La transacción queda abierta hasta que se
+    consume el generador.
+    @param lote Filas que se leen de la base de datos en cada lote.
+
+    @return
+    - Generador de strings, una línea (terminada en `\\n`) por registro.
+    """
+    yield _linea({'tipo': 'exportacion', 'version': FORMATO_VERSION, 'fecha': datetime.utcnow().isoformat()})
+    conversaciones = db_session.execute(
+        select(Conversacion.__table__).order_by(Conversacion.id).execution_options(yield_per=lote)
+    )
+    mensajes = db_session.execute(
+        select(Mensaje.__table__)
+        .where(Mensaje.conversacion_id.is_not(None))
+        .order_by(Mensaje.conversacion_id, Mensaje.id)  # ix_mensaje_conversacion_id_id
+        .execution_options(yield_per=lote)
+    )
+    archivos = db_session.execute(
+        select(Archivo.conversacion_id, Archivo.datos)
+        .order_by(Archivo.conversacion_id)
+        .execution_options(yield_per=EXPORTACION_LOTE_ARCHIVO)
+    )
+    mensaje = next(mensajes, None)
+    archivo = next(archivos, None)
+    for conv in conversaciones:
+        yield _linea({
+            'tipo': 'conversacion',
+            'id': conv.id,
+            'nombre': conv.nombre,
+            'contexto': bool(conv.contexto),
+            'modelo': conv.modelo,
+            'usar_cache': bool(conv.usar_cache),
+            'resumen': conv.resumen,
+            'fecha_creacion': _fecha(conv.fecha_creacion),
+            'fecha_modificacion': _fecha(conv.fecha_modificacion),
+        })
+        # Se descartan los mensajes huérfanos (sin conversación). Los archivados son
+        # anteriores a los activos (los IDs no se reutilizan), así que van primero.
+        while archivo is not None and archivo.conversacion_id <= conv.id:
+            if archivo.conversacion_id == conv.id:
+                for registro in mensajes_archivados(archivo.datos):
+                    yield _linea(_registro_mensaje(conv, registro['id'], registro))
+            archivo = next(archivos, None)
+        while mensaje is not None and mensaje.conversacion_id <= conv.id:
+            if mensaje.conversacion_id == conv.id:
+                yield _linea(_registro_mensaje(conv, mensaje.id, {
+                    'mensaje': mensaje.mensaje,
+                    'es_usuario': mensaje.es_usuario,
+                    'fecha_creacion': _fecha(mensaje.fecha_creacion),
+                    'tokens': mensaje.tokens,
+                    'codificacion': mensaje.codificacion,
+                }))
+            mensaje = next(mensajes, None)
+
+
+def exportar(db_session, lote=EXPORTACION_LOTE, bloque=EXPORTACION_BLOQUE):
+    """
+    @brief Genera la exportación NDJSON agrupando las líneas en bloques.
+
+    @details
+    Escribir cada línea por separado supone una llamada al servidor WSGI (y a veces un
+    paquete TCP) por mensaje; los bloques de `bloque` caracteres reducen esa sobrecarga
+    sin dejar de enviar los datos a medida que se leen.
+
+    @param db_session Sesión de SQLAlchemy.
+    @param lote Filas que se leen de la base de datos en cada lote.
+    @param bloque Tamaño aproximado de cada bloque en caracteres.
+
+    @return
+    - Generador de strings con líneas NDJSON completas.
+    """
+    pendientes, tamano = [], 0
+    for linea in lineas_exportacion(db_session, lote):
+        pendientes.append(linea)
+        tamano += len(linea)
+        if tamano >= bloque:
+            yield ''.join(pendientes)
+            pendientes, tamano = [], 0
+    if pendientes:
+        yield ''.join(pendientes)
+
+
+def _fila_conversacion(registro):
+    return {
+        'nombre': str(registro['nombre']),
+        'contexto': bool(registro.get('contexto', True)),
+        'modelo': str(registro.get('modelo') or 'gpt-3.5-turbo'),
+        'usar_cache': bool(registro.get('usar_cache', True)),
+        'resumen': registro.get('resumen'),
+        'resumen_hasta_id': None,
+        'fecha_creacion': _leer_fecha(registro.get('fecha_creacion')),
+        'fecha_modificacion': _leer_fecha(registro.get('fecha_modificacion') or registro.get('fecha_creacion')),
+        # Los campos de actividad se calculan al insertar sus mensajes (ver `_Importacion.volcar`)
+        'fecha_actividad': _leer_fecha(registro.get('fecha_creacion')),
+    }
+
+
+def _fila_mensaje(registro):
+    if not isinstance(registro['mensaje'], str):
+        raise ValueError("'mensaje' debe ser un texto")
+    return {
+        'conversacion_id': registro['conversacion_id'],
+        'mensaje': registro['mensaje'],
+        'es_usuario': bool(registro['es_usuario']),
+        'fecha_creacion': _leer_fecha(registro.get('fecha_creacion')),
+        'tokens': registro.get('tokens'),
+        'codificacion': registro.get('codificacion'),
+    }
+
+
+class _Importacion:
+    """! @brief Estado de una importación en curso (ver `importar`)."""
+
+    def __init__(self, db_session):
+        self.db_session = db_session
+        self.ids = {}  # ID en el fichero -> ID nuevo de la conversación
+        self.conversaciones = []  # (ID en el fichero, fila)
+        self.mensajes = []  # (número de línea, fila, fin_resumen)
+        self.resultado = ResultadoImportacion(0, 0)
+
+    def pendientes(self):
+        return len(self.conversaciones) + len(self.mensajes)
+
+    def volcar(self):
+        """! @brief Inserta las filas pendientes y hace commit del bloque."""
+        db_session = self.db_session
+        if self.conversaciones:
+            nuevos = db_session.execute(
+                insert(Conversacion).returning(Conversacion.id, sort_by_parameter_order=True),
+                [fila for _, fila in self.conversaciones],
+            ).scalars().all()
+            self.ids.update(zip((id for id, _ in self.conversaciones), nuevos))
+        filas = []
+        for linea, fila, _ in self.mensajes:
+            if fila['conversacion_id'] not in self.ids:
+                db_session.rollback()
+                raise ErrorImportacion(linea, f"conversación {fila['conversacion_id']} no definida antes", self.resultado)
+            filas.append(dict(fila, conversacion_id=self.ids[fila['conversacion_id']]))
+        if filas:
+            if any(fin for _, _, fin in self.mensajes):
+                # Hacen falta los IDs nuevos para apuntar `resumen_hasta_id` al mensaje marcado
+                nuevos = db_session.execute(
+                    insert(Mensaje).returning(Mensaje.id, sort_by_parameter_order=True), filas
+                ).scalars().all()
+                for (_, _, fin), fila, id in zip(self.mensajes, filas, nuevos):
+                    if fin:
+                        db_session.execute(
+                            update(Conversacion)
+                            .where(Conversacion.id == fila['conversacion_id'])
+                            .values(resumen_hasta_id=id)
+                        )
+            else:
+                db_session.execute(insert(Mensaje), filas)
+            # Los mensajes de una conversación pueden repartirse entre varios bloques
+            ids = {fila['conversacion_id'] for fila in filas}
+            rellenar_tokens(db_session, ids)
+            recalcular_actividad(db_session, ids)
+        db_session.commit()
+        self.resultado = ResultadoImportacion(
+            self.resultado.conversaciones + len(self.conversaciones),
+            self.resultado.mensajes + len(filas),
+        )
+        self.conversaciones, self.mensajes = [], []
+
+
+def importar(db_session, lineas, lote=IMPORTACION_LOTE):
+    """
+    @brief Importa conversaciones y mensajes desde líneas NDJSON.
+
+    @details
+    Acepta el formato que genera `exportar` (la cabecera es opcional). Cada conversación
+    recibe un ID nuevo y sus mensajes se asocian a él; un mensaje debe aparecer después
+    de su conversación. Las filas se insertan en bloques de `lote` líneas, cada uno en
+    su propia transacción.
+
+    @param db_session Sesión de SQLAlchemy.
+    @param lineas Iterable de líneas (`str` o `bytes` UTF-8), e.g. el cuerpo de la petición.
+    @param lote Líneas por bloque (y por transacción).
+
+    @return
+    - `ResultadoImportacion` con el número de conversaciones y mensajes insertados.
+
+    @throws ErrorImportacion Si una línea no es válida. Los bloques anteriores quedan
+    guardados y el bloque en curso se descarta.
+
+    @code
+    Ejemplo de uso:
+    with open('copia.ndjson', encoding='utf-8') as fichero:
+        resultado = importar(db_session, fichero)
+    @endcode
+    """
+    importacion = _Importacion(db_session)
+    for numero, linea in enumerate(lineas, 1):
+        if isinstance(linea, bytes):
+            linea = linea.decode('utf-8')
+        linea = linea.strip()
+        if not linea:
+            continue
+        try:
+            registro = json.loads(linea)
+            if not isinstance(registro, dict):
+                raise ValueError('se esperaba un objeto JSON')
+            tipo = registro.get('tipo')
+            if tipo == 'conversacion':
+                importacion.conversaciones.append((registro['id'], _fila_conversacion(registro)))
+            elif tipo == 'mensaje':
+                importacion.mensajes.append((numero, _fila_mensaje(registro), bool(registro.get('fin_resumen'))))
+            elif tipo == 'exportacion':
+                if registro.get('version') != FORMATO_VERSION:
+                    raise ValueError(f"versión del formato no admitida: {registro.get('version')}")
+            else:
+                raise ValueError(f"tipo de registro desconocido: {tipo}")
+        except (ValueError, KeyError, TypeError) as e:
+            db_session.rollback()
+            detalle = f"falta el campo {e}" if isinstance(e, KeyError) else str(e)
+            raise ErrorImportacion(numero, detalle, importacion.resultado) from e
+        if importacion.pendientes() >= lote:
+            importacion.volcar()
+    importacion.volcar()
+    return importacion.resultado
@@ -0,0 +1,354 @@
+"""! @brief Contadores e histogramas de latencia en formato de texto de Prometheus"""
+##
+# @file metricas_service.py
+#
+# @brief Registro de métricas del proceso (peticiones HTTP, consultas a la base de
+# datos, recuento de tokens y llamadas a OpenAI) que se publica en `GET /metrics`.
+#
+# @section description_metricas_service Descripción
+# Implementación mínima del formato de exposición de Prometheus (contadores e
+# histogramas con etiquetas), sin dependencias. Registrar una observación cuesta un
+# bloqueo y una búsqueda en un diccionario, así que puede hacerse en cada consulta SQL.
+#
+# Las métricas son de cada proceso: con varios workers, cada uno publica las suyas
+# (Prometheus debe consultar cada worker por separado o usar un único worker por
+# destino).
+#
+# Los histogramas creados con `parte` suman además cada observación al desglose de la
+# petición que se esté perfilando (ver `perfilado_service`).
+#
+# @code
+# Ejemplo de uso:
+# with DURACION_OPENAI.cronometrar(modelo='gpt-4o'):
+#     respuesta = cliente.chat.completions.create(...)
+#
+# @DURACION_RESPUESTA.cronometrar(operacion='resumen')
+# def obtener_resumen_historial(mensajes_historial): ...
+# @endcode
+import inspect
+import threading
+import time
+from functools import wraps
+from sqlalchemy import event
+from chatgpt_api.services.perfilado_service import sumar as sumar_perfil
+
+'''! @brief Límites (s) de los histogramas de peticiones HTTP y de llamadas a OpenAI'''
+LIMITES_LENTOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+'''! @brief Límites (s) de los histogramas de operaciones locales (SQL, tokens)'''
+LIMITES_RAPIDOS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1, 5)
+
+'''! @brief Tipo MIME del formato de texto de Prometheus'''
+TIPO_CONTENIDO = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _etiquetas_texto(nombres, valores, extra=None):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    """! @brief Contador monótono con etiquetas."""
+    tipo = 'counter'
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, valor=1, **etiquetas):
+        """
+        @brief Suma `valor` a la serie de las etiquetas indicadas.
+        @param valor Cantidad a sumar (no negativa).
+        @param etiquetas Valor de cada etiqueta declarada.
+        """
+        clave = tuple(etiquetas[n] for n in self.etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def exponer(self):
+        """! @brief Líneas de las muestras en formato de texto de Prometheus."""
+        with self._lock:
+            valores = sorted(self._valores.items())
+        return [f"{self.nombre}{_etiquetas_texto(self.etiquetas, clave)} {_numero(v)}" for clave, v in valores]
+
+
+class _Cronometro:
+    """! @brief Mide la duración de un bloque `with` o de cada llamada a una función decorada."""
+
+    def __init__(self, histograma, etiquetas):
+        self.histograma = histograma
+        self.etiquetas = etiquetas
+
+    def __enter__(self):
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *excepcion):
+        self.histograma.observar(time.perf_counter() - self._inicio, **self.etiquetas)
+
+    def __call__(self, funcion):
+        histograma, etiquetas = self.histograma, self.etiquetas
+        if inspect.iscoroutinefunction(funcion):
+            @wraps(funcion)
+            async def envoltura_async(*args, **kwargs):
+                with _Cronometro(histograma, etiquetas):
+                    return await funcion(*args, **kwargs)
+            return envoltura_async
+
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with _Cronometro(histograma, etiquetas):
+                return funcion(*args, **kwargs)
+        return envoltura
+
+
+class Histograma:
+    """
+    @brief Histograma acumulativo con etiquetas (`_bucket`, `_sum` y `_count`).
+
+    @details
+    Si se indica `parte`, cada observación se suma también a esa parte del desglose del
+    perfil activo (`perfilado_service.PARTES`).
+    """
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), limites=LIMITES_LENTOS, parte=None):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.limites = tuple(sorted(limites))
+        self.parte = parte
+        self._series = {}  # etiquetas -> [recuentos por límite, suma, total]
+        self._lock = threading.Lock()
+
+    def observar(self, valor, **etiquetas):
+        """
+        @brief Añade una observación.
+        @param valor Valor observado (segundos, en los histogramas de latencia).
+        @param etiquetas Valor de cada etiqueta declarada.
+        """
+        clave = tuple(etiquetas[n] for n in self.etiquetas)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * len(self.limites), 0.0, 0]
+            for i, limite in enumerate(self.limites):
+                if valor <= limite:
+                    serie[0][i] += 1
+                    break
+            serie[1] += valor
+            serie[2] += 1
+        if self.parte:
+            sumar_perfil(self.parte, valor)
+
+    def totales(self):
+        """
+        @brief Observaciones y suma de todas las series (e.g. para medir un intervalo por diferencia).
+        @return Tupla `(número de observaciones, suma)`.
+        """
+        with self._lock:
+            return sum(s[2] for s in self._series.values()), sum(s[1] for s in self._series.values())
+
+    def cronometrar(self, **etiquetas):
+        """
+        @brief Mide una duración en segundos.
+        @param etiquetas Valor de cada etiqueta declarada.
+        @return Objeto utilizable con `with` o como decorador (también de funciones `async`).
+        """
+        return _Cronometro(self, etiquetas)
+
+    def exponer(self):
+        """! @brief Líneas de las muestras en formato de texto de Prometheus."""
+        with self._lock:
+            series = sorted((clave, [list(s[0]), s[1], s[2]]) for clave, s in self._series.items())
+        lineas = []
+        for clave, (recuentos, suma, total) in series:
+            acumulado = 0
+            for limite, recuento in zip(self.limites, recuentos):
+                acumulado += recuento
+                le = _etiquetas_texto(self.etiquetas, clave, f'le="{_numero(float(limite))}"')
+                lineas.append(f"{self.nombre}_bucket{le} {acumulado}")
+            le = _etiquetas_texto(self.etiquetas, clave, 'le="+Inf"')
+            lineas.append(f"{self.nombre}_bucket{le} {total}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas_texto(self.etiquetas, clave)} {_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{_etiquetas_texto(self.etiquetas, clave)} {total}")
+        return lineas
+
+
+class MetricaCalculada:
+    """
+    @brief Métrica calculada en el momento de exponerla, devuelta por un colector.
+
+    @param nombre Nombre de la métrica.
+    @param tipo `gauge` o `counter`.
+    @param ayuda Descripción (línea `# HELP`).
+    @param etiquetas Nombres de las etiquetas.
+    @param muestras Lista de tuplas `(valores de las etiquetas, valor)`.
+    """
+
+    def __init__(self, nombre, tipo, ayuda, etiquetas, muestras):
+        self.nombre, self.tipo, self.ayuda = nombre, tipo, ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._muestras = muestras
+
+    def exponer(self):
+        return [f"{self.nombre}{_etiquetas_texto(self.etiquetas, clave)} {_numero(v)}" for clave, v in self._muestras]
+
+
+class Registro:
+    """
+    @brief Conjunto de métricas del proceso.
+
+    @details
+    Además de contadores e histogramas admite colectores: funciones que se llaman al
+    exponer y devuelven `MetricaCalculada` con valores ya existentes en otro sitio (e.g.
+    los contadores de la caché de respuestas).
+    """
+
+    def __init__(self):
+        self._metricas = []
+        self._colectores = []
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        """! @brief Crea y registra un `Contador`."""
+        metrica = Contador(nombre, ayuda, etiquetas)
+        self._metricas.append(metrica)
+        return metrica
+
+    def histograma(self, nombre, ayuda, etiquetas=(), limites=LIMITES_LENTOS, parte=None):
+        """! @brief Crea y registra un `Histograma`."""
+        metrica = Histograma(nombre, ayuda, etiquetas, limites, parte)
+        self._metricas.append(metrica)
+        return metrica
+
+    def colector(self, funcion):
+        """
+        @brief Registra un colector (se puede usar como decorador).
+        @param funcion Función sin argumentos que devuelve una lista de `MetricaCalculada`.
+        @return La misma función.
+        """
+        self._colectores.append(funcion)
+        return funcion
+
+    def exponer(self):
+        """
+        @brief Genera el texto que se publica en `/metrics`.
+        @return String en formato de texto de Prometheus 0.0.4.
+        """
+        metricas = list(self._metricas)
+        for colector in self._colectores:
+            metricas.extend(colector())
+        lineas = []
+        for metrica in metricas:
+            lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+            lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+            lineas.extend(metrica.exponer())
+        return '\n'.join(lineas) + '\n'
+
+
+'''! @brief Registro de métricas del proceso'''
+registro = Registro()
+
+'''! @brief Peticiones HTTP atendidas, por método, ruta (plantilla de Flask) y código de estado'''
+PETICIONES = registro.contador('flaskchat_peticiones_total', 'Peticiones HTTP atendidas', ['metodo', 'ruta', 'estado'])
+
+'''! @brief Duración de las peticiones HTTP, hasta enviar el último byte de la respuesta'''
+DURACION_PETICION = registro.histograma(
+    'flaskchat_peticion_duracion_segundos', 'Duración de las peticiones HTTP', ['metodo', 'ruta'])
+
+'''! @brief Duración de las sentencias SQL, por tipo (SELECT, INSERT...)'''
+DURACION_DB = registro.histograma(
+    'flaskchat_db_consulta_duracion_segundos', 'Duración de las sentencias SQL', ['operacion'], LIMITES_RAPIDOS, 'db')
+
+'''! @brief Duración de `contar_tokens` (codificar un historial con tiktoken)'''
+DURACION_TOKENS = registro.histograma(
+    'flaskchat_contar_tokens_duracion_segundos', 'Duración del recuento de tokens de un historial', [], LIMITES_RAPIDOS, 'tokens')
+
+'''! @brief Duración de las respuestas y resúmenes completos (caché y espera del planificador incluidas)'''
+DURACION_RESPUESTA = registro.histograma(
+    'flaskchat_respuesta_duracion_segundos', 'Duración de obtener una respuesta o un resumen', ['operacion'])
+
+'''! @brief Duración de cada petición HTTP a OpenAI (sin la espera del planificador; en streaming, hasta las cabeceras)'''
+DURACION_OPENAI = registro.histograma(
+    'flaskchat_openai_duracion_segundos', 'Duración de las peticiones a la API de OpenAI', ['modelo'], parte='openai')
+
+'''! @brief Tokens enviados (`entrada`) y generados (`salida`) por modelo'''
+TOKENS_OPENAI = registro.contador('flaskchat_openai_tokens_total', 'Tokens de las peticiones a OpenAI', ['modelo', 'tipo'])
+
+'''! @brief Peticiones a OpenAI fallidas, por modelo y código de estado (o `timeout`, `conexion`...)'''
+ERRORES_OPENAI = registro.contador(
+    'flaskchat_openai_errores_total', 'Peticiones a OpenAI fallidas', ['modelo', 'estado'])
+
+# Sentencias que se distinguen en la etiqueta `operacion` de `DURACION_DB`
+_OPERACIONES_SQL = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'PRAGMA', 'CREATE', 'ALTER', 'DROP'}
+
+# Nombre de la excepción -> etiqueta `estado` de `ERRORES_OPENAI` (si no tiene `status_code`)
+_ESTADOS_ERROR = {
+    'APITimeoutError': 'timeout',
+    'APIConnectionError': 'conexion',
+    'LimiteExcedido': 'limite_local',
+}
+
+
+def estado_error(excepcion):
+    """
+    @brief Etiqueta `estado` de `ERRORES_OPENAI` para una excepción.
+    @param excepcion Excepción lanzada por el SDK de OpenAI o por el planificador.
+    @return Código de estado HTTP como texto, o `timeout`, `conexion`, `limite_local` u `otro`.
+    """
+    estado = getattr(excepcion, 'status_code', None)
+    if estado is not None:
+        return str(estado)
+    return _ESTADOS_ERROR.get(type(excepcion).__name__, 'otro')
+
+
+def _antes_de_sentencia(conn, cursor, sentencia, parametros, contexto, executemany):
+    contexto._inicio_metricas = time.perf_counter()
+
+
+def _despues_de_sentencia(conn, cursor, sentencia, parametros, contexto, executemany):
+    inicio = getattr(contexto, '_inicio_metricas', None)
+    if inicio is None:
+        return
+    operacion = sentencia.lstrip().split(None, 1)[0].upper() if sentencia.strip() else ''
+    DURACION_DB.observar(
+        time.perf_counter() - inicio,
+        operacion=operacion if operacion in _OPERACIONES_SQL else 'OTRA',
+    )
+
+
+def instrumentar_motor(motor):
+    """
+    @brief Mide la duración de todas las sentencias SQL de un motor en `DURACION_DB`.
+    @param motor `Engine` de SQLAlchemy. Llamarla varias veces con el mismo motor no duplica las mediciones.
+    """
+    if not event.contains(motor, 'before_cursor_execute', _antes_de_sentencia):
+        event.listen(motor, 'before_cursor_execute', _antes_de_sentencia)
+        event.listen(motor, 'after_cursor_execute', _despues_de_sentencia)
+
+
+def registrar_peticion(metodo, ruta, estado, duracion):
+    """
+    @brief Registra una petición HTTP atendida en `PETICIONES` y `DURACION_PETICION`.
+    @param metodo Método HTTP.
+    @param ruta Plantilla de la ruta (e.g. `/api/chat/<int:id>`), no la URL concreta.
+    @param estado Código de estado de la respuesta.
+    @param duracion Segundos hasta enviar el último byte.
+    """
+    PETICIONES.inc(metodo=metodo, ruta=ruta, estado=str(estado))
+    DURACION_PETICION.observar(duracion, metodo=metodo, ruta=ruta)
@@ -0,0 +1,375 @@
+"""! @brief Registro de los modelos de OpenAI disponibles"""
+##
+# @file modelos_service.py
+#
+# @brief Lista de modelos de OpenAI en memoria, con índice por ID, metadatos y
+# refresco en segundo plano compartido entre procesos.
+#
+# @section description_modelos_service Descripción
+# El registro guarda una instantánea inmutable (lista de modelos + índice por ID).
+# Al refrescar se construye una instantánea nueva y se sustituye con una única
+# asignación, de modo que las peticiones en curso nunca ven un estado a medias.
+#
+# @section multiproceso_modelos_service Varios procesos
+# La lista se persiste en `models_cache.json`. Cuando la caché caduca
+# (`CACHE_REFRESH_DAYS`), sólo un proceso consulta la API de OpenAI:
+# 1. Se crea `models_cache.json.lock` con `O_CREAT | O_EXCL` (falla si ya existe).
+# 2. El proceso que lo consigue vuelve a comprobar si el fichero sigue caducado
+#    (otro proceso puede haberlo refrescado mientras tanto), descarga la lista,
+#    la escribe en un fichero temporal y lo renombra sobre `models_cache.json`
+#    (`os.replace` es atómico), y elimina el bloqueo.
+# 3. El resto de procesos no esperan: siguen con su lista y cargan el fichero
+#    nuevo en su siguiente comprobación periódica (cuando cambia su `mtime`).
+#
+# Un bloqueo con más de `LOCK_CADUCIDAD` segundos se considera abandonado (el
+# proceso que lo creó murió) y se elimina. Como dos procesos pueden verlo abandonado a
+# la vez, antes de eliminarlo se aparta con `os.rename` (atómico) y se comprueba que
+# el fichero apartado es el que se vio abandonado: si no, es el bloqueo nuevo de otro
+# proceso y se devuelve a su sitio.
+#
+# @section arranque_modelos_service Arranque
+# Al arrancar sólo se lee el fichero local. Si no existe se usa la lista incluida
+# `MODELOS_POR_DEFECTO`, y la consulta a OpenAI (si la caché falta o ha caducado) se
+# hace en el hilo de refresco, sin retrasar el arranque ni depender de la red.
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import lru_cache
+from chatgpt_api.services.openai_service import CODIFICACION_POR_DEFECTO
+from chatgpt_api.services.contexto_service import limite_contexto
+from chatgpt_api.services.transporte_service import obtener_sesion, OPENAI_BASE_URL, TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+'''
+@brief Archivo de caché de modelos de OpenAI.
+El archivo se utiliza para almacenar la lista de modelos disponibles y la fecha de última actualización.
+'''
+CACHE_FILE = os.path.join(os.path.dirname(__file__), "models_cache.json")
+
+'''
+@brief Número de días después de los cuales se considera que la caché de modelos está obsoleta.
+Si han pasado más días que este valor desde la última actualización, se refresca la caché.
+'''
+CACHE_REFRESH_DAYS = int(os.getenv('CACHE_REFRESH_DAYS', '14'))
+
+'''! @brief Segundos entre comprobaciones del refresco en segundo plano'''
+MODELOS_INTERVALO_COMPROBACION = int(os.getenv('MODELOS_INTERVALO_COMPROBACION', '3600'))
+
+'''! @brief Segundos tras los que un bloqueo de refresco se considera abandonado'''
+LOCK_CADUCIDAD = 300
+
+'''! @brief Modelos que se ofrecen mientras no hay caché en disco (primera ejecución o sin red)'''
+MODELOS_POR_DEFECTO = [
+    'gpt-3.5-turbo',
+    'gpt-4',
+    'gpt-4-turbo',
+    'gpt-4o',
+    'gpt-4o-mini',
+    'gpt-4.1',
+    'gpt-4.1-mini',
+    'o4-mini',
+]
+
+'''
+@brief Metadatos de un modelo.
+- `id`: identificador del modelo (e.g., "gpt-4o").
+- `contexto`: ventana de contexto en tokens (ver `contexto_service.limite_contexto`).
+- `datos`: diccionario devuelto por la API de OpenAI, con `contexto` añadido.
+- `codificacion` (propiedad): nombre de la codificación de tiktoken. Se calcula al
+  consultarla por primera vez, para no importar tiktoken al arrancar.
+'''
+class InfoModelo(namedtuple('InfoModelo', ['id', 'contexto', 'datos'])):
+    __slots__ = ()
+
+    @property
+    def codificacion(self):
+        return _nombre_codificacion(self.id)
+
+
+'''! @brief Instantánea del registro: tupla de `InfoModelo`, índice por ID y fecha de actualización'''
+EstadoModelos = namedtuple('EstadoModelos', ['modelos', 'indice', 'last_update'])
+
+
+@lru_cache(maxsize=None)
+def _nombre_codificacion(modelo):
+    """! @brief Nombre de la codificación de tiktoken de un modelo (sin cargarla)."""
+    import tiktoken
+    try:
+        return tiktoken.encoding_name_for_model(modelo)
+    except KeyError:
+        return CODIFICACION_POR_DEFECTO
+
+
+def _info_modelo(datos):
+    """! @brief Construye el `InfoModelo` de un modelo devuelto por la API."""
+    contexto = limite_contexto(datos['id'])
+    return InfoModelo(datos['id'], contexto, dict(datos, contexto=contexto))
+
+
+class RegistroModelos:
+    """
+    @brief Registro en memoria de los modelos disponibles.
+
+    @details
+    Las consultas (`existe`, `obtener`, `listar`) leen la instantánea actual sin
+    bloqueos. `refrescar` y `sincronizar` pueden llamarse desde cualquier hilo.
+    """
+
+    def __init__(self, ruta_cache=CACHE_FILE, dias_refresco=CACHE_REFRESH_DAYS):
+        self.ruta_cache = ruta_cache
+        self.ruta_lock = ruta_cache + '.lock'
+        self.dias_refresco = dias_refresco
+        self._estado = EstadoModelos((), {}, None)
+        self._mtime = None
+        self._hilo = None
+        self._parar = threading.Event()
+
+    # --- Consultas ---
+
+    def existe(self, modelo):
+        """
+        @brief Indica si un modelo está disponible.
+        @param modelo ID del modelo.
+        @return True si el modelo está en el registro.
+        """
+        return modelo in self._estado.indice
+
+    def obtener(self, modelo):
+        """
+        @brief Devuelve los metadatos de un modelo.
+        @param modelo ID del modelo.
+        @return `InfoModelo`, o None si el modelo no está en el registro.
+        """
+        return self._estado.indice.get(modelo)
+
+    def listar(self):
+        """
+        @brief Devuelve la lista de modelos disponibles.
+        @return Lista de diccionarios (los de la API de OpenAI más `contexto` y `codificacion`).
+        """
+        return [dict(info.datos, codificacion=info.codificacion) for info in self._estado.modelos]
+
+    def ultima_actualizacion(self):
+        """
+        @brief Devuelve la fecha de la última actualización de la lista.
+        @return String ISO con la fecha, o None si no se conoce.
+        """
+        return self._estado.last_update
+
+    # --- Carga y refresco ---
+
+    def _activar(self, datos):
+        modelos = tuple(_info_modelo(m) for m in datos.get('models', []))
+        self._estado = EstadoModelos(modelos, {info.id: info for info in modelos}, datos.get('last_update'))
+
+    def _caducada(self, last_update):
+        if not last_update:
+            return True
+        return datetime.utcnow() - datetime.fromisoformat(last_update) > timedelta(days=self.dias_refresco)
+
+    def cargar_de_disco(self):
+        """
+        @brief Carga la lista de modelos de `models_cache.json`, si existe.
+        @return Diccionario leído del fichero, o None si no existe o no es válido.
+        """
+        try:
+            mtime = os.path.getmtime(self.ruta_cache)
+            with open(self.ruta_cache, "r") as f:
+                datos = json.load(f)
+        except FileNotFoundError:
+            logger.debug(f"Cache file {self.ruta_cache} does not exist.")
+            return None
+        except (OSError, ValueError) as e:
+            logger.debug(f"Error loading cache file: {e}")
+            return None
+        if not datos.get('last_update'):
+            # Ficheros antiguos sin last_update: se usa la fecha de modificación del fichero
+            datos['last_update'] = datetime.utcfromtimestamp(mtime).isoformat()
+        self._activar(datos)
+        self._mtime = mtime
+        logger.debug(f"Loaded models cache from disk: {datos.get('last_update')}")
+        return datos
+
+    def _escribir_atomico(self, datos):
+        directorio = os.path.dirname(self.ruta_cache) or '.'
+        fd, temporal = tempfile.mkstemp(dir=directorio, prefix='.models_cache.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(datos, f, default=str)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporal, self.ruta_cache)
+        except BaseException:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+        self._mtime = os.path.getmtime(self.ruta_cache)
+
+    def _adquirir_lock(self):
+        for _ in range(2):
+            try:
+                fd = os.open(self.ruta_lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._romper_lock_abandonado():
+                    return False
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(str(os.getpid()))
+            return True
+        return False
+
+    def _romper_lock_abandonado(self):
+        """
+        @brief Elimina el bloqueo si está abandonado, sin llevarse por delante uno nuevo.
+
+        @details
+        Entre ver el bloqueo abandonado y eliminarlo, otro proceso puede haberlo eliminado
+        y creado uno nuevo. Por eso el bloqueo se renombra a un nombre único y sólo se
+        elimina si es el mismo fichero (inodo y `mtime`) que se vio abandonado; si no, se
+        devuelve a su sitio con `os.link`, que no sobrescribe.
+
+        @return
+        - True si se puede volver a intentar crear el bloqueo.
+        """
+        try:
+            visto = os.stat(self.ruta_lock)
+        except FileNotFoundError:
+            return True  # Se ha liberado entre medias
+        if time.time() - visto.st_mtime < LOCK_CADUCIDAD:
+            return False
+        apartado = f"{self.ruta_lock}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            os.rename(self.ruta_lock, apartado)
+        except FileNotFoundError:
+            return True  # Otro proceso lo ha apartado antes
+        actual = os.stat(apartado)
+        if (actual.st_ino, actual.st_mtime) != (visto.st_ino, visto.st_mtime):
+            try:
+                os.link(apartado, self.ruta_lock)
+            except OSError:
+                pass  # Ya hay otro bloqueo en su sitio
+            os.remove(apartado)
+            return False
+        logger.warning(f"Eliminando bloqueo abandonado {self.ruta_lock}")
+        os.remove(apartado)
+        return True
+
+    def _liberar_lock(self):
+        try:
+            os.remove(self.ruta_lock)
+        except FileNotFoundError:
+            pass
+
+    def _descargar(self):
+        """Consulta la API de OpenAI y devuelve la lista de modelos."""
+        logger.debug("Fetching models from OpenAI API...")
+        response = obtener_sesion().get(f"{OPENAI_BASE_URL}/models", timeout=TIMEOUT)
+        response.raise_for_status()
+        modelos = response.json().get("data", [])
+        logger.debug(f"Fetched {len(modelos)} models from OpenAI.")
+        return modelos
+
+    def refrescar(self, forzar=False):
+        """
+        @brief Descarga la lista de modelos de OpenAI si la caché en disco está caducada.
+
+        @details
+        Sigue el protocolo descrito en la cabecera del módulo: si otro proceso ya la ha
+        refrescado, se carga su fichero; si otro proceso la está refrescando, no se hace nada.
+
+        @param forzar Si es True, se descarga aunque la caché no esté caducada.
+
+        @return
+        - True si este proceso ha descargado la lista; False en caso contrario.
+
+        @throws requests.RequestException Si falla la consulta a la API de OpenAI.
+        """
+        datos = self.cargar_de_disco()
+        if not forzar and datos and not self._caducada(datos['last_update']):
+            return False
+        if not self._adquirir_lock():
+            logger.debug("Otro proceso está refrescando la caché de modelos.")
+            return False
+        try:
+            datos = self.cargar_de_disco()
+            if not forzar and datos and not self._caducada(datos['last_update']):
+                return False
+            datos = {'models': self._descargar(), 'last_update': datetime.utcnow().isoformat()}
+            self._escribir_atomico(datos)
+            self._activar(datos)
+            logger.debug(f"Saved models cache to disk at {datos['last_update']}")
+            return True
+        finally:
+            self._liberar_lock()
+
+    def sincronizar(self):
+        """
+        @brief Carga el fichero si otro proceso lo ha actualizado y lo refresca si ha caducado.
+        """
+        try:
+            mtime = os.path.getmtime(self.ruta_cache)
+        except OSError:
+            mtime = None
+        if mtime is not None and mtime != self._mtime:
+            self.cargar_de_disco()
+        if self._caducada(self._estado.last_update):
+            self.refrescar()
+
+    def inicializar(self):
+        """
+        @brief Carga la lista al arrancar sin acceder a la red.
+
+        @details
+        Lee `models_cache.json`; si no existe, activa `MODELOS_POR_DEFECTO` (sin fecha de
+        actualización, de modo que el primer `sincronizar` la sustituye por la lista real).
+        """
+        if self.cargar_de_disco() is None:
+            self._activar({'models': [{'id': modelo} for modelo in MODELOS_POR_DEFECTO], 'last_update': None})
+
+    def iniciar_refresco_periodico(self, intervalo=MODELOS_INTERVALO_COMPROBACION):
+        """
+        @brief Arranca (una sola vez por proceso) el hilo que llama a `sincronizar` periódicamente.
+
+        @details
+        La primera comprobación se hace nada más arrancar el hilo, de forma que una caché
+        ausente o caducada se refresca en segundo plano en cuanto arranca la aplicación.
+
+        @param intervalo Segundos entre comprobaciones.
+        """
+        if self._hilo is not None and self._hilo.is_alive() and not self._parar.is_set():
+            return
+        # Un evento nuevo por hilo: tras `detener_refresco_periodico` se puede volver a
+        # arrancar, aunque el hilo anterior no haya terminado aún
+        self._parar = parar = threading.Event()
+
+        def bucle():
+            espera = 0
+            while not parar.wait(espera):
+                espera = intervalo
+                try:
+                    self.sincronizar()
+                except Exception as e:
+                    logger.error(f"Error al refrescar la lista de modelos: {str(e)}")
+
+        self._hilo = threading.Thread(target=bucle, name='refresco-modelos', daemon=True)
+        self._hilo.start()
+
+    def detener_refresco_periodico(self):
+        """! @brief Detiene el hilo de refresco periódico."""
+        self._parar.set()
+
+
+'''! @brief Registro compartido de modelos de OpenAI'''
+registro_modelos = RegistroModelos()
+registro_modelos.inicializar()
+
+
+def get_available_models():
+    """Devuelve la lista de modelos disponibles (lista de dicts)."""
+    return registro_modelos.listar()
@@ -1,147 +1,132 @@
-import openai
 import os
-import tiktoken
 import logging
-import json
-from datetime import datetime, timedelta
-import requests
+from functools import lru_cache
+from chatgpt_api.services.cache_service import (
+    buscar_en_cache,
+    buscar_en_cache_async,
+    cache_respuestas,
+    guardar_en_cache_async,
+)
+from chatgpt_api.services.transporte_service import obtener_cliente, obtener_cliente_async
+from chatgpt_api.services.planificador_service import planificador, PRIORIDAD_CHAT, PRIORIDAD_RESUMEN
+from chatgpt_api.services.metricas_service import (
+    DURACION_OPENAI,
+    DURACION_RESPUESTA,
+    DURACION_TOKENS,
+    ERRORES_OPENAI,
+    TOKENS_OPENAI,
+    estado_error,
+)
+
+# `openai` y `tiktoken` se importan bajo demanda, en la primera petición que los necesita:
+# `openai` tarda más de medio segundo en importarse y `tiktoken` unos 15 ms, más la carga
+# de cada codificación al usarla (ver benchmarks/arranque.py).
+# Los clientes de OpenAI (pool de conexiones, tiempos de espera y reintentos) están en
+# `transporte_service`, y todas las peticiones pasan por el planificador de
+# `planificador_service`, que las hace esperar si se agotaría el límite de uso del modelo.
+# Las duraciones, los tokens y los errores se registran en `metricas_service` (`/metrics`).
 
-'''! @brief La clave de la API de la cuenta a la que está conectada la aplicación FlaskChat'''
-openai.api_key = os.getenv('OPENAI_API_KEY')
 logger = logging.getLogger(__name__)
 
-# --- INICIO: Gestión de caché de modelos OpenAI ---
-'''
-@file openai_service.py
-@brief Gestión de la caché de modelos de OpenAI y funciones auxiliares para refresco y consulta.
-'''
-
-'''
-@brief Archivo de caché de modelos de OpenAI.
-El archivo se utiliza para almacenar la lista de modelos disponibles y la fecha de última actualización.
-'''
-CACHE_FILE = os.path.join(os.path.dirname(__file__), "models_cache.json")
-
-'''
-@brief Número de días después de los cuales se considera que la caché de modelos está obsoleta.
-Si han pasado más días que este valor desde la última actualización, se refresca la caché.
-'''
-CACHE_REFRESH_DAYS = 14
-
-'''
-@brief Caché de modelos de OpenAI.
-La caché almacena la lista de modelos disponibles y la fecha de última actualización.
-'''
-models_cache = {
-    "models": [],
-    "last_update": None
-}
-
-'''
-@brief Carga la caché de modelos desde disco, si existe.
-@return True si la caché se cargó correctamente, False en caso contrario.
-'''
-def load_cache_from_disk():
-    """Carga la caché de modelos desde disco, si existe."""
-    if not os.path.exists(CACHE_FILE):
-        logger.debug(f"Cache file {CACHE_FILE} does not exist.")
-        return False
-    try:
-        with open(CACHE_FILE, "r") as f:
-            global models_cache
-            models_cache = json.load(f)
-            logger.debug(f"Loaded models cache from disk: {models_cache.get('last_update')}")
-        return True
-    except Exception as e:
-        logger.debug(f"Error loading cache file: {e}")
-        return False
-
-'''
-@brief Guarda la caché de modelos en disco.
-'''
-def save_cache_to_disk():
-    """Guarda la caché de modelos en disco."""
-    try:
-        with open(CACHE_FILE, "w") as f:
-            json.dump(models_cache, f, default=str)
-            logger.debug(f"Saved models cache to disk at {models_cache.get('last_update')}")
-    except Exception as e:
-        logger.debug(f"Error saving cache file: {e}")
+'''! @brief Máximo de tokens que puede generar el modelo en cada respuesta'''
+MAX_TOKENS_RESPUESTA = 1550
+
+'''! @brief Modelo utilizado para resumir el historial de las conversaciones'''
+MODELO_RESUMEN = os.getenv('MODELO_RESUMEN', 'gpt-3.5-turbo')
+
+'''! @brief Máximo de tokens que puede ocupar un resumen del historial'''
+MAX_TOKENS_RESUMEN = 500
+
+'''! @brief Parámetros de muestreo de las respuestas (forman parte de la clave de caché)'''
+PARAMETROS_RESPUESTA = {'max_tokens': MAX_TOKENS_RESPUESTA, 'temperature': 0.7}
 
-'''
-@brief Comprueba si la caché de modelos necesita ser refrescada.
-@return True si la caché está obsoleta o no existe, False si está actualizada.
-'''
-def cache_needs_refresh():
+'''! @brief Caracteres por token al estimar el tamaño de una petición para el planificador'''
+CARACTERES_POR_TOKEN = 4
+
+def _estimar_tokens(parametros):
+    """
+    @brief Tokens que se reservan para una petición: una estimación de los mensajes enviados más `max_tokens`.
+
+    @details
+    Los mensajes no se codifican con tiktoken: el historial ya se ha medido con los
+    recuentos guardados (`Mensaje.tokens`) y volver a codificarlo costaría tiempo en cada
+    petición (y en el bucle de eventos, en las asíncronas). Basta una estimación por
+    caracteres, porque la reserva se corrige después con el consumo real
+    (`Reserva.registrar`).
     """
-    Devuelve True si han pasado más de CACHE_REFRESH_DAYS desde la última actualización
-    (usando preferentemente el campo last_update del JSON), o si hay algún problema.
+    mensajes = parametros['messages']
+    caracteres = sum(len(mensaje.get('content') or '') for mensaje in mensajes)
+    return (caracteres // CARACTERES_POR_TOKEN + TOKENS_POR_MENSAJE * len(mensajes) + TOKENS_POR_PETICION
+            + parametros.get('max_tokens', 0))
+
+def _completar(prioridad, **parametros):
     """
-    if not os.path.exists(CACHE_FILE):
-        logger.debug("Cache file does not exist, refresh needed.")
-        return True
+    @brief Envía una petición de chat a OpenAI a través del planificador.
+
+    @details
+    Espera turno en el planificador, hace la petición pidiendo también las cabeceras HTTP
+    (`with_raw_response`) y ajusta los cubos del modelo con ellas y con el consumo real.
+    En las peticiones con `stream=True` el consumo no se conoce hasta el final: quien
+    consume el stream debe llamar a `reserva.registrar(usados=...)`.
+
+    @param prioridad Prioridad en la cola del planificador (ver `planificador_service`).
+    @param parametros Argumentos de `chat.completions.create`.
+
+    @return
+    - Tupla `(respuesta, reserva)`: la respuesta del SDK (o el stream) y la `Reserva` del planificador.
+
+    @throws LimiteExcedido Si la petición no obtiene turno a tiempo.
+    """
+    modelo = parametros['model']
     try:
-        with open(CACHE_FILE, "r") as f:
-            cache = json.load(f)
-            last_update = cache.get("last_update")
-            if last_update:
-                last_update_dt = datetime.fromisoformat(last_update)
-                age = datetime.utcnow() - last_update_dt
-                logger.debug(f"Cache last_update age: {age.days} days")
-                return age > timedelta(days=CACHE_REFRESH_DAYS)
-            else:
-                # Fallback: usar mtime del fichero si no hay last_update
-                mtime = datetime.fromtimestamp(os.path.getmtime(CACHE_FILE))
-                age = datetime.utcnow() - mtime
-                logger.debug(f"Cache file mtime age: {age.days} days (no last_update in cache)")
-                return age > timedelta(days=CACHE_REFRESH_DAYS)
+        with planificador.reservar(modelo, _estimar_tokens(parametros), prioridad) as reserva:
+            with DURACION_OPENAI.cronometrar(modelo=modelo):
+                crudo = obtener_cliente().chat.completions.with_raw_response.create(**parametros)
+            respuesta = crudo.parse()
+            uso = getattr(respuesta, 'usage', None)
+            reserva.registrar(crudo.headers, uso.total_tokens if uso else None)
     except Exception as e:
-        logger.debug(f"Error reading cache file: {e}")
-        return True
-
-'''
-@brief Consulta la API de OpenAI para obtener la lista de modelos, actualiza la caché y la guarda en disco.
-'''
-def fetch_openai_models():
-    """Consulta la API de OpenAI, actualiza la caché y la guarda en disco."""
-    logger.debug("Fetching models from OpenAI API...")
-    api_key = os.getenv("OPENAI_API_KEY")
-    headers = {"Authorization": f"Bearer {api_key}"}
-    response = requests.get("https://api.openai.com/v1/models", headers=headers)
-    response.raise_for_status()
-    data = response.json()
-    logger.debug(f"Respuesta completa de la API de modelos OpenAI: {json.dumps(data, indent=2, ensure_ascii=False)}")
-    models_cache["models"] = data.get("data", [])
-    models_cache["last_update"] = datetime.utcnow().isoformat()
-    logger.debug(f"Fetched {len(models_cache['models'])} models from OpenAI.")
-    save_cache_to_disk()
-
-'''
-@brief Inicializa la caché de modelos al arrancar el servidor.
-Sólo consulta OpenAI si han pasado más de CACHE_REFRESH_DAYS desde el último refresco.
-'''
-def initialize_models_cache():
+        ERRORES_OPENAI.inc(modelo=modelo, estado=estado_error(e))
+        raise
+    _registrar_uso(modelo, uso)
+    return respuesta, reserva
+
+async def _completar_async(prioridad, **parametros):
+    """! @brief Versión asíncrona de `_completar`, con el cliente de `obtener_cliente_async`."""
+    modelo = parametros['model']
+    try:
+        async with planificador.reservar_async(modelo, _estimar_tokens(parametros), prioridad) as reserva:
+            with DURACION_OPENAI.cronometrar(modelo=modelo):
+                crudo = await obtener_cliente_async().chat.completions.with_raw_response.create(**parametros)
+            respuesta = crudo.parse()
+            uso = getattr(respuesta, 'usage', None)
+            reserva.registrar(crudo.headers, uso.total_tokens if uso else None)
+    except Exception as e:
+        ERRORES_OPENAI.inc(modelo=modelo, estado=estado_error(e))
+        raise
+    _registrar_uso(modelo, uso)
+    return respuesta, reserva
+
+def _registrar_uso(modelo, uso):
+    """! @brief Suma a `TOKENS_OPENAI` los tokens de una respuesta (los streams no traen `usage`)."""
+    if uso:
+        TOKENS_OPENAI.inc(uso.prompt_tokens or 0, modelo=modelo, tipo='entrada')
+        TOKENS_OPENAI.inc(uso.completion_tokens or 0, modelo=modelo, tipo='salida')
+
+def _registrar_stream(reserva, texto, modelo):
     """
-    Inicializa la caché de modelos al arrancar el servidor.
-    Solo consulta OpenAI si han pasado más de CACHE_REFRESH_DAYS desde el último refresco.
+    @brief Devuelve al planificador los tokens reservados y no generados por un stream.
+
+    @details
+    Los streams no traen `usage`: los tokens de entrada son los estimados al reservar.
     """
-    if cache_needs_refresh():
-        logger.debug("Cache is stale or missing. Updating...")
-        fetch_openai_models()
-    else:
-        logger.debug("Cache is fresh. Loading from disk.")
-        load_cache_from_disk()
-
-'''
-@brief Devuelve la lista de modelos disponibles (lista de dicts).
-@return Lista de modelos disponibles en la caché.
-'''
-def get_available_models():
-    """Devuelve la lista de modelos disponibles (lista de dicts)."""
-    return models_cache["models"]
-# --- FIN: Gestión de caché de modelos OpenAI ---
-
-def obtener_respuesta_openai(mensajes_historial, modelo):
+    generados = contar_tokens_texto(texto, modelo)
+    TOKENS_OPENAI.inc(reserva.tokens - MAX_TOKENS_RESPUESTA, modelo=modelo, tipo='entrada')
+    TOKENS_OPENAI.inc(generados, modelo=modelo, tipo='salida')
+    reserva.registrar(usados=reserva.tokens - MAX_TOKENS_RESPUESTA + generados)
+
+@DURACION_RESPUESTA.cronometrar(operacion='respuesta')
+def obtener_respuesta_openai(mensajes_historial, modelo, usar_cache=False, prioridad=PRIORIDAD_CHAT, lanzar_errores=False):
     """
     @brief Obtiene la respuesta de OpenAI para un conjunto de mensajes.
 
@@ -155,15 +140,24 @@ def obtener_respuesta_openai(mensajes_historial, modelo):
 
     @param modelo Nombre del modelo de OpenAI que se utilizará para generar la respuesta (e.g., "gpt-3.5-turbo").
 
+    @param usar_cache Si es True (y `CACHE_RESPUESTAS` está activo), se devuelve la respuesta guardada para una
+    petición idéntica, si la hay, y se guarda la nueva respuesta en caso contrario (ver `cache_service`).
+
+    @param prioridad Prioridad de la petición en el planificador (`PRIORIDAD_CHAT` por defecto;
+    los trabajos en segundo plano usan `PRIORIDAD_LOTE`).
+
+    @param lanzar_errores Si es True, los errores de la API se propagan en lugar de devolverse como texto,
+    de modo que no se confunden con una respuesta que contenga la palabra "Error".
+
     @return
     - String con la respuesta generada por el modelo de OpenAI.
 
     @throws Exception Si ocurre un error al interactuar con la API de OpenAI, se registrará el error y se devolverá 
-    un mensaje indicando el fallo.
+    un mensaje indicando el fallo (o se propagará la excepción, con `lanzar_errores`).
 
     @note
     La función realiza una solicitud a OpenAI usando el método `openai.chat.completions.create`, y tiene configurado 
-    un límite de tokens de 1550.
+    un límite de `MAX_TOKENS_RESPUESTA` tokens (1550).
 
     @code
     Ejemplo de uso:
@@ -172,29 +166,188 @@ def obtener_respuesta_openai(mensajes_historial, modelo):
     """
 
     logger.info(f"El modelo utilizado es: {modelo}")
+    clave, cacheada = buscar_en_cache(modelo, mensajes_historial, PARAMETROS_RESPUESTA, usar_cache)
+    if cacheada is not None:
+        return cacheada
     try:
-        response = openai.chat.completions.create(
+        response, _ = _completar(
+            prioridad,
             model=modelo,
             messages=mensajes_historial,
-            max_tokens=1550,
-            temperature=0.7,
+            **PARAMETROS_RESPUESTA,
+        )
+        respuesta = response.choices[0].message.content
+        if clave and respuesta:
+            cache_respuestas.guardar(clave, respuesta)
+        return respuesta
+    except Exception as e:
+        logger.error(f"Error al obtener respuesta de OpenAI: {str(e)}")
+        if lanzar_errores:
+            raise
+        return f"Error al obtener respuesta de OpenAI: {str(e)}"
+
+def obtener_respuesta_openai_stream(mensajes_historial, modelo, usar_cache=False):
+    """
+    @brief Obtiene la respuesta de OpenAI en streaming, fragmento a fragmento.
+
+    @details
+    Versión generadora de `obtener_respuesta_openai`: solicita la respuesta con `stream=True`
+    y va devolviendo cada fragmento de texto (delta) en cuanto llega, sin esperar a que el
+    modelo termine de generar la respuesta completa.
+
+    @param mensajes_historial Lista de diccionarios con el historial de mensajes (`role` y `content`).
+    @param modelo Nombre del modelo de OpenAI que se utilizará para generar la respuesta.
+    @param usar_cache Si es True, se consulta y actualiza la caché de respuestas (ver `obtener_respuesta_openai`).
+
+    @return
+    - Generador de strings con los fragmentos de la respuesta.
+
+    @throws Exception A diferencia de `obtener_respuesta_openai`, los errores de la API se propagan
+    al consumidor del generador, que decide cómo notificarlos al cliente.
+
+    @code
+    Ejemplo de uso:
+    for delta in obtener_respuesta_openai_stream(mensajes_historial, "gpt-3.5-turbo"):
+        print(delta, end="")
+    @endcode
+    """
+    logger.info(f"El modelo utilizado (streaming) es: {modelo}")
+    clave, cacheada = buscar_en_cache(modelo, mensajes_historial, PARAMETROS_RESPUESTA, usar_cache)
+    if cacheada is not None:
+        yield cacheada
+        return
+    stream, reserva = _completar(
+        PRIORIDAD_CHAT,
+        model=modelo,
+        messages=mensajes_historial,
+        **PARAMETROS_RESPUESTA,
+        stream=True,
+    )
+    partes = []
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                partes.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+    finally:
+        stream.close()
+        _registrar_stream(reserva, ''.join(partes), modelo)
+    # Sólo se llega aquí si la respuesta se ha recibido completa
+    if clave and partes:
+        cache_respuestas.guardar(clave, ''.join(partes))
+
+# --- INICIO: Cliente asíncrono de OpenAI ---
+@DURACION_RESPUESTA.cronometrar(operacion='respuesta')
+async def obtener_respuesta_openai_async(mensajes_historial, modelo, usar_cache=False):
+    """
+    @brief Versión asíncrona de `obtener_respuesta_openai`.
+
+    @details
+    Mientras se espera la respuesta de OpenAI no se ocupa ningún hilo: el bucle de
+    eventos puede atender otras peticiones en paralelo.
+
+    @param mensajes_historial Lista de diccionarios con el historial de mensajes (`role` y `content`).
+    @param modelo Nombre del modelo de OpenAI que se utilizará para generar la respuesta.
+    @param usar_cache Si es True, se consulta y actualiza la caché de respuestas (ver `obtener_respuesta_openai`).
+
+    @return
+    - String con la respuesta generada, o con el mensaje de error si la llamada falla.
+    """
+    logger.info(f"El modelo utilizado (async) es: {modelo}")
+    clave, cacheada = await buscar_en_cache_async(modelo, mensajes_historial, PARAMETROS_RESPUESTA, usar_cache)
+    if cacheada is not None:
+        return cacheada
+    try:
+        response, _ = await _completar_async(
+            PRIORIDAD_CHAT,
+            model=modelo,
+            messages=mensajes_historial,
+            **PARAMETROS_RESPUESTA,
         )
-        return response.choices[0].message.content
+        respuesta = response.choices[0].message.content
+        if clave and respuesta:
+            await guardar_en_cache_async(clave, respuesta)
+        return respuesta
     except Exception as e:
         logger.error(f"Error al obtener respuesta de OpenAI: {str(e)}")
         return f"Error al obtener respuesta de OpenAI: {str(e)}"
 
-def obtener_resumen_historial(mensajes_historial):
+async def obtener_respuesta_openai_stream_async(mensajes_historial, modelo, usar_cache=False):
+    """
+    @brief Versión asíncrona de `obtener_respuesta_openai_stream`.
+
+    @param mensajes_historial Lista de diccionarios con el historial de mensajes (`role` y `content`).
+    @param modelo Nombre del modelo de OpenAI que se utilizará para generar la respuesta.
+    @param usar_cache Si es True, se consulta y actualiza la caché de respuestas (ver `obtener_respuesta_openai`).
+
+    @return
+    - Generador asíncrono de strings con los fragmentos de la respuesta.
+
+    @throws Exception Los errores de la API se propagan al consumidor del generador.
+    """
+    logger.info(f"El modelo utilizado (async, streaming) es: {modelo}")
+    clave, cacheada = await buscar_en_cache_async(modelo, mensajes_historial, PARAMETROS_RESPUESTA, usar_cache)
+    if cacheada is not None:
+        yield cacheada
+        return
+    stream, reserva = await _completar_async(
+        PRIORIDAD_CHAT,
+        model=modelo,
+        messages=mensajes_historial,
+        **PARAMETROS_RESPUESTA,
+        stream=True,
+    )
+    partes = []
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                partes.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+    finally:
+        await stream.close()
+        _registrar_stream(reserva, ''.join(partes), modelo)
+    if clave and partes:
+        await guardar_en_cache_async(clave, ''.join(partes))
+
+@DURACION_RESPUESTA.cronometrar(operacion='resumen')
+async def obtener_resumen_historial_async(mensajes_historial):
+    """
+    @brief Versión asíncrona de `obtener_resumen_historial`.
+
+    @param mensajes_historial Lista de diccionarios con el historial de mensajes (`role` y `content`).
+
+    @return
+    - String con el resumen generado, o con el mensaje de error si la llamada falla.
+    """
+    try:
+        resumen, _ = await _completar_async(
+            PRIORIDAD_RESUMEN,
+            model=MODELO_RESUMEN,
+            messages=[{'role': 'system', 'content': 'Resuma los siguientes mensajes de forma clara y concisa'}] + mensajes_historial,
+            max_tokens=MAX_TOKENS_RESUMEN,
+            temperature=0.7,
+        )
+        return resumen.choices[0].message.content
+    except Exception as e:
+        logger.error(f"Error al obtener resumen de OpenAI: {str(e)}")
+        return f"Error: {str(e)}"
+# --- FIN: Cliente asíncrono de OpenAI ---
+
+@DURACION_RESPUESTA.cronometrar(operacion='resumen')
+def obtener_resumen_historial(mensajes_historial, prioridad=PRIORIDAD_RESUMEN):
     """
     @brief Obtiene un resumen del historial de mensajes.
 
     @details
     Esta función envía el historial de mensajes a la API de OpenAI para obtener un resumen de los mensajes de manera
-    concisa y clara. El resumen se realiza utilizando el modelo `gpt-3.5-turbo`.
+    concisa y clara. El resumen se realiza utilizando el modelo `MODELO_RESUMEN`.
 
     @param mensajes_historial Lista de diccionarios que contienen el historial de mensajes. Cada mensaje debe tener
     un campo `role` ('user' o 'assistant') y un campo `content` con el contenido del mensaje.
 
+    @param prioridad Prioridad de la petición en el planificador (`PRIORIDAD_RESUMEN` por defecto;
+    los resúmenes de los trabajos en segundo plano usan la del trabajo).
+
     @return
     - String con el resumen generado por el modelo de OpenAI.
 
@@ -202,7 +355,8 @@ def obtener_resumen_historial(mensajes_historial):
     un mensaje indicando el fallo.
 
     @note
-    El modelo utilizado para resumir es `gpt-3.5-turbo` y tiene configurado un límite de tokens de 500.
+    El modelo utilizado para resumir es `MODELO_RESUMEN` (por defecto `gpt-3.5-turbo`, configurable con la
+    variable de entorno del mismo nombre) y tiene configurado un límite de `MAX_TOKENS_RESUMEN` tokens.
 
     @code
     Ejemplo de uso:
@@ -210,10 +364,11 @@ def obtener_resumen_historial(mensajes_historial):
     @endcode
     """
     try:
-        resumen = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
+        resumen, _ = _completar(
+            prioridad,
+            model=MODELO_RESUMEN,
             messages=[{'role': 'system', 'content': 'Resuma los siguientes mensajes de forma clara y concisa'}] + mensajes_historial,
-            max_tokens=500,
+            max_tokens=MAX_TOKENS_RESUMEN,
             temperature=0.7,
         )
         return resumen.choices[0].message.content
@@ -221,6 +376,55 @@ def obtener_resumen_historial(mensajes_historial):
         logger.error(f"Error al obtener resumen de OpenAI: {str(e)}")
         return f"Error: {str(e)}"
 
+'''! @brief Codificación usada cuando tiktoken no conoce el modelo'''
+CODIFICACION_POR_DEFECTO = "cl100k_base"
+
+'''! @brief Tokens adicionales que añade el formato de chat por cada mensaje'''
+TOKENS_POR_MENSAJE = 4
+
+'''! @brief Tokens adicionales de inicio y fin de la conversación'''
+TOKENS_POR_PETICION = 2
+
+@lru_cache(maxsize=None)
+def obtener_codificacion(modelo):
+    """
+    @brief Devuelve la codificación de tiktoken de un modelo.
+
+    @details
+    El resultado se guarda en memoria, de modo que la búsqueda sólo se hace una vez por modelo.
+    Si tiktoken no conoce el modelo se utiliza `CODIFICACION_POR_DEFECTO`.
+
+    @param modelo Nombre del modelo de OpenAI (e.g., "gpt-3.5-turbo").
+
+    @return
+    - Objeto `tiktoken.Encoding`. Su atributo `name` identifica la codificación.
+    """
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(modelo)
+    except KeyError:
+        logger.debug(f"tiktoken no conoce el modelo {modelo}, se usa {CODIFICACION_POR_DEFECTO}")
+        return tiktoken.get_encoding(CODIFICACION_POR_DEFECTO)
+
+@lru_cache(maxsize=256)
+def contar_tokens_texto(texto, modelo="gpt-3.5-turbo"):
+    """
+    @brief Cuenta los tokens del contenido de un único mensaje.
+
+    @details
+    No incluye los tokens de formato (`TOKENS_POR_MENSAJE`). Los últimos resultados se
+    guardan en memoria: el mensaje del usuario se cuenta al construir el historial y
+    de nuevo al guardarlo, pero sólo se codifica una vez.
+
+    @param texto Contenido del mensaje.
+    @param modelo Nombre del modelo cuya codificación se usará.
+
+    @return
+    - Integer con el número de tokens del texto.
+    """
+    return len(obtener_codificacion(modelo).encode(texto or ""))
+
+@DURACION_TOKENS.cronometrar()
 def contar_tokens(mensajes, modelo="gpt-3.5-turbo"):
     """
     @brief Cuenta el número de tokens utilizados por un conjunto de mensajes.
@@ -241,18 +445,18 @@ def contar_tokens(mensajes, modelo="gpt-3.5-turbo"):
 
     @note
     La función utiliza el paquete `tiktoken` para calcular los tokens de manera precisa.
+    Para el historial guardado en base de datos es preferible sumar `Mensaje.tokens`
+    en lugar de volver a codificar todos los mensajes.
 
     @code
     Ejemplo de uso:
     tokens = contar_tokens(mensajes_historial, "gpt-3.5-turbo")
     @endcode
     """
-    encoding = tiktoken.encoding_for_model(modelo)
+    encoding = obtener_codificacion(modelo)
     tokens = 0
     for msg in mensajes:
-        tokens += 4  # El número de tokens por cada mensaje (aproximación inicial).
+        tokens += TOKENS_POR_MENSAJE  # El número de tokens por cada mensaje (aproximación inicial).
         tokens += len(encoding.encode(msg.get("content", "")))  # Tokens del contenido del mensaje.
-    tokens += 2  # Para los tokens de inicio y fin del mensaje.
+    tokens += TOKENS_POR_PETICION  # Para los tokens de inicio y fin del mensaje.
     return tokens
-
-initialize_models_cache()
@@ -0,0 +1,186 @@
+"""! @brief Perfilado opcional de peticiones concretas (pstats, pilas colapsadas y desglose)"""
+##
+# @file perfilado_service.py
+#
+# @brief Perfila una petición con cProfile y con un muestreador de pilas, y guarda los
+# resultados en `PERFILADO_DIR` para analizarlos fuera de línea.
+#
+# @section description_perfilado_service Descripción
+# Por cada petición perfilada se escriben tres ficheros con el mismo prefijo:
+# - `.prof`: estadísticas de cProfile (`python -m pstats`, snakeviz...).
+# - `.folded`: pilas colapsadas (`modulo:funcion;modulo:funcion N`), obtenidas muestreando
+#   la pila del hilo cada `PERFILADO_INTERVALO` segundos. Es tiempo de reloj, así que
+#   incluye las esperas (OpenAI, bloqueos de SQLite). Se pasa directamente a
+#   `flamegraph.pl` o se abre en speedscope.
+# - `.json`: desglose del tiempo total entre base de datos, recuento de tokens,
+#   serialización JSON, llamadas a OpenAI y el resto.
+#
+# El desglose lo alimentan los mismos puntos de medida que las métricas
+# (`metricas_service`): cada observación se suma además al perfil activo en el contexto,
+# si lo hay. Sin perfil activo sólo cuesta leer una `ContextVar`.
+#
+# El perfilado está desactivado salvo con `PERFILADO=1`, y aun así sólo se perfilan las
+# peticiones que lo piden (cabecera `X-Perfilar: 1` o `?perfilar=1`) y una fracción
+# `PERFILADO_MUESTREO` del resto.
+#
+# @code
+# Ejemplo de uso:
+# perfil = Perfil('GET /api/chat/12')
+# perfil.iniciar()
+# ...
+# perfil.terminar()
+# perfil.guardar()   # -> perfiles/20250420T100000123456-GET_api_chat_12.{prof,folded,json}
+# @endcode
+import cProfile
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+'''! @brief Si es "1", se pueden perfilar peticiones'''
+PERFILADO = os.getenv('PERFILADO', '0') == '1'
+
+'''! @brief Directorio donde se escriben los perfiles'''
+PERFILADO_DIR = os.getenv('PERFILADO_DIR', 'perfiles')
+
+'''! @brief Fracción (0-1) de las peticiones sin cabecera ni parámetro que se perfilan'''
+PERFILADO_MUESTREO = float(os.getenv('PERFILADO_MUESTREO', '0'))
+
+'''! @brief Segundos entre dos muestras de la pila'''
+PERFILADO_INTERVALO = float(os.getenv('PERFILADO_INTERVALO', '0.001'))
+
+'''! @brief Partes del desglose, además de `otros` (tiempo no atribuido a ninguna)'''
+PARTES = ('db', 'tokens', 'json', 'openai')
+
+# Perfil de la petición en curso (None si no se está perfilando)
+_perfil_actual = ContextVar('perfil_actual', default=None)
+
+
+def sumar(parte, segundos):
+    """
+    @brief Atribuye tiempo a una parte del desglose del perfil activo, si lo hay.
+    @param parte Una de `PARTES`.
+    @param segundos Duración medida.
+    """
+    perfil = _perfil_actual.get()
+    if perfil is not None:
+        perfil.desglose[parte] += segundos
+
+
+@contextmanager
+def medir(parte):
+    """
+    @brief Atribuye la duración del bloque `with` a una parte del desglose del perfil activo.
+    @param parte Una de `PARTES`.
+    """
+    if _perfil_actual.get() is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        sumar(parte, time.perf_counter() - inicio)
+
+
+class _Muestreador(threading.Thread):
+    """! @brief Hilo que cuenta las pilas de otro hilo a intervalos regulares."""
+
+    def __init__(self, hilo, intervalo):
+        super().__init__(daemon=True, name='perfilado-muestreador')
+        self.hilo = hilo
+        self.intervalo = intervalo
+        self.pilas = Counter()
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.wait(self.intervalo):
+            marco = sys._current_frames().get(self.hilo)
+            pila = []
+            while marco is not None:
+                pila.append(f"{marco.f_globals.get('__name__', '?')}:{marco.f_code.co_name}")
+                marco = marco.f_back
+            if pila:
+                self.pilas[';'.join(reversed(pila))] += 1
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+
+
+class Perfil:
+    """
+    @brief Perfil de una petición.
+
+    @details
+    `iniciar` y `terminar` deben llamarse desde el hilo que atiende la petición: cProfile
+    sólo mide el hilo en el que se activa.
+
+    @param nombre Descripción de la petición (e.g. `POST /api/chat/12`); también da nombre a los ficheros.
+    @param directorio Directorio de salida.
+    @param intervalo Segundos entre muestras de la pila.
+    """
+
+    def __init__(self, nombre, directorio=PERFILADO_DIR, intervalo=PERFILADO_INTERVALO):
+        self.nombre = nombre
+        self.directorio = directorio
+        self.intervalo = intervalo
+        self.desglose = dict.fromkeys(PARTES, 0.0)
+        self.duracion = None
+        self._perfilador = cProfile.Profile()
+        self._muestreador = None
+        self._token = None
+        self._inicio = None
+
+    def iniciar(self):
+        """! @brief Activa el perfil en el hilo y el contexto actuales."""
+        self._token = _perfil_actual.set(self)
+        self._muestreador = _Muestreador(threading.get_ident(), self.intervalo)
+        self._muestreador.start()
+        self._inicio = time.perf_counter()
+        self._perfilador.enable()
+
+    def terminar(self):
+        """! @brief Detiene el perfil. Debe llamarse en el mismo contexto que `iniciar`."""
+        self._perfilador.disable()
+        self.duracion = time.perf_counter() - self._inicio
+        self._muestreador.parar()
+        _perfil_actual.reset(self._token)
+
+    def resumen(self):
+        """
+        @brief Desglose del tiempo total de la petición.
+        @return Diccionario con `total`, cada una de `PARTES` y `otros`, en segundos.
+        """
+        datos = {'nombre': self.nombre, 'total': round(self.duracion, 6)}
+        datos.update({parte: round(segundos, 6) for parte, segundos in self.desglose.items()})
+        datos['otros'] = round(max(self.duracion - sum(self.desglose.values()), 0.0), 6)
+        datos['muestras'] = sum(self._muestreador.pilas.values())
+        return datos
+
+    def guardar(self):
+        """
+        @brief Escribe los ficheros `.prof`, `.folded` y `.json` del perfil.
+        @return Prefijo (ruta sin extensión) de los ficheros escritos.
+        """
+        os.makedirs(self.directorio, exist_ok=True)
+        sufijo = re.sub(r'[^A-Za-z0-9]+', '_', self.nombre).strip('_')
+        base = os.path.join(self.directorio, f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{sufijo}")
+        self._perfilador.dump_stats(f"{base}.prof")
+        with open(f"{base}.folded", 'w', encoding='utf-8') as fichero:
+            for pila, muestras in self._muestreador.pilas.most_common():
+                fichero.write(f"{pila} {muestras}\n")
+        resumen = self.resumen()
+        with open(f"{base}.json", 'w', encoding='utf-8') as fichero:
+            json.dump(resumen, fichero, indent=2)
+        logger.info(f"Perfil de {self.nombre} en {base}: {resumen}")
+        return base
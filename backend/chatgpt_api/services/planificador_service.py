@@ -0,0 +1,340 @@
+"""! @brief Planificador de las peticiones salientes a OpenAI según sus límites de uso"""
+##
+# @file planificador_service.py
+#
+# @brief Cubos de peticiones y tokens por minuto para cada modelo, con cola de prioridades.
+#
+# @section description_planificador_service Descripción
+# Antes de cada petición a OpenAI se reserva una petición y una estimación de los tokens
+# que consumirá en los cubos del modelo: los caracteres de los mensajes entre
+# `CARACTERES_POR_TOKEN` más `max_tokens` (ver `openai_service._estimar_tokens`; no se
+# codifica con tiktoken, y la reserva se corrige con el consumo real). Cada cubo se
+# rellena de forma continua hasta su límite por minuto; si no hay saldo, la petición
+# espera en lugar de salir y recibir un 429.
+#
+# Las peticiones que esperan se atienden por prioridad y, dentro de la misma prioridad,
+# por orden de llegada:
+# 1. `PRIORIDAD_CHAT`: respuestas a los mensajes del usuario.
+# 2. `PRIORIDAD_RESUMEN`: resúmenes del historial.
+# 3. `PRIORIDAD_LOTE`: trabajos en segundo plano.
+#
+# Cada modelo tiene sus propios cubos y su propia cola, así que la prioridad sólo ordena
+# las peticiones al mismo modelo: un trabajo en segundo plano con `gpt-4` no espera a
+# los chats con `gpt-3.5-turbo`, porque no consumen el mismo saldo. Los resúmenes usan
+# siempre `MODELO_RESUMEN` y compiten sólo con las peticiones a ese modelo.
+#
+# @section ajuste_planificador_service Ajuste con la respuesta
+# Los límites iniciales son `OPENAI_LIMITE_RPM` y `OPENAI_LIMITE_TPM` (o los de
+# `OPENAI_LIMITES` para un modelo concreto). Con cada respuesta se corrigen con las
+# cabeceras `x-ratelimit-*` de OpenAI, se devuelven al cubo los tokens reservados que no
+# se han usado y, ante un 429, se vacían los cubos del modelo.
+#
+# Los límites son por proceso: con varios workers, conviene repartir los de la cuenta
+# entre ellos (e.g., `OPENAI_LIMITE_TPM` = límite de la cuenta / número de workers).
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+'''! @brief Prioridad de las respuestas a los mensajes del usuario (la más alta)'''
+PRIORIDAD_CHAT = 0
+
+'''! @brief Prioridad de los resúmenes del historial'''
+PRIORIDAD_RESUMEN = 1
+
+'''! @brief Prioridad de los trabajos en segundo plano (la más baja)'''
+PRIORIDAD_LOTE = 2
+
+'''! @brief Peticiones por minuto y modelo mientras OpenAI no indique otro límite'''
+OPENAI_LIMITE_RPM = int(os.getenv('OPENAI_LIMITE_RPM', '500'))
+
+'''! @brief Tokens por minuto y modelo mientras OpenAI no indique otro límite'''
+OPENAI_LIMITE_TPM = int(os.getenv('OPENAI_LIMITE_TPM', '200000'))
+
+'''
+@brief Límites iniciales por modelo, en JSON (e.g., `{"gpt-4o": {"rpm": 500, "tpm": 30000}}`).
+Los modelos que no aparecen usan `OPENAI_LIMITE_RPM` y `OPENAI_LIMITE_TPM`.
+'''
+OPENAI_LIMITES = json.loads(os.getenv('OPENAI_LIMITES', '{}'))
+
+'''! @brief Segundos máximos que una petición espera turno antes de fallar con `LimiteExcedido`'''
+PLANIFICADOR_ESPERA_MAXIMA = float(os.getenv('PLANIFICADOR_ESPERA_MAXIMA', '120'))
+
+'''! @brief Intervalo (s) con el que las peticiones asíncronas en cola comprueban si es su turno'''
+INTERVALO_SONDEO = 0.05
+
+
+class LimiteExcedido(Exception):
+    """! @brief Una petición ha esperado más de `PLANIFICADOR_ESPERA_MAXIMA` sin saldo en los cubos."""
+
+
+class Cubo:
+    """
+    @brief Cubo de fichas que se rellena de forma continua hasta `capacidad` por minuto.
+
+    @details
+    El nivel puede quedar negativo si se consume más de lo reservado (o una petición
+    mayor que la capacidad); en ese caso las siguientes esperan a que se recupere.
+    """
+
+    def __init__(self, capacidad):
+        self.capacidad = capacidad
+        self.nivel = float(capacidad)
+        self._actualizado = time.monotonic()
+
+    def _rellenar(self, ahora):
+        self.nivel = min(self.capacidad, self.nivel + (ahora - self._actualizado) * self.capacidad / 60)
+        self._actualizado = ahora
+
+    def espera(self, cantidad, ahora):
+        """
+        @brief Segundos hasta que haya saldo para `cantidad` fichas (0 si ya lo hay).
+        @param cantidad Fichas necesarias; se limita a la capacidad para que nunca espere indefinidamente.
+        @param ahora Instante actual según `time.monotonic()`.
+        """
+        self._rellenar(ahora)
+        falta = min(cantidad, self.capacidad) - self.nivel
+        return max(0.0, falta * 60 / self.capacidad)
+
+    def consumir(self, cantidad):
+        self.nivel -= cantidad
+
+    def ajustar(self, limite=None, restante=None):
+        """
+        @brief Corrige el cubo con los datos de las cabeceras de OpenAI.
+        @param limite Límite por minuto de la cuenta (nueva capacidad).
+        @param restante Saldo que le queda a la cuenta; el nivel nunca queda por encima.
+        """
+        self._rellenar(time.monotonic())
+        if limite:
+            self.capacidad = limite
+        if restante is not None:
+            self.nivel = min(self.nivel, restante)
+
+
+def _entero(cabeceras, nombre):
+    try:
+        return int(cabeceras.get(nombre))
+    except (TypeError, ValueError):
+        return None
+
+
+class Reserva:
+    """
+    @brief Petición y tokens reservados en los cubos de un modelo.
+
+    @details
+    Se obtiene con `Planificador.reservar` o `Planificador.reservar_async`. Tras recibir
+    la respuesta de OpenAI se llama a `registrar` con sus cabeceras y su consumo real.
+    """
+
+    def __init__(self, planificador, modelo, tokens):
+        self.planificador = planificador
+        self.modelo = modelo
+        self.tokens = tokens
+
+    def registrar(self, cabeceras=None, usados=None):
+        """
+        @brief Ajusta los cubos del modelo con la respuesta de OpenAI.
+        @param cabeceras Cabeceras HTTP de la respuesta (`x-ratelimit-*`).
+        @param usados Tokens realmente consumidos (`usage.total_tokens`), si se conocen.
+        """
+        self.planificador.registrar(self.modelo, cabeceras, self.tokens - usados if usados is not None else 0)
+
+
+class Planificador:
+    """
+    @brief Reparte el saldo de peticiones y tokens por minuto entre las peticiones a OpenAI.
+
+    @details
+    Es seguro usarlo a la vez desde varios hilos y desde el bucle de eventos del servidor
+    ASGI: las peticiones síncronas esperan en una condición y las asíncronas consultan
+    periódicamente (`INTERVALO_SONDEO`) si ya es su turno.
+    """
+
+    def __init__(self, rpm=OPENAI_LIMITE_RPM, tpm=OPENAI_LIMITE_TPM, limites=OPENAI_LIMITES,
+                 espera_maxima=PLANIFICADOR_ESPERA_MAXIMA):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.limites = limites
+        self.espera_maxima = espera_maxima
+        self._condicion = threading.Condition()
+        self._cubos = {}  # modelo -> (cubo de peticiones, cubo de tokens)
+        self._colas = {}  # modelo -> montículo de turnos (prioridad, orden de llegada)
+        self._orden = itertools.count()
+
+    def _cubos_de(self, modelo):
+        if modelo not in self._cubos:
+            limites = self.limites.get(modelo, {})
+            self._cubos[modelo] = (Cubo(limites.get('rpm', self.rpm)), Cubo(limites.get('tpm', self.tpm)))
+        return self._cubos[modelo]
+
+    # --- Cola ---
+
+    def _pedir_turno(self, modelo, prioridad):
+        turno = (prioridad, next(self._orden))
+        heapq.heappush(self._colas.setdefault(modelo, []), turno)
+        return turno
+
+    def _intentar(self, modelo, tokens, turno):
+        """Reserva si es el turno de la petición y hay saldo; devuelve los segundos que debe esperar (0 si ha reservado)."""
+        cola = self._colas[modelo]
+        if cola[0] != turno:
+            return INTERVALO_SONDEO
+        peticiones, fichas = self._cubos_de(modelo)
+        ahora = time.monotonic()
+        espera = max(peticiones.espera(1, ahora), fichas.espera(tokens, ahora))
+        if espera > 0:
+            return espera
+        peticiones.consumir(1)
+        fichas.consumir(tokens)
+        heapq.heappop(cola)
+        self._condicion.notify_all()
+        return 0
+
+    def _abandonar(self, modelo, turno):
+        cola = self._colas[modelo]
+        if turno in cola:
+            cola.remove(turno)
+            heapq.heapify(cola)
+            self._condicion.notify_all()
+
+    # --- Reservas ---
+
+    @contextmanager
+    def reservar(self, modelo, tokens, prioridad=PRIORIDAD_CHAT):
+        """
+        @brief Espera turno y saldo para una petición y la reserva.
+
+        @details
+        Si el bloque lanza una excepción con respuesta HTTP (e.g., `openai.RateLimitError`),
+        sus cabeceras se aplican a los cubos antes de propagarla.
+
+        @param modelo Modelo al que se envía la petición.
+        @param tokens Estimación de los tokens que consumirá (entrada + `max_tokens`).
+        @param prioridad `PRIORIDAD_CHAT`, `PRIORIDAD_RESUMEN` o `PRIORIDAD_LOTE`.
+
+        @return
+        - Context manager que entrega la `Reserva`.
+
+        @throws LimiteExcedido Si no hay saldo en `espera_maxima` segundos.
+
+        @code
+        Ejemplo de uso:
+        with planificador.reservar("gpt-4o", 1800) as reserva:
+            crudo = cliente.chat.completions.with_raw_response.create(...)
+            reserva.registrar(crudo.headers, crudo.parse().usage.total_tokens)
+        @endcode
+        """
+        limite = time.monotonic() + self.espera_maxima
+        with self._condicion:
+            turno = self._pedir_turno(modelo, prioridad)
+            try:
+                while True:
+                    espera = self._intentar(modelo, tokens, turno)
+                    if espera == 0:
+                        break
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        raise LimiteExcedido(f"Sin saldo de peticiones/tokens para {modelo} tras {self.espera_maxima:g} s")
+                    self._condicion.wait(min(espera, restante))
+            except BaseException:
+                self._abandonar(modelo, turno)
+                raise
+        with self._errores(modelo):
+            yield Reserva(self, modelo, tokens)
+
+    @asynccontextmanager
+    async def reservar_async(self, modelo, tokens, prioridad=PRIORIDAD_CHAT):
+        """
+        @brief Versión asíncrona de `reservar`: espera sin bloquear el bucle de eventos.
+        @param modelo Modelo al que se envía la petición.
+        @param tokens Estimación de los tokens que consumirá.
+        @param prioridad `PRIORIDAD_CHAT`, `PRIORIDAD_RESUMEN` o `PRIORIDAD_LOTE`.
+        @return Context manager asíncrono que entrega la `Reserva`.
+        @throws LimiteExcedido Si no hay saldo en `espera_maxima` segundos.
+        """
+        limite = time.monotonic() + self.espera_maxima
+        with self._condicion:
+            turno = self._pedir_turno(modelo, prioridad)
+        try:
+            while True:
+                with self._condicion:
+                    espera = self._intentar(modelo, tokens, turno)
+                if espera == 0:
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    raise LimiteExcedido(f"Sin saldo de peticiones/tokens para {modelo} tras {self.espera_maxima:g} s")
+                await asyncio.sleep(min(espera, restante, INTERVALO_SONDEO))
+        except BaseException:
+            with self._condicion:
+                self._abandonar(modelo, turno)
+            raise
+        with self._errores(modelo):
+            yield Reserva(self, modelo, tokens)
+
+    @contextmanager
+    def _errores(self, modelo):
+        try:
+            yield
+        except Exception as e:
+            respuesta = getattr(e, 'response', None)
+            if respuesta is not None:
+                self.registrar(modelo, respuesta.headers, vaciar=respuesta.status_code == 429)
+            raise
+
+    # --- Ajuste ---
+
+    def registrar(self, modelo, cabeceras=None, devolver=0, vaciar=False):
+        """
+        @brief Ajusta los cubos de un modelo tras una respuesta de OpenAI.
+        @param modelo Modelo de la petición.
+        @param cabeceras Cabeceras HTTP de la respuesta, con `x-ratelimit-limit-*` y `x-ratelimit-remaining-*`.
+        @param devolver Tokens reservados que no se han usado (negativo si se usaron más).
+        @param vaciar True si OpenAI ha respondido 429: se vacían los dos cubos del modelo.
+        """
+        with self._condicion:
+            peticiones, fichas = self._cubos_de(modelo)
+            fichas.consumir(-devolver)
+            if cabeceras is not None:
+                peticiones.ajustar(_entero(cabeceras, 'x-ratelimit-limit-requests'),
+                                   _entero(cabeceras, 'x-ratelimit-remaining-requests'))
+                fichas.ajustar(_entero(cabeceras, 'x-ratelimit-limit-tokens'),
+                               _entero(cabeceras, 'x-ratelimit-remaining-tokens'))
+            if vaciar:
+                logger.warning(f"OpenAI ha limitado las peticiones a {modelo}; se vacían sus cubos")
+                peticiones.ajustar(restante=0)
+                fichas.ajustar(restante=0)
+            self._condicion.notify_all()
+
+    def estadisticas(self):
+        """
+        @brief Devuelve el estado de los cubos y las colas.
+        @return Diccionario por modelo con `rpm`, `tpm`, saldos disponibles y peticiones en cola.
+        """
+        with self._condicion:
+            ahora = time.monotonic()
+            datos = {}
+            for modelo, (peticiones, fichas) in self._cubos.items():
+                peticiones._rellenar(ahora)
+                fichas._rellenar(ahora)
+                datos[modelo] = {
+                    'rpm': peticiones.capacidad,
+                    'tpm': fichas.capacidad,
+                    'peticiones_disponibles': int(peticiones.nivel),
+                    'tokens_disponibles': int(fichas.nivel),
+                    'en_cola': len(self._colas.get(modelo, [])),
+                }
+            return datos
+
+
+'''! @brief Planificador compartido por todas las peticiones a OpenAI del proceso'''
+planificador = Planificador()
@@ -0,0 +1,278 @@
+"""! @brief Cola de generaciones en segundo plano persistida en la base de datos"""
+##
+# @file trabajos_service.py
+#
+# @brief Trabajos (tabla `trabajo`) que generan la respuesta a un mensaje fuera de la
+# petición HTTP, y pool de hilos que los ejecuta.
+#
+# @section description_trabajos_service Descripción
+# `POST /api/chat/<id>` con la cabecera `Prefer: respond-async` guarda el mensaje como
+# un trabajo pendiente y responde 202 al momento; el cliente consulta el resultado en
+# `GET /api/jobs/<id>`. Así las generaciones largas no mantienen abierta la conexión
+# (ni caducan en el proxy inverso).
+#
+# Cada hilo del pool reclama el trabajo pendiente más antiguo con un `UPDATE`
+# condicional (`WHERE estado = 'pendiente'`), de modo que un trabajo nunca se ejecuta
+# dos veces a la vez aunque haya varios hilos o varios procesos. La respuesta, el
+# estado final del trabajo y los `Mensaje` del intercambio se guardan en la misma
+# transacción.
+#
+# @section reinicios_trabajos_service Reinicios
+# Los trabajos sobreviven a los reinicios porque están en la base de datos. Mientras
+# se ejecuta un trabajo, un hilo renueva su `fecha_renovacion` cada tercio de
+# `TRABAJOS_CADUCIDAD`; un trabajo `en_curso` que lleva más de `TRABAJOS_CADUCIDAD`
+# segundos sin renovarse se considera abandonado (el proceso murió) y vuelve a
+# reclamarse, hasta `TRABAJOS_MAX_INTENTOS` intentos. Así la caducidad no depende de lo
+# que tarde OpenAI en responder.
+#
+# Cada intento se identifica por el número de `intentos` con el que se reclamó: el
+# resultado sólo se guarda si el trabajo sigue `en_curso` con ese mismo número. Si el
+# trabajo se volvió a reclamar (por ejemplo, porque el proceso se quedó sin renovarlo),
+# el intento antiguo descarta su respuesta y no se guardan mensajes duplicados.
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_, func, update
+from chatgpt_api.db import db_session as sesion_hilo
+from chatgpt_api.models import Conversacion, Trabajo
+from chatgpt_api.services.chat_service import construir_historial, guardar_intercambio
+from chatgpt_api.services.openai_service import obtener_respuesta_openai
+from chatgpt_api.services.planificador_service import PRIORIDAD_LOTE
+
+logger = logging.getLogger(__name__)
+
+'''! @brief Hilos que ejecutan trabajos en cada proceso (0 desactiva la ejecución en este proceso)'''
+TRABAJOS_HILOS = int(os.getenv('TRABAJOS_HILOS', '2'))
+
+'''! @brief Segundos entre consultas a la tabla cuando no hay trabajos pendientes'''
+TRABAJOS_INTERVALO = float(os.getenv('TRABAJOS_INTERVALO', '2'))
+
+'''! @brief Segundos sin renovarse tras los que un trabajo `en_curso` se considera abandonado'''
+TRABAJOS_CADUCIDAD = int(os.getenv('TRABAJOS_CADUCIDAD', '900'))
+
+'''! @brief Intentos de un trabajo antes de marcarlo como fallido'''
+TRABAJOS_MAX_INTENTOS = 3
+
+'''! @brief Estados de un trabajo'''
+PENDIENTE, EN_CURSO, COMPLETADO, ERROR = 'pendiente', 'en_curso', 'completado', 'error'
+
+
+def trabajo_to_dict(trabajo):
+    """
+    @brief Serializa un trabajo para la API.
+    @param trabajo Instancia de `Trabajo`.
+    @return Diccionario con el estado, la respuesta o el error y las fechas del trabajo.
+    """
+    return {
+        'id': trabajo.id,
+        'conversacion_id': trabajo.conversacion_id,
+        'estado': trabajo.estado,
+        'respuesta': trabajo.respuesta,
+        'error': trabajo.error,
+        'intentos': trabajo.intentos,
+        'fecha_creacion': trabajo.fecha_creacion.isoformat() if trabajo.fecha_creacion else None,
+        'fecha_inicio': trabajo.fecha_inicio.isoformat() if trabajo.fecha_inicio else None,
+        'fecha_fin': trabajo.fecha_fin.isoformat() if trabajo.fecha_fin else None,
+    }
+
+
+def encolar(db_session, conversacion_id, mensaje_usuario):
+    """
+    @brief Guarda un mensaje como trabajo pendiente y avisa al pool.
+
+    @param db_session Sesión de SQLAlchemy.
+    @param conversacion_id ID de la conversación.
+    @param mensaje_usuario Texto del mensaje del usuario.
+
+    @return
+    - Instancia de `Trabajo` ya guardada (con `id`).
+    """
+    trabajo = Trabajo(conversacion_id=conversacion_id, mensaje=mensaje_usuario, estado=PENDIENTE)
+    db_session.add(trabajo)
+    db_session.commit()
+    pool_trabajos.avisar()
+    return trabajo
+
+
+class PoolTrabajos:
+    """
+    @brief Hilos que reclaman y ejecutan los trabajos pendientes.
+
+    @details
+    Los hilos esperan un aviso de `encolar` o, como mucho, `intervalo` segundos, de modo
+    que también recogen los trabajos encolados por otros procesos y los que quedaron
+    pendientes antes de un reinicio.
+    """
+
+    def __init__(self, hilos=TRABAJOS_HILOS, intervalo=TRABAJOS_INTERVALO, caducidad=TRABAJOS_CADUCIDAD):
+        self.hilos = hilos
+        self.intervalo = intervalo
+        self.caducidad = caducidad
+        self._aviso = threading.Event()
+        self._parar = threading.Event()
+        self._hilos = []
+
+    def _reclamable(self, ahora):
+        # Los trabajos reclamados antes de la migración 12 no tienen `fecha_renovacion`
+        renovacion = func.coalesce(Trabajo.fecha_renovacion, Trabajo.fecha_inicio)
+        return or_(
+            Trabajo.estado == PENDIENTE,
+            and_(Trabajo.estado == EN_CURSO, renovacion < ahora - timedelta(seconds=self.caducidad)),
+        )
+
+    @staticmethod
+    def _propio(id, intento):
+        """! @brief Condición de que el trabajo sigue `en_curso` en el intento `intento`."""
+        return and_(Trabajo.id == id, Trabajo.estado == EN_CURSO, Trabajo.intentos == intento)
+
+    def reclamar(self, db_session):
+        """
+        @brief Marca como `en_curso` el trabajo reclamable más antiguo.
+        @param db_session Sesión de SQLAlchemy.
+        @return ID del trabajo reclamado, o None si no hay ninguno.
+        """
+        ahora = datetime.utcnow()
+        candidatos = db_session.query(Trabajo.id).filter(self._reclamable(ahora)).order_by(Trabajo.id).limit(5).all()
+        for (id,) in candidatos:
+            reclamado = db_session.execute(
+                update(Trabajo)
+                .where(Trabajo.id == id, self._reclamable(ahora))
+                .values(estado=EN_CURSO, fecha_inicio=ahora, fecha_renovacion=ahora, intentos=Trabajo.intentos + 1)
+            ).rowcount
+            db_session.commit()
+            if reclamado:
+                return id
+        return None
+
+    def ejecutar(self, db_session, id):
+        """
+        @brief Genera la respuesta de un trabajo reclamado y guarda el resultado.
+
+        @details
+        Construye el historial y consulta a OpenAI igual que `POST /api/chat/<id>`, con la
+        prioridad `PRIORIDAD_LOTE` también para los resúmenes. Si todo va bien, el trabajo
+        pasa a `completado` y se guardan los mensajes del intercambio; si OpenAI devuelve
+        un error, pasa a `error` sin guardar mensajes. En ambos casos sólo si el trabajo no
+        se ha vuelto a reclamar mientras tanto (ver `_propio`).
+
+        @param db_session Sesión de SQLAlchemy.
+        @param id ID del trabajo, reclamado con `reclamar`.
+        """
+        trabajo = db_session.get(Trabajo, id)
+        intento = trabajo.intentos
+        if intento > TRABAJOS_MAX_INTENTOS:
+            self._fallar(db_session, id, intento, f"Abandonado tras {TRABAJOS_MAX_INTENTOS} intentos")
+            return
+        conv = db_session.get(Conversacion, trabajo.conversacion_id)
+        if conv is None:
+            self._fallar(db_session, id, intento, 'Conversación no encontrada')
+            return
+        with self._renovando(id, intento):
+            # Cede el turno a los mensajes de los usuarios que esperan respuesta
+            mensajes_historial = construir_historial(db_session, conv, trabajo.mensaje, PRIORIDAD_LOTE)
+            logger.info(f"Trabajo {id}: enviando historial al modelo {conv.modelo}.")
+            try:
+                respuesta = obtener_respuesta_openai(
+                    mensajes_historial, conv.modelo, usar_cache=conv.usar_cache,
+                    prioridad=PRIORIDAD_LOTE, lanzar_errores=True,
+                )
+            except Exception as e:
+                self._fallar(db_session, id, intento, f"Error al obtener respuesta de OpenAI: {str(e)}")
+                return
+        completado = db_session.execute(
+            update(Trabajo)
+            .where(self._propio(id, intento))
+            .values(estado=COMPLETADO, respuesta=respuesta, fecha_fin=datetime.utcnow())
+        ).rowcount
+        if not completado:
+            db_session.rollback()
+            logger.warning(f"Trabajo {id}: se volvió a reclamar durante el intento {intento}; se descarta la respuesta")
+            return
+        guardar_intercambio(db_session, conv.id, trabajo.mensaje, respuesta, conv.modelo)  # Hace commit de todo
+
+    def _fallar(self, db_session, id, intento, error):
+        logger.error(f"Trabajo {id} fallido: {error}")
+        db_session.execute(
+            update(Trabajo)
+            .where(self._propio(id, intento))
+            .values(estado=ERROR, error=error, fecha_fin=datetime.utcnow())
+        )
+        db_session.commit()
+
+    @contextmanager
+    def _renovando(self, id, intento):
+        """
+        @brief Renueva `fecha_renovacion` del trabajo mientras se ejecuta el bloque.
+
+        @details
+        Un hilo aparte (con su propia sesión) actualiza la fecha cada tercio de `caducidad`,
+        mientras el trabajo siga siendo del intento `intento`, de modo que otros hilos o
+        procesos no lo consideren abandonado por mucho que tarde OpenAI.
+        """
+        fin = threading.Event()
+
+        def renovar():
+            while not fin.wait(self.caducidad / 3):
+                try:
+                    sesion_hilo.execute(
+                        update(Trabajo).where(self._propio(id, intento)).values(fecha_renovacion=datetime.utcnow())
+                    )
+                    sesion_hilo.commit()
+                except Exception as e:
+                    logger.error(f"No se pudo renovar el trabajo {id}: {str(e)}")
+                finally:
+                    sesion_hilo.remove()
+
+        hilo = threading.Thread(target=renovar, name=f'trabajo-{id}-renovacion', daemon=True)
+        hilo.start()
+        try:
+            yield
+        finally:
+            fin.set()
+            hilo.join()
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            try:
+                id = self.reclamar(sesion_hilo)
+                if id is None:
+                    self._aviso.wait(self.intervalo)
+                    self._aviso.clear()
+                else:
+                    self.ejecutar(sesion_hilo, id)
+            except Exception as e:
+                logger.error(f"Error en el pool de trabajos: {str(e)}")
+                self._parar.wait(self.intervalo)
+            finally:
+                sesion_hilo.remove()
+
+    def avisar(self):
+        """! @brief Despierta a los hilos en espera (hay un trabajo nuevo)."""
+        self._aviso.set()
+
+    def iniciar(self):
+        """! @brief Arranca los hilos (una sola vez por proceso); no hace nada si `hilos` es 0."""
+        if self._hilos:
+            return
+        self._parar.clear()
+        for n in range(self.hilos):
+            hilo = threading.Thread(target=self._bucle, name=f'trabajos-{n}', daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+
+    def detener(self, espera=None):
+        """
+        @brief Detiene los hilos cuando terminen el trabajo en curso.
+        @param espera Segundos máximos que se espera a cada hilo (None: sin límite).
+        """
+        self._parar.set()
+        self._aviso.set()
+        for hilo in self._hilos:
+            hilo.join(espera)
+        self._hilos = []
+
+
+'''! @brief Pool de trabajos del proceso (se arranca con `app.iniciar_servicios`)'''
+pool_trabajos = PoolTrabajos()
@@ -0,0 +1,180 @@
+"""! @brief Clientes HTTP compartidos para todo el tráfico con OpenAI"""
+##
+# @file transporte_service.py
+#
+# @brief Cliente de OpenAI (síncrono y asíncrono) y sesión de `requests` compartidos,
+# con conexiones persistentes, tiempos de espera y reintentos con espera exponencial.
+#
+# @section description_transporte_service Descripción
+# Cada proceso reutiliza un único pool de conexiones por cliente, de modo que las
+# peticiones a OpenAI no pagan un handshake TLS nuevo cada vez. Todas las peticiones
+# tienen un tiempo máximo de conexión (`HTTP_TIMEOUT_CONEXION`) y de lectura
+# (`HTTP_TIMEOUT_LECTURA`) para que un servidor que no responde no bloquee un worker
+# indefinidamente.
+#
+# Las respuestas 408, 409, 429 y 5xx (y los errores de conexión) se reintentan hasta
+# `HTTP_REINTENTOS` veces con espera exponencial y aleatoria (con un máximo de 8 s),
+# respetando la cabecera `Retry-After` cuando el servidor la envía:
+# - Cliente de OpenAI: lo hace el propio SDK (`max_retries`). Espera 0,5 s, 1 s, 2 s...
+#   menos entre un 0 y un 25 % aleatorio.
+# - Sesión de `requests` (lista de modelos): `urllib3.util.Retry` montado en el adaptador.
+#   urllib3 hace el primer reintento sin esperar; después espera 0,5 s, 1 s, 2 s... más
+#   entre 0 y 0,5 s aleatorios.
+#
+# Los clientes se crean la primera vez que se usan (ver benchmarks/arranque.py).
+import os
+import threading
+
+'''! @brief URL base de la API de OpenAI (permite usar un proxy o un servidor compatible)'''
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
+
+'''! @brief Máximo de conexiones simultáneas por cliente'''
+HTTP_CONEXIONES = int(os.getenv('HTTP_CONEXIONES', '20'))
+
+'''! @brief Segundos que una conexión inactiva se mantiene abierta para reutilizarla'''
+HTTP_KEEPALIVE = float(os.getenv('HTTP_KEEPALIVE', '30'))
+
+'''! @brief Segundos máximos para establecer una conexión (o esperar una libre del pool)'''
+HTTP_TIMEOUT_CONEXION = float(os.getenv('HTTP_TIMEOUT_CONEXION', '5'))
+
+'''! @brief Segundos máximos de espera entre datos recibidos del servidor'''
+HTTP_TIMEOUT_LECTURA = float(os.getenv('HTTP_TIMEOUT_LECTURA', '120'))
+
+'''! @brief Tiempos de espera `(conexión, lectura)` para las peticiones con `obtener_sesion`'''
+TIMEOUT = (HTTP_TIMEOUT_CONEXION, HTTP_TIMEOUT_LECTURA)
+
+'''! @brief Reintentos ante errores de conexión, 408, 409, 429 y 5xx'''
+HTTP_REINTENTOS = int(os.getenv('HTTP_REINTENTOS', '3'))
+
+'''! @brief Códigos de estado que se reintentan'''
+ESTADOS_REINTENTO = (408, 409, 429, 500, 502, 503, 504)
+
+'''! @brief Espera base (s) entre reintentos de la sesión de `requests`; se duplica en cada uno'''
+ESPERA_INICIAL = 0.5
+
+'''! @brief Espera máxima (s) entre reintentos cuando el servidor no envía `Retry-After`'''
+ESPERA_MAXIMA = 8.0
+
+_lock = threading.Lock()
+_cliente = None
+_cliente_async = None
+_sesion = None
+
+
+def _httpx():
+    """! @brief Devuelve el módulo de `httpx` que usa el SDK de OpenAI instalado."""
+    try:
+        import httpx
+    except ImportError:  # Versiones del SDK basadas en `httpx2`
+        import httpx2 as httpx
+    return httpx
+
+
+def _opciones_http():
+    """! @brief Límites del pool y tiempos de espera de los clientes de OpenAI."""
+    httpx = _httpx()
+    return {
+        'limits': httpx.Limits(
+            max_connections=HTTP_CONEXIONES,
+            max_keepalive_connections=HTTP_CONEXIONES,
+            keepalive_expiry=HTTP_KEEPALIVE,
+        ),
+        'timeout': httpx.Timeout(HTTP_TIMEOUT_LECTURA, connect=HTTP_TIMEOUT_CONEXION, pool=HTTP_TIMEOUT_CONEXION),
+    }
+
+
+def obtener_cliente():
+    """
+    @brief Devuelve el cliente `openai.OpenAI` compartido, creándolo si no existe.
+
+    @details
+    Usa la clave de la API de la variable de entorno `OPENAI_API_KEY` y la URL base
+    `OPENAI_BASE_URL`. Es seguro usarlo desde varios hilos.
+
+    @return
+    - Instancia de `openai.OpenAI`.
+
+    @code
+    Ejemplo de uso:
+    respuesta = obtener_cliente().chat.completions.create(model="gpt-4o", messages=mensajes)
+    @endcode
+    """
+    global _cliente
+    if _cliente is None:
+        with _lock:
+            if _cliente is None:
+                import openai
+                _cliente = openai.OpenAI(
+                    api_key=os.getenv('OPENAI_API_KEY'),
+                    base_url=OPENAI_BASE_URL,
+                    max_retries=HTTP_REINTENTOS,
+                    http_client=openai.DefaultHttpxClient(**_opciones_http()),
+                )
+    return _cliente
+
+
+def obtener_cliente_async():
+    """
+    @brief Devuelve el cliente `openai.AsyncOpenAI` compartido por el punto de entrada ASGI.
+
+    @details
+    Tiene la misma configuración que `obtener_cliente`. Debe usarse siempre desde el mismo
+    bucle de eventos (el del servidor ASGI).
+
+    @return
+    - Instancia de `openai.AsyncOpenAI`.
+    """
+    global _cliente_async
+    if _cliente_async is None:
+        import openai
+        _cliente_async = openai.AsyncOpenAI(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            base_url=OPENAI_BASE_URL,
+            max_retries=HTTP_REINTENTOS,
+            http_client=openai.DefaultAsyncHttpxClient(**_opciones_http()),
+        )
+    return _cliente_async
+
+
+def obtener_sesion():
+    """
+    @brief Devuelve la sesión de `requests` compartida para las peticiones directas a la API.
+
+    @details
+    La sesión mantiene las conexiones abiertas y reintenta las peticiones idempotentes
+    (GET, HEAD...) según la política descrita en la cabecera del módulo. `requests` no
+    admite un tiempo de espera por sesión: use `TIMEOUT` en cada petición.
+
+    @return
+    - Instancia de `requests.Session` con la cabecera `Authorization` configurada.
+
+    @code
+    Ejemplo de uso:
+    respuesta = obtener_sesion().get(f"{OPENAI_BASE_URL}/models", timeout=TIMEOUT)
+    @endcode
+    """
+    global _sesion
+    if _sesion is None:
+        with _lock:
+            if _sesion is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util import Retry
+                reintentos = Retry(
+                    total=HTTP_REINTENTOS,
+                    status_forcelist=ESTADOS_REINTENTO,
+                    # Esperas: 0 (primer reintento), factor * 2, factor * 4... más `backoff_jitter`
+                    backoff_factor=ESPERA_INICIAL / 2,
+                    backoff_jitter=ESPERA_INICIAL,
+                    backoff_max=ESPERA_MAXIMA,
+                    respect_retry_after_header=True,
+                    raise_on_status=False,
+                )
+                adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_CONEXIONES, max_retries=reintentos)
+                sesion = requests.Session()
+                sesion.mount('https://', adaptador)
+                sesion.mount('http://', adaptador)
+                sesion.headers['Authorization'] = f"Bearer {os.getenv('OPENAI_API_KEY')}"
+                _sesion = sesion
+    return _sesion
+
@@ -0,0 +1,156 @@
+"""! @brief Pruebas del recorte del historial y del plan de resumen"""
+##
+# @file test_chat_service.py
+#
+# @brief Pruebas de `contexto_service.corte_*` y `chat_service.preparar_historial`.
+#
+# @section description_test_chat_service Descripción
+# Los tokens se cuentan como palabras (una por palabra) para no depender de las
+# codificaciones de tiktoken, que se descargan de la red. La base de datos es SQLite en
+# memoria con el esquema de `models.py`.
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from chatgpt_api.models import Base, Conversacion, Mensaje
+from chatgpt_api.services import chat_service
+from chatgpt_api.services.chat_service import preparar_historial, mensaje_resumen
+from chatgpt_api.services.contexto_service import corte_por_presupuesto, corte_desde_inicio
+from chatgpt_api.services.openai_service import MAX_TOKENS_RESUMEN, TOKENS_POR_MENSAJE
+
+'''! @brief Nombre de la codificación falsa (una palabra = un token)'''
+CODIFICACION = 'palabras'
+
+
+class _Codificacion:
+    name = CODIFICACION
+
+
+def _contar(texto, modelo=None):
+    return len(texto.split())
+
+
+@pytest.fixture
+def db_session(monkeypatch):
+    monkeypatch.setattr(chat_service, 'obtener_codificacion', lambda modelo: _Codificacion())
+    monkeypatch.setattr(chat_service, 'contar_tokens_texto', _contar)
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    sesion = sessionmaker(bind=engine)()
+    yield sesion
+    sesion.close()
+    engine.dispose()
+
+
+def _conversacion(db_session, mensajes, resumen=None, palabras=20):
+    conv = Conversacion(nombre='prueba', modelo='gpt-3.5-turbo', resumen=resumen)
+    db_session.add(conv)
+    db_session.flush()
+    for i in range(mensajes):
+        texto = ' '.join([f'm{i}'] * palabras)
+        db_session.add(Mensaje(
+            conversacion_id=conv.id, mensaje=texto, es_usuario=i % 2 == 0,
+            tokens=_contar(texto), codificacion=CODIFICACION,
+        ))
+    db_session.commit()
+    return conv
+
+
+def _limitar_presupuesto(monkeypatch, limite):
+    monkeypatch.setattr(chat_service, 'presupuesto_contexto', lambda modelo, reservado=None: limite)
+
+
+# --- corte_por_presupuesto / corte_desde_inicio ---
+
+def test_corte_por_presupuesto_cabe_todo():
+    assert corte_por_presupuesto([10, 10, 10], 30) == 0
+    assert corte_por_presupuesto([], 0) == 0
+
+
+def test_corte_por_presupuesto_limite_exacto():
+    assert corte_por_presupuesto([10, 10, 10], 29) == 1
+    assert corte_por_presupuesto([10, 10, 10], 20) == 1
+    assert corte_por_presupuesto([10, 10, 10], 19) == 2
+
+
+def test_corte_por_presupuesto_no_cabe_ni_el_ultimo():
+    assert corte_por_presupuesto([10, 10, 10], 5) == 3
+    assert corte_por_presupuesto([10, 10, 10], -1) == 3
+
+
+def test_corte_desde_inicio_avanza_al_menos_uno():
+    assert corte_desde_inicio([10, 10, 10], 25) == 2
+    assert corte_desde_inicio([10, 10, 10], 30) == 3
+    assert corte_desde_inicio([10, 10, 10], 5) == 1
+    assert corte_desde_inicio([10, 10, 10], -100) == 1
+    assert corte_desde_inicio([], 10) == 0
+
+
+# --- preparar_historial ---
+
+def test_sin_resumen_si_cabe_todo(db_session, monkeypatch):
+    _limitar_presupuesto(monkeypatch, 10000)
+    conv = _conversacion(db_session, 10)
+    plan = preparar_historial(db_session, conv, 'hola')
+    assert plan.a_resumir is None
+    assert len(plan.mensajes) == 10
+
+
+def _comprobar_plan(db_session, plan):
+    """
+    @brief Comprueba que la marca `resumen_hasta_id` sólo cubre mensajes que se resumen.
+
+    @details
+    Los mensajes hasta la marca son exactamente los que se resumen, y los que se envían
+    son los más recientes posteriores a ella (los intermedios quedan para la siguiente
+    ronda de resumen).
+    """
+    ids = [m.id for m in db_session.query(Mensaje).order_by(Mensaje.id)]
+    textos = {m.id: m.mensaje for m in db_session.query(Mensaje)}
+    resumidos = [m['content'] for m in plan.a_resumir if m['role'] != 'system']
+    assert resumidos, "el resumen debe incluir al menos un mensaje"
+    hasta = plan.resumen_hasta_id
+    assert resumidos == [textos[id] for id in ids if id <= hasta]
+    pendientes = [textos[id] for id in ids if id > hasta]
+    enviados = [m['content'] for m in plan.mensajes]
+    assert enviados == pendientes[len(pendientes) - len(enviados):]
+
+
+def test_resume_lo_mas_antiguo(db_session, monkeypatch):
+    _limitar_presupuesto(monkeypatch, 200)
+    conv = _conversacion(db_session, 10)
+    plan = preparar_historial(db_session, conv, 'hola')
+    _comprobar_plan(db_session, plan)
+
+
+def _fijos(mensaje_usuario):
+    """! @brief Tokens fijos que `preparar_historial` descuenta del presupuesto."""
+    return (
+        chat_service.TOKENS_POR_PETICION + 2 * TOKENS_POR_MENSAJE
+        + _contar(chat_service.MENSAJE_SISTEMA['content']) + _contar(mensaje_usuario)
+    )
+
+
+def test_resumen_guardado_mas_largo_que_la_reserva(db_session, monkeypatch):
+    # El resumen guardado ocupa más que la reserva para uno nuevo, y los mensajes caben
+    # reservando `MAX_TOKENS_RESUMEN` pero no reservando lo que ocupa el resumen.
+    reserva = MAX_TOKENS_RESUMEN + TOKENS_POR_MENSAJE
+    resumen = ' '.join(['r'] * (reserva + 100))
+    tokens_resumen = _contar(mensaje_resumen(resumen)['content']) + TOKENS_POR_MENSAJE
+    conv = _conversacion(db_session, 10, resumen=resumen)
+    mensajes = 10 * (20 + TOKENS_POR_MENSAJE)
+    fijos = _fijos('hola')
+    _limitar_presupuesto(monkeypatch, fijos + reserva + mensajes + 10)
+    assert tokens_resumen > reserva + 10  # Con la reserva del resumen guardado no cabría todo
+    plan = preparar_historial(db_session, conv, 'hola')
+    _comprobar_plan(db_session, plan)
+    ultimo = db_session.query(Mensaje).order_by(Mensaje.id.desc()).first()
+    assert plan.resumen_hasta_id < ultimo.id
+
+
+def test_no_cabe_ni_el_ultimo_mensaje(db_session, monkeypatch):
+    _limitar_presupuesto(monkeypatch, 10)
+    conv = _conversacion(db_session, 3, resumen='resumen previo')
+    plan = preparar_historial(db_session, conv, 'hola')
+    _comprobar_plan(db_session, plan)
+
@@ -37,12 +37,15 @@ export const API = {
 
     /**
      * @function loadConversations
-     * @description Carga las conversaciones desde el servidor
-     * @returns {Promise} Promesa que resuelve con las conversaciones
+     * @description Carga una página de conversaciones desde el servidor
+     * @param {string|null} before - Cursor de la página anterior (`siguiente_cursor`); null para la primera
+     * @returns {Promise} Promesa que resuelve con `{conversaciones, siguiente_cursor}`
      */
-    async loadConversations() {
+    async loadConversations(before = null) {
         //console.log("[DEBUG API] Solicitando lista de conversaciones...");
-        const response = await fetch("/api/historial");
+        const params = new URLSearchParams();
+        if (before) params.set('before', before);
+        const response = await fetch(`/api/historial?${params}`);
         if (!response.ok) {
             console.error("[ERROR API] Error al obtener conversaciones:", response.status);
             throw new Error(`Error HTTP: ${response.status}`);
@@ -54,13 +57,16 @@ export const API = {
 
     /**
      * @function loadMessages
-     * @description Carga los mensajes de una conversación específica
+     * @description Carga una página de mensajes de una conversación específica
      * @param {string} conversationId - ID de la conversación
-     * @returns {Promise} Promesa que resuelve con los mensajes
+     * @param {number|null} before - Carga los mensajes anteriores a este ID; null para los más recientes
+     * @returns {Promise} Promesa que resuelve con `{mensajes, siguiente_cursor}`
      */
-    async loadMessages(conversationId) {
+    async loadMessages(conversationId, before = null) {
         //console.log(`[DEBUG API] Solicitando mensajes para conversación ${conversationId}...`);
-        const response = await fetch(`/api/chat/${conversationId}`);
+        const params = new URLSearchParams();
+        if (before !== null) params.set('before', before);
+        const response = await fetch(`/api/chat/${conversationId}?${params}`);
         if (!response.ok) {
             console.error("[ERROR API] Error al obtener mensajes:", response.status);
             throw new Error(`Error HTTP: ${response.status}`);
@@ -72,12 +78,17 @@ export const API = {
 
     /**
      * @function sendMessage
-     * @description Envía un mensaje al servidor
+     * @description Envía un mensaje al servidor. Si se indica `onDelta`, la respuesta
+     * se recibe en streaming (Server-Sent Events) y se notifica fragmento a fragmento.
      * @param {string} conversationId - ID de la conversación
      * @param {string} message - Mensaje a enviar
-     * @returns {Promise} Promesa que resuelve con la respuesta
+     * @param {Function} [onDelta] - Callback invocado con (fragmento, textoAcumulado)
+     * @returns {Promise} Promesa que resuelve con la respuesta completa
      */
-    async sendMessage(conversationId, message) {
+    async sendMessage(conversationId, message, onDelta = null) {
+        if (onDelta) {
+            return this.sendMessageStream(conversationId, message, onDelta);
+        }
         const response = await fetch(`/api/chat/${conversationId}`, {
             method: 'POST',
             headers: {
@@ -94,6 +105,66 @@ export const API = {
         return { mensaje: data.respuesta };
     },
 
+    /**
+     * @function sendMessageStream
+     * @description Envía un mensaje y consume la respuesta en streaming (SSE sobre fetch)
+     * @param {string} conversationId - ID de la conversación
+     * @param {string} message - Mensaje a enviar
+     * @param {Function} onDelta - Callback invocado con (fragmento, textoAcumulado)
+     * @returns {Promise} Promesa que resuelve con la respuesta completa
+     */
+    async sendMessageStream(conversationId, message, onDelta) {
+        const response = await fetch(`/api/chat/${conversationId}/stream`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
+            },
+            body: JSON.stringify({ mensaje: message }),
+        });
+
+        if (!response.ok || !response.body) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let texto = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // Los eventos SSE se separan por una línea en blanco
+            let separador;
+            while ((separador = buffer.indexOf('\n\n')) !== -1) {
+                const bloque = buffer.slice(0, separador);
+                buffer = buffer.slice(separador + 2);
+
+                let evento = 'message';
+                let datos = '';
+                for (const linea of bloque.split('\n')) {
+                    if (linea.startsWith('event:')) evento = linea.slice(6).trim();
+                    else if (linea.startsWith('data:')) datos += linea.slice(5).trim();
+                }
+                if (!datos) continue;
+                const payload = JSON.parse(datos);
+
+                if (evento === 'error') {
+                    throw new Error(payload.error);
+                }
+                if (payload.delta) {
+                    texto += payload.delta;
+                    onDelta(payload.delta, texto);
+                }
+            }
+        }
+
+        return { mensaje: texto };
+    },
+
     /**
      * @function createConversation
      * @description Crea una nueva conversación
@@ -11,6 +11,14 @@ export const ConversationManager = {
     conversationList: null,
     /** @type {number|null} ID de la conversación activa */
     activeConversationId: null,
+    /** @type {string|null} Cursor para cargar la siguiente página de conversaciones */
+    conversationsCursor: null,
+    /** @type {number|null} Cursor para cargar los mensajes anteriores de la conversación activa */
+    messagesCursor: null,
+    /** @type {boolean} Indica si hay una página de conversaciones cargándose */
+    loadingConversations: false,
+    /** @type {boolean} Indica si hay una página de mensajes cargándose */
+    loadingMessages: false,
 
     /**
      * @function editConversationName
@@ -128,16 +136,31 @@ export const ConversationManager = {
             console.error('[ERROR] No se encontró el elemento conversation-list');
             return;
         }
+        // Paginación: más conversaciones al llegar al final de la lista,
+        // mensajes anteriores al llegar al principio del chat
+        this.conversationList.addEventListener('scroll', () => {
+            const list = this.conversationList;
+            if (list.scrollTop + list.clientHeight >= list.scrollHeight - 50) {
+                this.loadMoreConversations();
+            }
+        });
+        UI.chatContent.addEventListener('scroll', () => {
+            if (UI.chatContent.scrollTop <= 50) {
+                this.loadOlderMessages();
+            }
+        });
         await this.loadConversations();
     },
 
     /**
      * @function loadConversations
-     * @description Carga las conversaciones desde el servidor
+     * @description Carga la primera página de conversaciones desde el servidor
      */
     async loadConversations() {
         try {
-            const conversations = await API.loadConversations();
+            const page = await API.loadConversations();
+            const conversations = page.conversaciones;
+            this.conversationsCursor = page.siguiente_cursor;
             this.renderConversationList(conversations);
 
             // Si hay conversaciones y ninguna está activa, seleccionar la primera
@@ -149,13 +172,32 @@ export const ConversationManager = {
         }
     },
 
+    /**
+     * @function loadMoreConversations
+     * @description Carga la siguiente página de conversaciones y la añade al final de la lista
+     */
+    async loadMoreConversations() {
+        if (!this.conversationsCursor || this.loadingConversations) return;
+        this.loadingConversations = true;
+        try {
+            const page = await API.loadConversations(this.conversationsCursor);
+            this.conversationsCursor = page.siguiente_cursor;
+            this.renderConversationList(page.conversaciones, true);
+        } catch (error) {
+            console.error('[ERROR] Error al cargar más conversaciones:', error);
+        } finally {
+            this.loadingConversations = false;
+        }
+    },
+
     /**
      * @function renderConversationList
      * @description Renderiza la lista de conversaciones
      * @param {Array} conversations - Lista de conversaciones
+     * @param {boolean} [append=false] - Añade las conversaciones a la lista en lugar de reemplazarla
      */
-    renderConversationList(conversations) {
-        this.conversationList.innerHTML = '';
+    renderConversationList(conversations, append = false) {
+        if (!append) this.conversationList.innerHTML = '';
         conversations.forEach(conv => {
             const li = document.createElement('li');
             li.classList.add('conversation-item');
@@ -224,13 +266,16 @@ export const ConversationManager = {
 
     /**
      * @function loadMessages
-     * @description Carga los mensajes de una conversación
+     * @description Carga la página más reciente de mensajes de una conversación
      * @param {string} conversationId - ID de la conversación
      */
     async loadMessages(conversationId) {
+        this.messagesCursor = null;
         try {
-            const messages = await API.loadMessages(conversationId);
-            
+            const page = await API.loadMessages(conversationId);
+            const messages = page.mensajes;
+            this.messagesCursor = page.siguiente_cursor;
+
             UI.clearChat();
             if (!Array.isArray(messages)) {
                 console.warn("[WARN] Los mensajes recibidos no son un array:", messages);
@@ -265,6 +310,35 @@ export const ConversationManager = {
         }
     },
 
+    /**
+     * @function loadOlderMessages
+     * @description Carga la página de mensajes anterior a la mostrada y la inserta al principio
+     * del chat, conservando la posición del scroll
+     */
+    async loadOlderMessages() {
+        const conversationId = this.activeConversationId;
+        if (!conversationId || this.messagesCursor === null || this.loadingMessages) return;
+        this.loadingMessages = true;
+        try {
+            const page = await API.loadMessages(conversationId, this.messagesCursor);
+            // Se descarta si el usuario ha cambiado de conversación mientras tanto
+            if (conversationId !== this.activeConversationId) return;
+            this.messagesCursor = page.siguiente_cursor;
+
+            const previousHeight = UI.chatContent.scrollHeight;
+            for (const message of [...page.mensajes].reverse()) {
+                if (message && typeof message.mensaje === "string") {
+                    await UI.renderMessage(message, { prepend: true });
+                }
+            }
+            UI.chatContent.scrollTop += UI.chatContent.scrollHeight - previousHeight;
+        } catch (error) {
+            console.error("[ERROR] Error al cargar mensajes anteriores:", error);
+        } finally {
+            this.loadingMessages = false;
+        }
+    },
+
     /**
      * @function createNewConversation
      * @description Crea una nueva conversación
@@ -70,15 +70,16 @@ export const EventHandler = {
         input.value = '';
         input.style.height = "auto";
 
+        // Mensaje del asistente que se rellena a medida que llega la respuesta
+        const botMessage = UI.createStreamingMessage();
         try {
-            const response = await API.sendMessage(conversationId, text);
-            await UI.renderMessage({ 
-                mensaje: response.mensaje, // Ahora response.mensaje contiene la respuesta
-                es_usuario: 0,
-                fecha_creacion: new Date().toISOString()
+            await API.sendMessage(conversationId, text, (delta, texto) => {
+                UI.updateStreamingMessage(botMessage, texto);
             });
+            await UI.finishStreamingMessage(botMessage);
         } catch (error) {
             console.error('Error al enviar mensaje:', error);
+            if (!botMessage.textContent) botMessage.parentElement.remove();
             await UI.renderMessage({ 
                 mensaje: 'Error al enviar el mensaje. Por favor, intenta de nuevo.',
                 es_usuario: 0,
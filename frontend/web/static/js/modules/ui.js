@@ -137,8 +137,10 @@ export const UI = {
      * @function renderMessage
      * @description Renderiza un mensaje en el chat
      * @param {Object} message - Objeto mensaje
+     * @param {Object} [options] - Opciones de renderizado
+     * @param {boolean} [options.prepend=false] - Inserta el mensaje al principio del chat (mensajes antiguos) sin desplazar el scroll
      */
-    async renderMessage(message) {
+    async renderMessage(message, { prepend = false } = {}) {
         // Si es el primer mensaje, limpiar el logo
         if (this.chatContent.classList.contains("empty")) {
             this.chatContent.innerHTML = "";
@@ -172,9 +174,59 @@ export const UI = {
         messageContainer.appendChild(messageDiv);
 
         // Añadir el contenedor al chat
+        if (prepend) {
+            this.chatContent.insertBefore(messageContainer, this.chatContent.firstChild);
+        } else {
+            this.chatContent.appendChild(messageContainer);
+            this.chatContent.scrollTop = this.chatContent.scrollHeight;
+        }
+        //console.log("[DEBUG UI] Mensaje renderizado exitosamente");
+        return messageDiv;
+    },
+
+    /**
+     * @function createStreamingMessage
+     * @description Crea un mensaje vacío del asistente que se irá rellenando en streaming
+     * @returns {HTMLElement} Elemento del mensaje
+     */
+    createStreamingMessage() {
+        if (this.chatContent.classList.contains("empty")) {
+            this.chatContent.innerHTML = "";
+            this.chatContent.classList.remove("empty");
+        }
+        const messageContainer = document.createElement("div");
+        messageContainer.classList.add("message-container");
+        const messageDiv = document.createElement("div");
+        messageDiv.classList.add("message", "bot", "streaming");
+        messageContainer.appendChild(messageDiv);
         this.chatContent.appendChild(messageContainer);
         this.chatContent.scrollTop = this.chatContent.scrollHeight;
-        //console.log("[DEBUG UI] Mensaje renderizado exitosamente");
+        return messageDiv;
+    },
+
+    /**
+     * @function updateStreamingMessage
+     * @description Actualiza el contenido de un mensaje en streaming con el texto acumulado
+     * @param {HTMLElement} messageDiv - Elemento creado con createStreamingMessage
+     * @param {string} texto - Texto acumulado de la respuesta
+     */
+    updateStreamingMessage(messageDiv, texto) {
+        try {
+            messageDiv.innerHTML = marked.parse(texto);
+        } catch (error) {
+            messageDiv.textContent = texto;
+        }
+        this.chatContent.scrollTop = this.chatContent.scrollHeight;
+    },
+
+    /**
+     * @function finishStreamingMessage
+     * @description Marca un mensaje en streaming como completo y aplica el resaltado de código
+     * @param {HTMLElement} messageDiv - Elemento creado con createStreamingMessage
+     */
+    async finishStreamingMessage(messageDiv) {
+        messageDiv.classList.remove("streaming");
+        await this.cargarLenguajesDinamicamente();
     },
 
     /**